@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Time running --count "curtin version" commands one after another,
+each in a new "python3 -m curtin" process as subiquity used to and then
+in a CurtinWorker.  An install runs a dozen or so curtin commands, more
+with in-target package installs.
+
+curtin must be importable, e.g. with PYTHONPATH pointing at a curtin
+checkout.  Run it from the top of the tree.
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from subiquity.server.curtin import CurtinWorker
+
+
+class Runner:
+
+    async def start(self, cmd, **opts):
+        return await asyncio.create_subprocess_exec(
+            *cmd, stdout=subprocess.DEVNULL)
+
+    async def wait(self, proc):
+        await proc.wait()
+
+
+async def run_processes(count):
+    for i in range(count):
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, '-m', 'curtin', 'version',
+            stdout=subprocess.DEVNULL)
+        await proc.wait()
+
+
+async def run(opts):
+    start = time.perf_counter()
+    await run_processes(opts.count)
+    processes = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tdir:
+        worker = CurtinWorker(Runner(), os.path.join(tdir, 'socket'))
+        start = time.perf_counter()
+        if not await worker.start():
+            sys.exit("the curtin worker did not start")
+        started = time.perf_counter()
+        for i in range(opts.count):
+            child = await worker.spawn(['version'])
+            await child.wait()
+        done = time.perf_counter()
+        await worker.close()
+        await worker.proc.wait()
+
+    print('{} commands'.format(opts.count))
+    for label, t in [
+            ('new process each', processes),
+            ('worker start', started - start),
+            ('worker commands', done - started),
+            ('worker total', done - start),
+            ]:
+        print(f'{label:<40}{t * 1000:10.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=12)
+    opts = parser.parse_args()
+    asyncio.run(run(opts))
+
+
+if __name__ == '__main__':
+    main()
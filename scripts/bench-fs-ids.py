@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Time building a FilesystemModel for a machine with thousands of
+disks: loading the probe data (load_probe_data, which goes through
+_actions_from_config), and then adding a partition, filesystem and mount
+to every disk, which allocates an id for each new object.
+
+The probe data is made by copying one disk from a machine config in
+examples/ as many times as requested.  Run it from the top of the tree
+with curtin and probert on the path (e.g. PYTHONPATH=.:curtin:probert),
+on two revisions to compare them.
+"""
+
+import argparse
+import json
+import os
+import string
+import time
+
+from subiquity.common.filesystem import gaps
+from subiquity.models.filesystem import FilesystemModel
+
+
+def disk_name(i):
+    # sda, sdb, ..., sdz, sdaa, sdab, ...
+    letters = ''
+    i += 1
+    while i > 0:
+        i, r = divmod(i - 1, 26)
+        letters = string.ascii_lowercase[r] + letters
+    return 'sd' + letters
+
+
+def make_probe_data(machine_config, template, count):
+    with open(machine_config) as fp:
+        storage = json.load(fp)['storage']
+    data = storage['blockdev'][template]
+    name = os.path.basename(template)
+    serial = data.get('ID_SERIAL_SHORT')
+    text = json.dumps(data)
+    blockdev = {}
+    for i in range(count):
+        new_name = disk_name(i)
+        new_text = text.replace(name, new_name)
+        if serial:
+            new_text = new_text.replace(serial, '{}-{}'.format(serial, i))
+        blockdev['/dev/' + new_name] = json.loads(new_text)
+    storage['blockdev'] = blockdev
+    return storage
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    print(f'{label:<40}{(time.perf_counter() - start) * 1000:10.1f} ms')
+    return result
+
+
+def add_mounts(model):
+    for i, disk in enumerate(model._all(type='disk')):
+        gap = gaps.largest_gap(disk)
+        part = model.add_partition(disk, size=gap.size, offset=gap.offset)
+        fs = model.add_filesystem(part, 'ext4')
+        model.add_mount(fs, '/srv/{}'.format(i))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--template', default='/dev/sda')
+    parser.add_argument(
+        'machine_config', nargs='?', default='examples/simple.json')
+    opts = parser.parse_args()
+
+    probe_data = make_probe_data(
+        opts.machine_config, opts.template, opts.count)
+    model = FilesystemModel()
+    timed(
+        'load_probe_data ({} disks)'.format(opts.count),
+        lambda: model.load_probe_data(probe_data))
+    timed(
+        '_actions_from_config',
+        lambda: model._actions_from_config(
+            model._orig_config, probe_data['blockdev'], is_probe_data=True))
+    timed(
+        'add partition, format and mount to each',
+        lambda: add_mounts(model))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Measure how FilesystemModel._render_actions scales with the size of
+the storage configuration.
+
+For each scale, this generates a layout like the ones large RAID/LVM
+autoinstall configs produce: disks with many partitions, a RAID over
+one partition from each disk, a volume group on the RAID with many
+logical volumes, and a filesystem and (nested) mount on every logical
+volume and every remaining partition.  The actions are listed dependents
+first, which is the worst case for a renderer that makes repeated passes.
+
+Run it from the top of the tree with curtin and probert on the path
+(e.g. PYTHONPATH=.:curtin:probert), on two revisions to compare them.
+"""
+
+import argparse
+import time
+
+from subiquity.models.filesystem import (
+    ActionRenderMode,
+    FilesystemModel,
+    )
+
+
+def make_config(scale):
+    disks = max(2, scale // 100)
+    parts_per_disk = scale // disks
+    part_size = 1 << 30
+    config = []
+    blockdevs = {}
+    raid_members = []
+    volumes = []
+    for d in range(disks):
+        path = '/dev/vd{}'.format(d)
+        disk_id = 'disk-{}'.format(d)
+        blockdevs[path] = {
+            'attrs': {'size': str((parts_per_disk + 2) * part_size)},
+            }
+        config.append({
+            'type': 'disk', 'id': disk_id, 'path': path, 'ptable': 'gpt',
+            'serial': 'serial-{}'.format(d),
+            })
+        for p in range(parts_per_disk):
+            part_id = 'part-{}-{}'.format(d, p)
+            config.append({
+                'type': 'partition', 'id': part_id, 'device': disk_id,
+                'number': p + 1, 'size': part_size,
+                'offset': (1 << 20) + p * part_size,
+                })
+            if p == 0:
+                raid_members.append(part_id)
+            else:
+                volumes.append(part_id)
+    config.append({
+        'type': 'raid', 'id': 'md0', 'name': 'md0', 'raidlevel': 'raid0',
+        'devices': raid_members, 'spare_devices': [],
+        })
+    config.append({
+        'type': 'lvm_volgroup', 'id': 'vg0', 'name': 'vg0',
+        'devices': ['md0'],
+        })
+    for lv in range(scale):
+        lv_id = 'lv-{}'.format(lv)
+        config.append({
+            'type': 'lvm_partition', 'id': lv_id, 'name': lv_id,
+            'volgroup': 'vg0', 'size': 1 << 20,
+            })
+        volumes.append(lv_id)
+    for i, volume in enumerate(volumes):
+        fs_id = 'fs-{}'.format(i)
+        config.append({
+            'type': 'format', 'id': fs_id, 'volume': volume, 'fstype': 'ext4',
+            })
+        # Nest the mounts so that most of them have a parent mount.
+        path = '/srv/' + '/'.join(str(i)[:k] for k in range(1, len(str(i))))
+        config.append({
+            'type': 'mount', 'id': 'mount-{}'.format(i), 'device': fs_id,
+            'path': path.rstrip('/') + '/v{}'.format(i),
+            })
+    return config, blockdevs
+
+
+def bench(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        'scales', nargs='*', type=int, default=[250, 500, 1000, 2000, 4000])
+    opts = parser.parse_args()
+
+    for scale in opts.scales:
+        config, blockdevs = make_config(scale)
+        model = FilesystemModel()
+        model._probe_data = {'blockdev': blockdevs}
+        # Dependents first: mounts, then formats, ..., then the disks.
+        model._actions = list(reversed(
+            model._actions_from_config(config, blockdevs)))
+        for mode in ActionRenderMode.DEFAULT, ActionRenderMode.ALL:
+            t = bench(lambda: model._render_actions(mode), opts.repeat)
+            print(f'{len(model._actions):7} actions {mode.name:<8}'
+                  f'{t * 1000:10.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
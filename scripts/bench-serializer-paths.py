@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Microbenchmark for the per-value overhead of the serializer (mostly
+the cost of creating a SerializationContext for every list element, dict
+key and attr field) on the storage data of a machine config.
+
+The blockdev data is always benchmarked.  If curtin is importable, the
+StorageResponse and StorageResponseV2 the server would send for the
+machine are benchmarked too.  Run it on two revisions to compare them.
+"""
+
+import argparse
+import json
+import sys
+import timeit
+from typing import Dict
+
+from subiquity.common.serialize import Serializer
+from subiquity.common.types import (
+    Bootloader,
+    ProbeStatus,
+    StorageResponse,
+    StorageResponseV2,
+    )
+
+
+def payloads(probe_data):
+    yield 'blockdev', Dict[str, dict], probe_data['blockdev']
+    try:
+        from subiquity.common.filesystem import labels
+        from subiquity.models.filesystem import (
+            ActionRenderMode,
+            FilesystemModel,
+            )
+    except ImportError as e:
+        print(f'skipping storage responses: {e}', file=sys.stderr)
+        return
+    model = FilesystemModel(Bootloader.UEFI)
+    model.load_probe_data(probe_data)
+    yield 'StorageResponse', StorageResponse, StorageResponse(
+        status=ProbeStatus.DONE,
+        bootloader=model.bootloader,
+        orig_config=model._orig_config,
+        config=model._render_actions(mode=ActionRenderMode.ALL),
+        blockdev=model._probe_data['blockdev'],
+        dasd=model._probe_data.get('dasd', {}),
+        storage_version=model.storage_version)
+    yield 'StorageResponseV2', StorageResponseV2, StorageResponseV2(
+        status=ProbeStatus.DONE,
+        disks=[labels.for_client(d) for d in model._all(type='disk')],
+        need_root=not model.is_root_mounted(),
+        need_boot=model.needs_bootloader_partition())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=200)
+    parser.add_argument(
+        'machine_config', nargs='?',
+        default='examples/many-nics-and-disks.json')
+    opts = parser.parse_args()
+
+    with open(opts.machine_config) as fp:
+        probe_data = json.load(fp)['storage']
+
+    for name, annotation, value in payloads(probe_data):
+        for mode in 'generic', 'compiled':
+            serializer = Serializer(compiled=mode == 'compiled')
+            best = min(timeit.repeat(
+                lambda: serializer.serialize(annotation, value),
+                number=opts.number, repeat=5)) / opts.number
+            print(f'{name:<18} {mode:<9} {best * 1e6:10.1f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Compare the speed of the generic and compiled modes of
+subiquity.common.serialize.Serializer on the payloads the API actually
+sends: StorageResponse and StorageResponseV2 built from machine configs
+in examples/ and SnapListResponse built from the canned snapd responses
+in examples/snaps.
+
+Run it from the top of the tree with curtin and probert on the path
+(e.g. PYTHONPATH=.:curtin:probert).
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+
+from subiquity.common.serialize import Serializer
+from subiquity.common.types import (
+    ProbeStatus,
+    SnapCheckState,
+    SnapListResponse,
+    StorageResponse,
+    StorageResponseV2,
+    )
+
+
+def snap_payloads(examples):
+    from subiquity.models.snaplist import SnapListModel
+    model = SnapListModel()
+    snapdir = os.path.join(examples, 'snaps')
+    with open(os.path.join(snapdir, 'v2-find-section=server.json')) as fp:
+        model.load_find_data(json.load(fp))
+    for path in sorted(glob.glob(os.path.join(snapdir, 'v2-find-name=*'))):
+        with open(path) as fp:
+            model.load_info_data(json.load(fp))
+    yield 'snaps', SnapListResponse, SnapListResponse(
+        status=SnapCheckState.DONE, snaps=model.get_snap_list())
+
+
+def storage_payloads(machine_config):
+    from subiquity.common.filesystem import labels
+    from subiquity.models.filesystem import (
+        ActionRenderMode,
+        FilesystemModel,
+        )
+    with open(machine_config) as fp:
+        probe_data = json.load(fp)['storage']
+    model = FilesystemModel()
+    model.load_probe_data(probe_data)
+    name = os.path.basename(machine_config)
+    yield name + ' v1', StorageResponse, StorageResponse(
+        status=ProbeStatus.DONE,
+        bootloader=model.bootloader,
+        orig_config=model._orig_config,
+        config=model._render_actions(mode=ActionRenderMode.ALL),
+        blockdev=model._probe_data['blockdev'],
+        dasd=model._probe_data.get('dasd', {}),
+        storage_version=model.storage_version)
+    yield name + ' v2', StorageResponseV2, StorageResponseV2(
+        status=ProbeStatus.DONE,
+        disks=[labels.for_client(d) for d in model._all(type='disk')],
+        need_root=not model.is_root_mounted(),
+        need_boot=model.needs_bootloader_partition())
+
+
+def bench(func, args):
+    # The arguments are consumed one per call because deserializing a
+    # Union pops the '$type' key out of its input.
+    best = None
+    for i in range(5):
+        batch = args()
+        start = time.perf_counter()
+        for arg in batch:
+            func(arg)
+        elapsed = (time.perf_counter() - start) / len(batch)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--examples', default='examples')
+    parser.add_argument('--number', type=int, default=20)
+    parser.add_argument(
+        'machine_configs', nargs='*',
+        default=['examples/many-nics-and-disks.json', 'examples/simple.json'])
+    opts = parser.parse_args()
+
+    payloads = list(snap_payloads(opts.examples))
+    for machine_config in opts.machine_configs:
+        payloads.extend(storage_payloads(machine_config))
+
+    generic = Serializer()
+    compiled = Serializer(compiled=True)
+
+    for name, annotation, value in payloads:
+        serialized = generic.serialize(annotation, value)
+        assert compiled.serialize(annotation, value) == serialized
+        text = json.dumps(serialized)
+        # Some types (e.g. SnapInfo) compare by identity, so compare the
+        # round tripped value in serialized form.
+        assert generic.serialize(
+            annotation, compiled.from_json(annotation, text)) == serialized
+        print(f'{name} ({len(text)} bytes of JSON)')
+
+        def values():
+            return [value] * opts.number
+
+        def copies():
+            return [json.loads(text) for i in range(opts.number)]
+
+        for verb, args in ('serialize', values), ('deserialize', copies):
+            times = {}
+            for label, serializer in (
+                    ('generic', generic), ('compiled', compiled)):
+                meth = getattr(serializer, verb)
+                times[label] = bench(
+                    lambda arg: meth(annotation, arg), args)
+                print(f'  {verb:<12}{label:<9}{times[label]*1000:9.3f} ms')
+            speedup = times['generic'] / times['compiled']
+            print(f'  {verb:<12}speedup  {speedup:9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Time SnapdSnapInfoLoader loading the snap list and the info for
+every snap in it from the dry-run snapd responses in examples/snaps,
+with each request to the fake snapd taking --delay seconds (a store
+round trip is typically a few hundred milliseconds).
+
+Also reports how long the info for the last snap in the list takes to
+arrive when it is asked for as soon as the list is loaded, which is what
+the snap screen does when the user selects a snap.  Run it from the top
+of the tree.
+"""
+
+import argparse
+import asyncio
+import time
+
+from subiquitycore.context import Context
+from subiquitycore.snapd import (
+    AsyncSnapd,
+    get_fake_connection,
+    ThreadedSnapdConnection,
+    )
+
+from subiquity.models.snaplist import SnapListModel
+from subiquity.server.controllers.snaplist import SnapdSnapInfoLoader
+
+
+class App:
+    project = 'bench'
+
+    def report_start_event(self, context, description):
+        pass
+
+    def report_finish_event(self, context, description, status):
+        pass
+
+
+async def run(opts):
+    snapd = AsyncSnapd(ThreadedSnapdConnection(
+        get_fake_connection(scale_factor=1/opts.delay)))
+    model = SnapListModel()
+    loader = SnapdSnapInfoLoader(
+        model, snapd, 'server', Context.new(App()),
+        max_concurrent_fetches=opts.concurrency)
+    start = time.perf_counter()
+    loader.start()
+    await loader.load_list_task_created.wait()
+    await loader.get_snap_list_task()
+    listed = time.perf_counter()
+    last = model.get_snap_list()[-1]
+    await loader.get_snap_info_task(last)
+    requested = time.perf_counter()
+    await loader.main_task
+    done = time.perf_counter()
+    print('{} snaps, {:.3f}s per request, {} at once'.format(
+        len(model.get_snap_list()), opts.delay, opts.concurrency))
+    for label, t in [
+            ('list', listed - start),
+            ('info for {}'.format(last.name), requested - listed),
+            ('all info', done - start),
+            ]:
+        print(f'{label:<40}{t * 1000:10.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--delay', type=float, default=0.2)
+    parser.add_argument('--concurrency', type=int, default=4)
+    opts = parser.parse_args()
+    asyncio.run(run(opts))
+
+
+if __name__ == '__main__':
+    main()
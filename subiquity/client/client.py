@@ -49,8 +49,12 @@ from subiquity.common.types import (
     ApplicationState,
     ErrorReportKind,
     ErrorReportRef,
+    ServerEventKind,
+    )
+from subiquity.journald import (
+    journald_available,
+    journald_listen,
     )
-from subiquity.journald import journald_listen
 from subiquity.server.server import POSTINSTALL_MODEL_NAMES
 from subiquity.ui.frame import SubiquityUI
 from subiquity.ui.views.error import ErrorReportStretchy
@@ -235,10 +239,16 @@ class SubiquityClient(TuiApplication):
             answer = await run_in_thread(input)
         await self.confirm_install()
 
-    async def _status_get(self, cur=None):
+    async def server_events(self):
+        """Yield the events the server sends, reconnecting if the
+        connection fails."""
+        last_seq = stream_id = None
         while True:
             try:
-                return await self.client.meta.status.GET(cur=cur)
+                async for event in self.client.meta.events.GET(
+                        after=last_seq, stream_id=stream_id):
+                    last_seq, stream_id = event.seq, event.stream_id
+                    yield event
             except aiohttp.ClientError:
                 try:
                     fp = open(self.state_path("server-state"))
@@ -249,12 +259,16 @@ class SubiquityClient(TuiApplication):
                         state = getattr(ApplicationState, fp.read(), None)
                     if state == ApplicationState.EXITED:
                         self.exit()
-                await asyncio.sleep(1)
+            await asyncio.sleep(1)
 
-    async def noninteractive_watch_app_state(self, initial_status):
-        app_status = initial_status
+    async def status_changes(self):
+        async for event in self.server_events():
+            if event.kind == ServerEventKind.STATUS:
+                yield event.status
+
+    async def noninteractive_watch_app_state(self):
         confirm_task = None
-        while True:
+        async for app_status in self.status_changes():
             app_state = app_status.state
             if app_state == ApplicationState.NEEDS_CONFIRMATION:
                 if confirm_task is None:
@@ -268,13 +282,16 @@ class SubiquityClient(TuiApplication):
                 print("An error occurred. Press enter to start a shell")
                 await run_in_thread(input)
                 os.execvp("/bin/bash", ["/bin/bash"])
-            app_status = await self._status_get(app_state)
 
     def subiquity_event_noninteractive(self, event):
-        if event['SUBIQUITY_EVENT_TYPE'] == 'start':
-            print('start: ' + event["MESSAGE"])
-        elif event['SUBIQUITY_EVENT_TYPE'] == 'finish':
-            print('finish: ' + event["MESSAGE"])
+        if event.kind == ServerEventKind.CONTEXT_START:
+            print('start: ' + event.message)
+        elif event.kind == ServerEventKind.CONTEXT_FINISH:
+            print('finish: ' + event.message)
+
+    async def noninteractive_watch_events(self):
+        async for event in self.server_events():
+            self.subiquity_event_noninteractive(event)
 
     async def connect(self):
 
@@ -296,21 +313,28 @@ class SubiquityClient(TuiApplication):
                 spinner.cancel()
                 p('\x08 \n')
 
-        status = await spinning_wait("connecting", self._status_get())
-        journald_listen(
-            self.aio_loop,
-            [status.echo_syslog_id],
-            lambda e: print(e['MESSAGE']))
-        if status.state == ApplicationState.STARTING_UP:
-            status = await spinning_wait(
-                "starting up", self._status_get(cur=status.state))
-        if status.state == ApplicationState.CLOUD_INIT_WAIT:
-            status = await spinning_wait(
-                "waiting for cloud-init", self._status_get(cur=status.state))
-        if status.state == ApplicationState.EARLY_COMMANDS:
-            print("running early commands")
-            status = await self._status_get(cur=status.state)
-            await asyncio.sleep(0.5)
+        statuses = self.status_changes()
+        try:
+            status = await spinning_wait("connecting", statuses.__anext__())
+            if journald_available():
+                journald_listen(
+                    self.aio_loop,
+                    [status.echo_syslog_id],
+                    lambda e: print(e['MESSAGE']),
+                    this_boot=True, fields=('MESSAGE',))
+            while status.state == ApplicationState.STARTING_UP:
+                status = await spinning_wait(
+                    "starting up", statuses.__anext__())
+            while status.state == ApplicationState.CLOUD_INIT_WAIT:
+                status = await spinning_wait(
+                    "waiting for cloud-init", statuses.__anext__())
+            if status.state == ApplicationState.EARLY_COMMANDS:
+                print("running early commands")
+                while status.state == ApplicationState.EARLY_COMMANDS:
+                    status = await statuses.__anext__()
+                await asyncio.sleep(0.5)
+        finally:
+            await statuses.aclose()
         return status
 
     async def start(self):
@@ -352,18 +376,6 @@ class SubiquityClient(TuiApplication):
                     self.load_controllers(controllers)
 
             await super().start()
-            # Progress uses systemd to collect and display the installation
-            # logs. Although some system don't have systemd, so we disable
-            # the progress page
-            if hasattr(self.controllers, "Progress"):
-                journald_listen(
-                    self.aio_loop,
-                    [status.event_syslog_id],
-                    self.controllers.Progress.event)
-                journald_listen(
-                    self.aio_loop,
-                    [status.log_syslog_id],
-                    self.controllers.Progress.log_line)
             if not status.cloud_init_ok:
                 self.add_global_overlay(CloudInitFail(self))
             self.error_reporter.load_reports()
@@ -381,13 +393,8 @@ class SubiquityClient(TuiApplication):
                 # for a non-interactive one we need to clear things up or the
                 # prompting for confirmation will be confusing.
                 os.system('stty sane')
-            journald_listen(
-                self.aio_loop,
-                [status.event_syslog_id],
-                self.subiquity_event_noninteractive,
-                seek=True)
-            asyncio.create_task(
-                self.noninteractive_watch_app_state(status))
+            asyncio.create_task(self.noninteractive_watch_events())
+            asyncio.create_task(self.noninteractive_watch_app_state())
 
     def _exception_handler(self, loop, context):
         exc = context.get('exception')
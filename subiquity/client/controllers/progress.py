@@ -23,6 +23,7 @@ from subiquitycore.context import with_context
 from subiquity.client.controller import SubiquityTuiController
 from subiquity.common.types import (
     ApplicationState,
+    ServerEventKind,
     ShutdownMode,
     )
 from subiquity.ui.views.installprogress import (
@@ -39,23 +40,22 @@ class ProgressController(SubiquityTuiController):
     def __init__(self, app):
         super().__init__(app)
         self.progress_view = ProgressView(self)
+        self.app_status = None
         self.app_state = None
         self.crash_report_ref = None
+        self.install_running = None
         self.answers = app.answers.get("InstallProgress", {})
 
     def event(self, event):
-        if event["SUBIQUITY_EVENT_TYPE"] == "start":
+        if event.kind == ServerEventKind.STATUS:
+            self.status_changed(event.status)
+        elif event.kind == ServerEventKind.CONTEXT_START:
             self.progress_view.event_start(
-                event["SUBIQUITY_CONTEXT_ID"],
-                event.get("SUBIQUITY_CONTEXT_PARENT_ID"),
-                event["MESSAGE"])
-        elif event["SUBIQUITY_EVENT_TYPE"] == "finish":
-            self.progress_view.event_finish(
-                event["SUBIQUITY_CONTEXT_ID"])
-
-    def log_line(self, event):
-        log_line = event['MESSAGE']
-        self.progress_view.add_log_line(log_line)
+                event.context_id, event.context_parent_id, event.message)
+        elif event.kind == ServerEventKind.CONTEXT_FINISH:
+            self.progress_view.event_finish(event.context_id)
+        elif event.kind == ServerEventKind.LOG:
+            self.progress_view.add_log_line(event.message)
 
     def cancel(self):
         pass
@@ -75,43 +75,45 @@ class ProgressController(SubiquityTuiController):
 
     @with_context()
     async def _wait_status(self, context):
-        install_running = None
-        while True:
-            try:
-                app_status = await self.app.client.meta.status.GET(
-                    cur=self.app_state)
-            except aiohttp.ClientError:
-                await asyncio.sleep(1)
-                continue
-            self.app_state = app_status.state
-
-            self.progress_view.update_for_state(self.app_state)
-            if self.ui.body is self.progress_view:
-                self.ui.set_header(self.progress_view.title)
-
-            if app_status.error is not None:
-                if self.crash_report_ref is None:
-                    self.crash_report_ref = app_status.error
-                    self.ui.set_body(self.progress_view)
-                    self.app.show_error_report(self.crash_report_ref)
-
-            if self.app_state == ApplicationState.NEEDS_CONFIRMATION:
-                if self.showing:
-                    self.app.show_confirm_install()
-
-            if self.app_state == ApplicationState.RUNNING:
-                if app_status.confirming_tty != self.app.our_tty:
-                    install_running = InstallRunning(
+        async for event in self.app.server_events():
+            self.event(event)
+
+    def status_changed(self, app_status):
+        # The current status is sent again whenever the event stream is
+        # reconnected.
+        if app_status == self.app_status:
+            return
+        self.app_status = app_status
+        self.app_state = app_status.state
+
+        self.progress_view.update_for_state(self.app_state)
+        if self.ui.body is self.progress_view:
+            self.ui.set_header(self.progress_view.title)
+
+        if app_status.error is not None:
+            if self.crash_report_ref is None:
+                self.crash_report_ref = app_status.error
+                self.ui.set_body(self.progress_view)
+                self.app.show_error_report(self.crash_report_ref)
+
+        if self.app_state == ApplicationState.NEEDS_CONFIRMATION:
+            if self.showing:
+                self.app.show_confirm_install()
+
+        if self.app_state == ApplicationState.RUNNING:
+            if app_status.confirming_tty != self.app.our_tty:
+                if self.install_running is None:
+                    self.install_running = InstallRunning(
                         self.app, app_status.confirming_tty)
-                    self.app.add_global_overlay(install_running)
-            else:
-                if install_running is not None:
-                    self.app.remove_global_overlay(install_running)
-                    install_running = None
-
-            if self.app_state == ApplicationState.DONE:
-                if self.answers.get('reboot', False):
-                    self.click_reboot()
+                    self.app.add_global_overlay(self.install_running)
+        else:
+            if self.install_running is not None:
+                self.app.remove_global_overlay(self.install_running)
+                self.install_running = None
+
+        if self.app_state == ApplicationState.DONE:
+            if self.answers.get('reboot', False):
+                self.click_reboot()
 
     def make_ui(self):
         if self.app_state == ApplicationState.NEEDS_CONFIRMATION:
@@ -97,6 +97,11 @@ def make_server_args_parser():
         '--snap-section', action='store', default='server',
         help=("Show snaps from this section of the store in the snap "
               "list screen."))
+    parser.add_argument(
+        '--snap-cache-ttl', action='store', type=int, default=3600,
+        help=("Use the snap list and info saved in the state directory "
+              "without asking the store for this many seconds.  0 disables "
+              "the cache."))
     parser.add_argument(
         '--source-catalog', dest='source_catalog', action='store')
     parser.add_argument(
@@ -107,6 +112,29 @@ def make_server_args_parser():
         '--storage-version', action='store', type=int)
     parser.add_argument(
         '--use-os-prober', action='store_true', default=False)
+    parser.add_argument(
+        '--no-journal-events', action='store_false', dest='journal_events',
+        default=True,
+        help=("Do not copy progress events to the journal (clients get "
+              "them from the API either way)"))
+    parser.add_argument(
+        '--no-curtin-worker', action='store_false', dest='curtin_worker',
+        default=True,
+        help=("Start a new process for each curtin command instead of "
+              "forking them from a process that has already imported "
+              "curtin"))
+    parser.add_argument(
+        '--parallel-extract', action='store_true',
+        help=("Copy the install source into the target with several "
+              "threads instead of running curtin's extract stage"))
+    parser.add_argument(
+        '--extract-threads', action='store', type=int, default=0,
+        help=("The number of threads --parallel-extract uses.  0 picks a "
+              "number from the number of CPUs."))
+    parser.add_argument(
+        '--verify-extract', action='store_true',
+        help=("With --parallel-extract, read back each file after copying "
+              "it and check it matches the source"))
     parser.add_argument(
         '--postinst-hooks-dir', default='/etc/subiquity/postinst.d',
         type=pathlib.Path)
@@ -18,8 +18,9 @@ import inspect
 
 import aiohttp
 
+from subiquity.common import jsoncodec
 from subiquity.common.serialize import Serializer
-from .defs import Payload
+from .defs import Payload, Stream
 
 
 def _wrap(make_request, path, meth, serializer, serialize_query_args):
@@ -32,7 +33,7 @@ def _wrap(make_request, path, meth, serializer, serialize_query_args):
             payload_ann = param.annotation.__args__[0]
     r_ann = sig.return_annotation
 
-    async def impl(self, *args, **kw):
+    def make_args(self, args, kw):
         args = sig.bind(*args, **kw)
         query_args = {}
         data = None
@@ -44,11 +45,30 @@ def _wrap(make_request, path, meth, serializer, serialize_query_args):
                     value = serializer.to_json(
                         meth_params[arg_name].annotation, value)
                 query_args[arg_name] = value
+        return path.format(**self.path_args), data, query_args
+
+    if getattr(r_ann, '__origin__', None) is Stream:
+        stream_ann = r_ann.__args__[0]
+
+        async def stream_impl(self, *args, **kw):
+            path, data, query_args = make_args(self, args, kw)
+            async with make_request(
+                    meth.__name__, path,
+                    json=data, params=query_args) as resp:
+                resp.raise_for_status()
+                async for line in resp.content:
+                    yield serializer.from_json(
+                        stream_ann, line.decode('utf-8'))
+        return stream_impl
+
+    async def impl(self, *args, **kw):
+        path, data, query_args = make_args(self, args, kw)
         async with make_request(
-                meth.__name__, path.format(**self.path_args),
+                meth.__name__, path,
                 json=data, params=query_args) as resp:
             resp.raise_for_status()
-            return serializer.deserialize(r_ann, await resp.json())
+            return serializer.deserialize(
+                r_ann, await resp.json(loads=jsoncodec.loads))
     return impl
 
 
@@ -71,7 +91,7 @@ def client_init(self, path_args=None):
 
 def make_client_cls(endpoint_cls, make_request, serializer=None):
     if serializer is None:
-        serializer = Serializer()
+        serializer = Serializer(compiled=True)
 
     ns = {'__init__': client_init}
 
@@ -92,14 +112,72 @@ def make_client(endpoint_cls, make_request, serializer=None, path_args=None):
     return make_client_cls(endpoint_cls, make_request, serializer)(path_args)
 
 
+class _CachedResponse:
+    """A response whose body has already been read (or was revalidated
+    with a 304 from a cached copy)."""
+
+    def __init__(self, response, text):
+        self._response = response
+        self._text = text
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def raise_for_status(self):
+        if self._response.status != 304:
+            self._response.raise_for_status()
+
+    async def text(self):
+        return self._text
+
+    async def json(self, loads=jsoncodec.loads):
+        return loads(self._text)
+
+
+def with_etag_cache(make_request):
+    """Wrap make_request so that the last response to each GET that came
+    with an ETag is kept and revalidated with If-None-Match."""
+    cache = {}
+
+    @contextlib.asynccontextmanager
+    async def cached_make_request(method, path, *, params, json):
+        if method != 'GET':
+            async with make_request(
+                    method, path, params=params, json=json) as resp:
+                yield resp
+            return
+        key = (path, tuple(sorted(params.items())))
+        cached = cache.get(key)
+        headers = {}
+        if cached is not None:
+            headers['If-None-Match'] = cached[0]
+        async with make_request(
+                method, path, params=params, json=json,
+                headers=headers) as resp:
+            if resp.status == 304 and cached is not None:
+                yield _CachedResponse(resp, cached[1])
+                return
+            etag = resp.headers.get('ETag')
+            if resp.status != 200 or etag is None:
+                cache.pop(key, None)
+                yield resp
+                return
+            text = await resp.text()
+            cache[key] = (etag, text)
+            yield _CachedResponse(resp, text)
+
+    return cached_make_request
+
+
 def make_client_for_conn(
         endpoint_cls, conn, resp_hook=lambda r: r, serializer=None,
         header_func=None):
     session = aiohttp.ClientSession(
-        connector=conn, connector_owner=False)
+        connector=conn, connector_owner=False,
+        json_serialize=jsoncodec.dumps)
 
     @contextlib.asynccontextmanager
-    async def make_request(method, path, *, params, json):
+    async def make_request(method, path, *, params, json, headers=None):
         # session.request needs a full URL with scheme and host even though
         # that's in some ways a bit silly with a unix socket, so we just
         # hardcode something here (I guess the "a" gets sent along to the
@@ -107,12 +185,11 @@ def make_client_for_conn(
         # something like virtual host based selection but well....)
         url = 'http://a' + path
         if header_func is not None:
-            headers = header_func()
-        else:
-            headers = None
+            headers = {**(header_func() or {}), **(headers or {})}
         async with session.request(
                 method, url, json=json, params=params,
                 headers=headers, timeout=0) as response:
             yield resp_hook(response)
 
-    return make_client(endpoint_cls, make_request, serializer)
+    return make_client(
+        endpoint_cls, with_etag_cache(make_request), serializer)
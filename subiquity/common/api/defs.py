@@ -89,6 +89,15 @@ class Payload(typing.Generic[T]):
     pass
 
 
+class Stream(typing.Generic[T]):
+    """Return annotation for an endpoint that sends a sequence of values.
+
+    The implementation is an async generator.  Each value it yields is
+    sent to the client as a line of JSON as soon as it is produced and
+    the client method returns an async iterator over the values.
+    """
+
+
 def path_parameter(cls):
     cls.__parameter__ = True
     return cls
@@ -19,9 +19,10 @@ import traceback
 
 from aiohttp import web
 
+from subiquity.common import jsoncodec
 from subiquity.common.serialize import Serializer
 
-from .defs import Payload
+from .defs import Payload, Stream
 
 
 class BindError(Exception):
@@ -57,12 +58,49 @@ def trim(text):
         return text
 
 
+# Included in every ETag so that tags handed out by a previous server
+# process are never mistaken for current ones.
+_etag_prefix = os.urandom(4).hex()
+
+
+def with_etag(etag_func):
+    """Mark a GET implementation as cacheable.
+
+    etag_func is called with the controller before the implementation
+    and should return a token that changes whenever the response would
+    (typically built from model generation counters), or None if the
+    response cannot be cached right now.  If the client already has the
+    response for the current token, the implementation is not called and
+    the server responds with 304 Not Modified.
+    """
+    def decorator(meth):
+        meth.__etag_func__ = etag_func
+        return meth
+    return decorator
+
+
+def _if_none_match(request):
+    header = request.headers.get('If-None-Match')
+    if header is None:
+        return ()
+    return [tag.strip() for tag in header.split(',')]
+
+
+async def _json_lines(serializer, annotation, values):
+    async for value in values:
+        yield (serializer.to_json(annotation, value) + '\n').encode('utf-8')
+
+
 def _make_handler(controller, definition, implementation, serializer,
                   serialize_query_args):
     def_sig = inspect.signature(definition)
     def_ret_ann = def_sig.return_annotation
     def_params = def_sig.parameters
 
+    stream_annotation = None
+    if getattr(def_ret_ann, '__origin__', None) is Stream:
+        stream_annotation = def_ret_ann.__args__[0]
+
     impl_sig = inspect.signature(implementation)
     impl_params = impl_sig.parameters
 
@@ -105,6 +143,8 @@ def _make_handler(controller, definition, implementation, serializer,
         raise SignatureMisatchError(
             definition.__qualname__, check_def_sig, check_impl_sig)
 
+    etag_func = getattr(implementation, '__etag_func__', None)
+
     async def handler(request):
         context = controller.context.child(implementation.__name__)
         with context:
@@ -131,10 +171,29 @@ def _make_handler(controller, definition, implementation, serializer,
                     args['context'] = context
                 if 'request' in impl_params:
                     args['request'] = request
-                result = await implementation(**args)
-                resp = web.json_response(
-                    serializer.serialize(def_ret_ann, result),
-                    headers={'x-status': 'ok'})
+                headers = {'x-status': 'ok'}
+                etag = None
+                if etag_func is not None:
+                    token = etag_func(controller)
+                    if token is not None:
+                        etag = headers['ETag'] = f'"{_etag_prefix}-{token}"'
+                if etag is not None and etag in _if_none_match(request):
+                    resp = web.Response(status=304, headers=headers)
+                elif stream_annotation is not None:
+                    # The body is written by aiohttp after the handler
+                    # (and any middleware) has returned, one line of JSON
+                    # per value the implementation yields.
+                    resp = web.Response(
+                        body=_json_lines(
+                            serializer, stream_annotation,
+                            implementation(**args)),
+                        headers=headers,
+                        content_type='application/x-ndjson')
+                else:
+                    result = await implementation(**args)
+                    resp = web.json_response(
+                        serializer.serialize(def_ret_ann, result),
+                        headers=headers, dumps=jsoncodec.dumps)
             except Exception as exc:
                 tb = traceback.TracebackException.from_exception(exc)
                 resp = web.Response(
@@ -146,7 +205,11 @@ def _make_handler(controller, definition, implementation, serializer,
                         'x-error-msg': str(exc),
                         })
                 resp['exception'] = exc
-            context.description = '{} {}'.format(resp.status, trim(resp.text))
+            if stream_annotation is not None and resp.status == 200:
+                text = '<stream>'
+            else:
+                text = trim(resp.text)
+            context.description = '{} {}'.format(resp.status, text)
             return resp
     handler.controller = controller
 
@@ -160,7 +223,7 @@ async def controller_for_request(request):
 
 def bind(router, endpoint, controller, serializer=None, _depth=None):
     if serializer is None:
-        serializer = Serializer()
+        serializer = Serializer(compiled=True)
     if _depth is None:
         _depth = len(endpoint.fullname)
 
@@ -41,7 +41,7 @@ class FakeResponse:
     def raise_for_status(self):
         pass
 
-    async def json(self):
+    async def json(self, loads=None):
         return self.data
 
 
@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import attr
 import contextlib
 import functools
@@ -21,14 +22,17 @@ import unittest
 import aiohttp
 from aiohttp import web
 
-from subiquity.common.api.client import make_client
+from subiquity.common.api.client import make_client, with_etag_cache
 from subiquity.common.api.defs import (
     api,
     MultiplePathParameters,
     path_parameter,
     Payload,
+    Stream,
     )
 
+from subiquity.common.api.server import with_etag
+
 from .test_server import (
     makeTestClient,
     ControllerBase,
@@ -271,3 +275,85 @@ class TestEndToEnd(unittest.IsolatedAsyncioTestCase):
             self.assertEqual(r, 3)
             with self.assertRaises(Abort):
                 await client.bad.GET(2)
+
+    async def test_etag_cache(self):
+        @api
+        class API:
+            def GET(x: int) -> int: ...
+            def POST(x: int) -> None: ...
+
+        class Impl(ControllerBase):
+            generation = 0
+            calls = 0
+
+            @with_etag(lambda self: self.generation)
+            async def GET(self, x: int) -> int:
+                self.calls += 1
+                return x + self.generation
+
+            async def POST(self, x: int) -> None:
+                self.generation += x
+
+        def etag_make_request(client, method, path, *, params, json,
+                              headers=None):
+            return client.request(
+                method, path, params=params, json=json, headers=headers)
+
+        impl = Impl()
+        async with makeTestClient(API, impl) as client:
+            mr = with_etag_cache(functools.partial(etag_make_request, client))
+            client = make_client(API, mr)
+            self.assertEqual(await client.GET(1), 1)
+            self.assertEqual(await client.GET(1), 1)
+            self.assertEqual(impl.calls, 1)
+            self.assertEqual(await client.GET(2), 2)
+            self.assertEqual(impl.calls, 2)
+            await client.POST(3)
+            self.assertEqual(await client.GET(1), 4)
+            self.assertEqual(await client.GET(1), 4)
+            self.assertEqual(impl.calls, 3)
+
+    async def test_stream(self):
+        @attr.s(auto_attribs=True)
+        class Point:
+            x: int
+            label: str
+
+        @api
+        class API:
+            def GET(start: int) -> Stream[Point]: ...
+
+        class Impl(ControllerBase):
+            async def GET(self, start: int) -> Stream[Point]:
+                for i in range(start, start + 3):
+                    yield Point(x=i, label=f'line\n{i}')
+
+        async with makeE2EClient(API, Impl()) as client:
+            points = [p async for p in client.GET(2)]
+            self.assertEqual(points, [
+                Point(x=2, label='line\n2'),
+                Point(x=3, label='line\n3'),
+                Point(x=4, label='line\n4'),
+                ])
+
+    async def test_stream_incremental(self):
+        @api
+        class API:
+            def GET() -> Stream[int]: ...
+
+        queue = asyncio.Queue()
+
+        class Impl(ControllerBase):
+            async def GET(self) -> Stream[int]:
+                while (v := await queue.get()) is not None:
+                    yield v
+
+        async with makeE2EClient(API, Impl()) as client:
+            values = client.GET()
+            queue.put_nowait(1)
+            self.assertEqual(await values.__anext__(), 1)
+            queue.put_nowait(2)
+            self.assertEqual(await values.__anext__(), 2)
+            queue.put_nowait(None)
+            with self.assertRaises(StopAsyncIteration):
+                await values.__anext__()
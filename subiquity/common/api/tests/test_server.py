@@ -27,6 +27,7 @@ from subiquity.common.api.server import (
     controller_for_request,
     MissingImplementationError,
     SignatureMisatchError,
+    with_etag,
     )
 
 
@@ -279,3 +280,50 @@ class TestBind(unittest.IsolatedAsyncioTestCase):
         async with makeTestClient(API, Impl()) as client:
             await self.assertResponse(
                 client.get('/value?arg=2'), 'value2')
+
+    async def test_etag(self):
+        @api
+        class API:
+            def GET() -> str: ...
+
+        class Impl(ControllerBase):
+            generation = 0
+            calls = 0
+
+            @with_etag(lambda self: self.generation)
+            async def GET(self) -> str:
+                self.calls += 1
+                return 'value'
+
+        impl = Impl()
+        async with makeTestClient(API, impl) as client:
+            resp = await client.get('/')
+            self.assertEqual(resp.status, 200)
+            etag = resp.headers['ETag']
+
+            resp = await client.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status, 304)
+            self.assertEqual(resp.headers['ETag'], etag)
+            self.assertEqual(impl.calls, 1)
+
+            impl.generation += 1
+            resp = await client.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status, 200)
+            self.assertEqual(await resp.json(), 'value')
+            self.assertNotEqual(resp.headers['ETag'], etag)
+            self.assertEqual(impl.calls, 2)
+
+    async def test_etag_none(self):
+        @api
+        class API:
+            def GET() -> str: ...
+
+        class Impl(ControllerBase):
+            @with_etag(lambda self: None)
+            async def GET(self) -> str:
+                return 'value'
+
+        async with makeTestClient(API, Impl()) as client:
+            resp = await client.get('/', headers={'If-None-Match': '*'})
+            self.assertEqual(resp.status, 200)
+            self.assertNotIn('ETag', resp.headers)
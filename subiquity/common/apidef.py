@@ -23,7 +23,12 @@ from subiquitycore.models.network import (
     WLANConfig,
     )
 
-from subiquity.common.api.defs import api, Payload, simple_endpoint
+from subiquity.common.api.defs import (
+    api,
+    Payload,
+    simple_endpoint,
+    Stream,
+    )
 from subiquity.common.types import (
     AddPartitionV2,
     AnyStep,
@@ -49,6 +54,7 @@ from subiquity.common.types import (
     DriversPayload,
     SnapInfo,
     SnapListResponse,
+    ServerEvent,
     SnapSelection,
     SourceSelectionAndSetting,
     SSHData,
@@ -87,6 +93,17 @@ class API:
               -> ApplicationStatus:
                 """Get the installer state."""
 
+        class events:
+            def GET(after: Optional[int] = None,
+                    stream_id: Optional[str] = None) -> Stream[ServerEvent]:
+                """Stream status changes, context events and log lines.
+
+                The current status is sent first, then the events with a
+                seq greater than after (or all the events the server still
+                has if after is not given or stream_id is not the id of
+                the server's current stream) and then new events as they
+                happen."""
+
         class mark_configured:
             def POST(endpoint_names: List[str]) -> None:
                 """Mark the controllers for endpoint_names as configured."""
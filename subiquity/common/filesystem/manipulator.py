@@ -136,9 +136,10 @@ class FilesystemManipulator:
         for lv in list(vg.partitions()):
             self.delete_logical_volume(lv)
         for d in vg.devices:
-            d.wipe = 'superblock'
             if d.type == "dm_crypt":
                 self.model.remove_dm_crypt(d)
+            else:
+                d.wipe = 'superblock'
         self.model.remove_volgroup(vg)
     delete_lvm_volgroup = delete_volgroup
 
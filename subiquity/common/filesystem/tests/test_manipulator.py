@@ -92,6 +92,22 @@ class TestFilesystemManipulator(unittest.TestCase):
             a for a in manipulator.model._actions if a.type == 'dm_crypt']
         self.assertEqual(dm_crypts, [])
 
+    def test_delete_vg_with_encrypted_and_plain_pvs(self):
+        manipulator, disk = make_manipulator_and_disk()
+        part = make_partition(manipulator.model, disk)
+        encrypted = manipulator.model.add_dm_crypt(part, 'passw0rd')
+        plain = make_disk(manipulator.model)
+        vg = manipulator.model.add_volgroup(
+            name='vg0', devices={encrypted, plain})
+        manipulator.create_logical_volume(vg, {'name': 'lv0', 'size': MiB})
+        manipulator.delete_volgroup(vg)
+        self.assertEqual(
+            [a for a in manipulator.model._actions
+             if a.type in ('dm_crypt', 'lvm_volgroup', 'lvm_partition')],
+            [])
+        self.assertEqual(plain.wipe, 'superblock')
+        self.assertIsNone(part._constructed_device)
+
     def test_wipe_existing_fs(self):
         # LP: #1983036 - edit a partition to wipe it and mount it, but not
         # actually change the fs type already there
@@ -103,7 +119,7 @@ class TestFilesystemManipulator(unittest.TestCase):
         manipulator.model._actions.append(fs)
         manipulator.delete_filesystem(fs)
         spec = {'wipe': 'random'}
-        with mock.patch.object(p, 'original_fstype') as original_fstype:
+        with mock.patch.object(type(p), 'original_fstype') as original_fstype:
             original_fstype.return_value = 'ext2'
             fs = manipulator.create_filesystem(p, spec)
         self.assertTrue(p.preserve)
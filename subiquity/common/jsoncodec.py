@@ -0,0 +1,127 @@
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" The JSON codec used by the API server and client and by
+Serializer.to_json/from_json.
+
+Probe data and storage responses can be many megabytes, so this uses
+orjson or ujson if either is installed and falls back to the standard
+library's json module otherwise.  Both dumps and loads deal in str.
+"""
+
+import json
+import re
+from typing import Any, Callable
+
+import attr
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class JSONCodec:
+    name: str
+    dumps: Callable[[Any], str]
+    loads: Callable[[str], Any]
+
+
+def _make_json():
+    return JSONCodec('json', json.dumps, json.loads)
+
+
+# A number that might not fit in 64 bits has at least 19 digits.
+_long_number = re.compile(r'\d{19}')
+
+
+def _make_orjson():
+    import orjson
+
+    opts = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+        try:
+            return orjson.dumps(obj, option=opts).decode('utf-8')
+        except TypeError:
+            # orjson refuses some things the json module accepts, such as
+            # integers that do not fit in 64 bits.
+            return json.dumps(obj)
+
+    def loads(s):
+        # orjson parses integers that do not fit in 64 bits as floats,
+        # losing precision.  Checking for a long run of digits is much
+        # cheaper than looking for such floats in the result; the run is
+        # usually in a string and the json module parses that the same.
+        if _long_number.search(s):
+            return json.loads(s)
+        return orjson.loads(s)
+
+    return JSONCodec('orjson', dumps, loads)
+
+
+def _make_ujson():
+    import ujson
+
+    def dumps(obj):
+        try:
+            return ujson.dumps(obj, escape_forward_slashes=False)
+        except OverflowError:
+            return json.dumps(obj)
+
+    def loads(s):
+        try:
+            return ujson.loads(s)
+        except ValueError:
+            # Integers that do not fit in 64 bits again (or bad JSON, in
+            # which case the json module raises a ValueError too).
+            return json.loads(s)
+
+    return JSONCodec('ujson', dumps, loads)
+
+
+_codec_makers = {
+    'orjson': _make_orjson,
+    'ujson': _make_ujson,
+    'json': _make_json,
+    }
+
+
+def make_codec(name):
+    """Return the codec called name, raising ImportError if the module it
+    needs is not installed."""
+    return _codec_makers[name]()
+
+
+def find_codec(preferred=('orjson', 'ujson', 'json')):
+    """Return the first codec from preferred that is available."""
+    for name in preferred:
+        try:
+            return make_codec(name)
+        except ImportError:
+            continue
+    return _make_json()
+
+
+codec = find_codec()
+
+
+def set_codec(new_codec):
+    global codec
+    codec = new_codec
+
+
+def dumps(obj):
+    return codec.dumps(obj)
+
+
+def loads(s):
+    return codec.loads(s)
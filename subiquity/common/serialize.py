@@ -15,12 +15,14 @@
 
 import datetime
 import enum
-import json
+import functools
 import inspect
 import typing
 
 import attr
 
+from subiquity.common import jsoncodec
+
 
 def named_field(name, default=attr.NOTHING):
     return attr.ib(metadata={'name': name}, default=default)
@@ -30,6 +32,10 @@ def _field_name(field):
     return field.metadata.get('name', field.name)
 
 
+def _cur(context):
+    return context.cur
+
+
 class SerializationError(Exception):
     def __init__(self, obj, path, message):
         self.obj = obj
@@ -43,23 +49,46 @@ class SerializationError(Exception):
         return f"processing {self.obj}: at {p}, {self.message}"
 
 
-@attr.s(auto_attribs=True)
+_NO_KEY = object()
+
+
+@attr.s(auto_attribs=True, slots=True)
 class SerializationContext:
     obj: typing.Any
     cur: typing.Any
-    path: str
+    # The path to cur is only needed if an error is raised, so rather than
+    # building it up for every value visited, each context records its
+    # parent and the step from the parent to it (segment, which is a format
+    # string to be filled in with key if key is not _NO_KEY) and the path
+    # is only computed when asked for.
+    parent: typing.Optional['SerializationContext']
+    segment: str
+    key: typing.Any
     metadata: typing.Optional[typing.Dict]
     serializing: bool
 
     @classmethod
     def new(cls, obj, *, serializing):
-        return SerializationContext(obj, obj, '', {}, serializing)
+        return SerializationContext(
+            obj, obj, None, '', _NO_KEY, {}, serializing)
 
-    def child(self, path, cur, metadata=None):
+    def child(self, path, cur, metadata=None, *, key=_NO_KEY):
         if metadata is None:
             metadata = self.metadata
-        return attr.evolve(
-            self, path=self.path + path, cur=cur, metadata=metadata)
+        return SerializationContext(
+            self.obj, cur, self, path, key, metadata, self.serializing)
+
+    @property
+    def path(self):
+        segments = []
+        context = self
+        while context is not None:
+            if context.key is _NO_KEY:
+                segments.append(context.segment)
+            else:
+                segments.append(context.segment.format(context.key))
+            context = context.parent
+        return ''.join(reversed(segments))
 
     def error(self, message):
         raise SerializationError(self.obj, self.path, message)
@@ -76,7 +105,7 @@ class SerializationContext:
 class Serializer:
 
     def __init__(self, *, compact=False, ignore_unknown_fields=False,
-                 serialize_enums_by="name"):
+                 serialize_enums_by="name", compiled=False):
         self.compact = compact
         self.ignore_unknown_fields = ignore_unknown_fields
         assert serialize_enums_by in ("value", "name")
@@ -97,6 +126,20 @@ class Serializer:
         self.type_deserializers[dict] = self._scalar
         self.type_serializers[datetime.datetime] = self._serialize_datetime
         self.type_deserializers[datetime.datetime] = self._deserialize_datetime
+        # If compiled is True, the first time an annotation is seen a
+        # converter specialized for that annotation is built and cached
+        # (see _compile below) rather than walking the annotation on
+        # every call.
+        self.compiled = compiled
+        self._compiled_serializers = {}
+        self._compiled_deserializers = {}
+        self.compile_walkers = {
+            typing.Union: self._compile_Union,
+            list: self._compile_List,
+            typing.List: self._compile_List,
+            dict: self._compile_Dict,
+            typing.Dict: self._compile_Dict,
+            }
 
     def _scalar(self, annotation, context):
         context.assert_type(annotation)
@@ -135,7 +178,7 @@ class Serializer:
 
     def _walk_List(self, meth, args, context):
         return [
-            meth(args[0], context.child(f'[{i}]', v))
+            meth(args[0], context.child('[{}]', v, key=i))
             for i, v in enumerate(context.cur)
             ]
 
@@ -146,8 +189,8 @@ class Serializer:
         else:
             input_items = context.cur.items()
         output_items = [[
-            meth(k_ann, context.child(f'/{k}', k)),
-            meth(v_ann, context.child(f'[{k}]', v))
+            meth(k_ann, context.child('/{}', k, key=k)),
+            meth(v_ann, context.child('[{}]', v, key=k))
             ] for k, v in input_items]
         if context.serializing and k_ann is not str:
             return output_items
@@ -156,7 +199,7 @@ class Serializer:
     def _serialize_dict(self, annotation, context):
         context.assert_type(annotation)
         for k in context.cur:
-            context.child(f'/{k}', k).assert_type(str)
+            context.child('/{}', k, key=k).assert_type(str)
         return context.cur
 
     def _serialize_datetime(self, annotation, context):
@@ -175,9 +218,10 @@ class Serializer:
                 self._serialize(
                     field.type,
                     context.child(
-                        f'.{field.name}',
+                        '.{}',
                         getattr(context.cur, field.name),
-                        field.metadata)),
+                        field.metadata,
+                        key=field.name)),
                 ))
         if self.compact:
             return [s[1] for s in serialized]
@@ -211,6 +255,8 @@ class Serializer:
 
     def serialize(self, annotation, value):
         context = SerializationContext.new(value, serializing=True)
+        if self.compiled:
+            return self._compile(annotation, True)(context)
         return self._serialize(annotation, context)
 
     def _deserialize_datetime(self, annotation, context):
@@ -226,7 +272,8 @@ class Serializer:
             for field, value in zip(attr.fields(annotation), context.cur):
                 args.append(self._deserialize(
                     field.type,
-                    context.child(f'[{field.name!r}]', value, field.metadata)))
+                    context.child(
+                        '[{!r}]', value, field.metadata, key=field.name)))
             return annotation(*args)
         else:
             context.assert_type(dict)
@@ -246,7 +293,7 @@ class Serializer:
                 field = fields[key]
                 args[field.name] = self._deserialize(
                     field.type,
-                    context.child(f'[{key!r}]', value, field.metadata))
+                    context.child('[{!r}]', value, field.metadata, key=key))
             return annotation(**args)
 
     def _deserialize_enum(self, annotation, context):
@@ -273,15 +320,237 @@ class Serializer:
 
     def deserialize(self, annotation, value):
         context = SerializationContext.new(value, serializing=False)
+        if self.compiled:
+            return self._compile(annotation, False)(context)
         return self._deserialize(annotation, context)
 
+    # The _compile* methods mirror the _serialize*/_deserialize* methods
+    # above: the converter returned for an annotation must behave exactly
+    # as calling _serialize or _deserialize with that annotation would,
+    # including raising the same errors with the same paths.
+
+    def _compile(self, annotation, serializing):
+        if serializing:
+            cache = self._compiled_serializers
+        else:
+            cache = self._compiled_deserializers
+        converter = cache.get(annotation)
+        if converter is not None:
+            return converter
+
+        # An attr class can (indirectly) contain fields of its own type,
+        # so put a stub that forwards to the real converter in the cache
+        # while compiling.
+        def forward(context):
+            return converter(context)
+
+        cache[annotation] = forward
+        try:
+            converter = self._compile_annotation(annotation, serializing)
+        except Exception:
+            del cache[annotation]
+            raise
+        cache[annotation] = converter
+        return converter
+
+    def _compile_annotation(self, annotation, serializing):
+        if annotation is None:
+            def conv_none(context):
+                context.assert_type(type(None))
+                return None
+            return conv_none
+        if annotation is inspect.Signature.empty or annotation is typing.Any:
+            return _cur
+        if attr.has(annotation):
+            if serializing:
+                return self._compile_serialize_attr(annotation)
+            else:
+                return self._compile_deserialize_attr(annotation)
+        origin = getattr(annotation, '__origin__', None)
+        if origin is not None:
+            if origin in self.compile_walkers:
+                return self.compile_walkers[origin](
+                    annotation.__args__, serializing)
+        elif isinstance(annotation, type) and issubclass(annotation,
+                                                         enum.Enum):
+            if serializing:
+                return self._compile_serialize_enum(annotation)
+            else:
+                return self._compile_deserialize_enum(annotation)
+        elif serializing and annotation in self.type_serializers:
+            return functools.partial(
+                self.type_serializers[annotation], annotation)
+        elif not serializing and annotation in self.type_deserializers:
+            return functools.partial(
+                self.type_deserializers[annotation], annotation)
+        # Anything we do not know how to specialize (including annotations
+        # that are errors) is handled by the generic code when called.
+        if serializing:
+            return functools.partial(self._serialize, annotation)
+        else:
+            return functools.partial(self._deserialize, annotation)
+
+    def _compile_Union(self, args, serializing):
+        NoneType = type(None)
+        if NoneType in args:
+            args = [a for a in args if a is not NoneType]
+            if len(args) == 1:
+                # I.e. Optional[thing]
+                conv = self._compile(args[0], serializing)
+
+                def conv_optional(context):
+                    if context.cur is None:
+                        return context.cur
+                    return conv(context)
+                return conv_optional
+        if not all(attr.has(a) for a in args):
+            def conv_error(context):
+                raise context.error(f"cannot serialize Union[{args}]")
+            return conv_error
+        convs = [(a, self._compile(a, serializing)) for a in args]
+        if serializing:
+            compact = self.compact
+
+            def serialize_union(context):
+                for a, conv in convs:
+                    if isinstance(context.cur, a):
+                        r = conv(context)
+                        if compact:
+                            r.insert(0, a.__name__)
+                        else:
+                            r['$type'] = a.__name__
+                        return r
+                context.error(f"type of {context.cur} not found in {args}")
+            return serialize_union
+        else:
+            by_name = {}
+            for a, conv in convs:
+                by_name.setdefault(a.__name__, conv)
+            compact = self.compact
+
+            def deserialize_union(context):
+                if compact:
+                    n = context.cur.pop(0)
+                else:
+                    n = context.cur.pop('$type')
+                conv = by_name.get(n)
+                if conv is None:
+                    context.error(f"type {n} not found in {args}")
+                return conv(context)
+            return deserialize_union
+
+    def _compile_List(self, args, serializing):
+        conv = self._compile(args[0], serializing)
+
+        def conv_list(context):
+            return [
+                conv(context.child('[{}]', v, key=i))
+                for i, v in enumerate(context.cur)
+                ]
+        return conv_list
+
+    def _compile_Dict(self, args, serializing):
+        k_ann, v_ann = args
+        k_conv = self._compile(k_ann, serializing)
+        v_conv = self._compile(v_ann, serializing)
+        str_keys = k_ann is str
+
+        def conv_dict(context):
+            if not serializing and not str_keys:
+                input_items = context.cur
+            else:
+                input_items = context.cur.items()
+            output_items = [[
+                k_conv(context.child('/{}', k, key=k)),
+                v_conv(context.child('[{}]', v, key=k))
+                ] for k, v in input_items]
+            if serializing and not str_keys:
+                return output_items
+            return dict(output_items)
+        return conv_dict
+
+    def _compile_serialize_attr(self, annotation):
+        fields = [
+            (field.name, _field_name(field), f'.{field.name}',
+             field.metadata, self._compile(field.type, True))
+            for field in attr.fields(annotation)
+            ]
+        if self.compact:
+            def serialize_attr_compact(context):
+                cur = context.cur
+                return [
+                    conv(context.child(path, getattr(cur, name), metadata))
+                    for name, _, path, metadata, conv in fields
+                    ]
+            return serialize_attr_compact
+        else:
+            def serialize_attr(context):
+                cur = context.cur
+                return {
+                    key: conv(
+                        context.child(path, getattr(cur, name), metadata))
+                    for name, key, path, metadata, conv in fields
+                    }
+            return serialize_attr
+
+    def _compile_deserialize_attr(self, annotation):
+        if self.compact:
+            fields = [
+                (f'[{field.name!r}]', field.metadata,
+                 self._compile(field.type, False))
+                for field in attr.fields(annotation)
+                ]
+
+            def deserialize_attr_compact(context):
+                context.assert_type(list)
+                return annotation(*[
+                    conv(context.child(path, value, metadata))
+                    for (path, metadata, conv), value in zip(
+                        fields, context.cur)
+                    ])
+            return deserialize_attr_compact
+        else:
+            fields = {
+                _field_name(field): (
+                    field.name, f'[{_field_name(field)!r}]', field.metadata,
+                    self._compile(field.type, False))
+                for field in attr.fields(annotation)
+                }
+            ignore_unknown_fields = self.ignore_unknown_fields
+
+            def deserialize_attr(context):
+                context.assert_type(dict)
+                args = {}
+                for key, value in context.cur.items():
+                    field = fields.get(key)
+                    if field is None:
+                        # See the comment in _deserialize_attr.
+                        if key == '$type' or ignore_unknown_fields:
+                            continue
+                        raise KeyError(key)
+                    name, path, metadata, conv = field
+                    args[name] = conv(context.child(path, value, metadata))
+                return annotation(**args)
+            return deserialize_attr
+
+    def _compile_serialize_enum(self, annotation):
+        by = self.serialize_enums_by
+
+        def serialize_enum(context):
+            context.assert_type(annotation)
+            return getattr(context.cur, by)
+        return serialize_enum
+
+    def _compile_deserialize_enum(self, annotation):
+        return functools.partial(self._deserialize_enum, annotation)
+
     def to_json(self, annotation, value):
-        return json.dumps(self.serialize(annotation, value))
+        return jsoncodec.dumps(self.serialize(annotation, value))
 
     def from_json(self, annotation, value):
-        return self.deserialize(annotation, json.loads(value))
+        return self.deserialize(annotation, jsoncodec.loads(value))
 
 
-_serializer = Serializer()
+_serializer = Serializer(compiled=True)
 to_json = _serializer.to_json
 from_json = _serializer.from_json
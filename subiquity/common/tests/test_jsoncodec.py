@@ -0,0 +1,86 @@
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import unittest
+from unittest import mock
+
+from subiquity.common import jsoncodec
+
+
+def available_codecs():
+    for name in 'json', 'orjson', 'ujson':
+        try:
+            yield jsoncodec.make_codec(name)
+        except ImportError:
+            pass
+
+
+class TestJSONCodec(unittest.TestCase):
+
+    def test_roundtrip(self):
+        value = {
+            'str': 'a/b é',
+            'int': 2**63 - 1,
+            'float': 1.5,
+            'list': [None, True, False],
+            'dict': {'a': {}},
+            }
+        for codec in available_codecs():
+            with self.subTest(codec=codec.name):
+                encoded = codec.dumps(value)
+                self.assertIsInstance(encoded, str)
+                self.assertEqual(json.loads(encoded), value)
+                self.assertEqual(codec.loads(encoded), value)
+
+    def test_same_as_json(self):
+        values = [{1: 'a'}, 2**70, [-2**70]]
+        for codec in available_codecs():
+            with self.subTest(codec=codec.name):
+                for value in values:
+                    self.assertEqual(
+                        json.loads(codec.dumps(value)),
+                        json.loads(json.dumps(value)))
+
+    def test_loads_big_ints(self):
+        value = [2**64, -2**63 - 1, 2**64 - 1, 10**100, '1' * 30, 0.5]
+        encoded = json.dumps(value)
+        for codec in available_codecs():
+            with self.subTest(codec=codec.name):
+                loaded = codec.loads(encoded)
+                self.assertEqual(loaded, value)
+                self.assertEqual(
+                    [type(v) for v in loaded], [type(v) for v in value])
+
+    def test_loads_invalid(self):
+        for codec in available_codecs():
+            with self.subTest(codec=codec.name):
+                with self.assertRaises(ValueError):
+                    codec.loads('{"a": 12345678901234567890')
+                with self.assertRaises(ValueError):
+                    codec.loads('{')
+
+    def test_find_codec_falls_back(self):
+        with mock.patch.dict(
+                'sys.modules', {'orjson': None, 'ujson': None}):
+            self.assertEqual(jsoncodec.find_codec().name, 'json')
+
+    def test_set_codec(self):
+        orig = jsoncodec.codec
+        self.addCleanup(jsoncodec.set_codec, orig)
+        codec = jsoncodec.JSONCodec('fake', lambda o: 'dumped', lambda s: 1)
+        jsoncodec.set_codec(codec)
+        self.assertEqual(jsoncodec.dumps({}), 'dumped')
+        self.assertEqual(jsoncodec.loads('{}'), 1)
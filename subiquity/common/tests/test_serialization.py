@@ -141,7 +141,8 @@ class CommonSerializerTests:
 
     def test_enums_by_value(self):
         self.serializer = type(self.serializer)(
-            compact=self.serializer.compact, serialize_enums_by="value")
+            compact=self.serializer.compact, serialize_enums_by="value",
+            compiled=self.serializer.compiled)
         self.assertSerialization(MyEnum, MyEnum.name, "value")
 
     def test_serialize_any(self):
@@ -268,6 +269,50 @@ class TestSerializer(CommonSerializerTests, unittest.TestCase):
             self.serializer.deserialize(Type, {'field-1': 1, 'field2': 2})
         self.assertEqual(catcher.exception.path, "['field-1']")
 
+    def test_error_path_in_list(self):
+        with self.assertRaises(SerializationError) as catcher:
+            self.serializer.serialize(
+                Container, Container(Data('a', 1), [Data('b', 2), Data(3, 4)]))
+        self.assertEqual(catcher.exception.path, '.data_list[1].field1')
+
+    def test_error_path_in_dict(self):
+        with self.assertRaises(SerializationError) as catcher:
+            self.serializer.serialize(
+                typing.Dict[str, Data], {'a': Data('b', 2), 'c': Data(3, 4)})
+        self.assertEqual(catcher.exception.path, '[c].field1')
+        with self.assertRaises(SerializationError) as catcher:
+            self.serializer.serialize(dict, {'a': 1, 2: 3})
+        self.assertEqual(catcher.exception.path, '/2')
+
+
+class TestCompiledSerializer(TestSerializer):
+
+    serializer = Serializer(compiled=True)
+
+    def test_recursive(self):
+
+        @attr.s(auto_attribs=True)
+        class Tree:
+            value: int
+            children: typing.List['Tree']
+
+        attr.resolve_types(Tree, localns={'Tree': Tree})
+
+        self.assertSerialization(
+            Tree,
+            Tree(1, [Tree(2, []), Tree(3, [Tree(4, [])])]),
+            {'value': 1, 'children': [
+                {'value': 2, 'children': []},
+                {'value': 3, 'children': [{'value': 4, 'children': []}]},
+                ]})
+
+    def test_compiled_once(self):
+        serializer = Serializer(compiled=True)
+        serializer.serialize(Container, Container.make_random())
+        conv = serializer._compiled_serializers[Container]
+        serializer.serialize(Container, Container.make_random())
+        self.assertIs(serializer._compiled_serializers[Container], conv)
+
 
 class TestCompactSerializer(CommonSerializerTests, unittest.TestCase):
 
@@ -294,6 +339,11 @@ class TestCompactSerializer(CommonSerializerTests, unittest.TestCase):
         self.assertSerialization(typing.Union[Data, Container], data, expected)
 
 
+class TestCompiledCompactSerializer(TestCompactSerializer):
+
+    serializer = Serializer(compact=True, compiled=True)
+
+
 class TestOptionalAndDefault(CommonSerializerTests, unittest.TestCase):
 
     serializer = Serializer()
@@ -381,3 +431,8 @@ class TestOptionalAndDefault(CommonSerializerTests, unittest.TestCase):
 
         with self.assertRaises(KeyError):
             self.serializer.deserialize(OptionalAndDefault, data)
+
+
+class TestCompiledOptionalAndDefault(TestOptionalAndDefault):
+
+    serializer = Serializer(compiled=True)
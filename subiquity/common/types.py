@@ -96,6 +96,33 @@ class ApplicationStatus:
     event_syslog_id: str
 
 
+class ServerEventKind(enum.Enum):
+    STATUS = enum.auto()
+    CONTEXT_START = enum.auto()
+    CONTEXT_FINISH = enum.auto()
+    LOG = enum.auto()
+
+
+@attr.s(auto_attribs=True)
+class ServerEvent:
+    """ Something that happened in the server, as sent by meta.events.
+
+    seq increases by one for each event the server sends and can be
+    passed back to meta.events, along with stream_id, to resume after a
+    lost connection. stream_id changes when the server restarts.
+    STATUS events carry the new status, CONTEXT_START and CONTEXT_FINISH
+    events the context ids and (for starts) a message describing the
+    context and LOG events a line of output from a command the server
+    ran. """
+    seq: int
+    kind: ServerEventKind
+    stream_id: str
+    status: Optional[ApplicationStatus] = None
+    context_id: Optional[str] = None
+    context_parent_id: Optional[str] = None
+    message: Optional[str] = None
+
+
 class PasswordKind(enum.Enum):
     NONE = enum.auto()
     KNOWN = enum.auto()
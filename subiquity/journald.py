@@ -13,37 +13,166 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
 import contextlib
+import logging
+import os
 
-from systemd import journal
+try:
+    from systemd import journal
+except ImportError:
+    journal = None
 
 
-def journald_listen(loop, identifiers, callback, seek=False):
+log = logging.getLogger('subiquity.journald')
+
+JOURNAL_SOCKET = '/run/systemd/journal/socket'
+
+
+def journald_available():
+    """Whether there is a journal to send entries to and read them from.
+
+    Containers frequently run without journald (or without the python
+    bindings for it), in which case the journal is simply not used."""
+    return journal is not None and os.path.exists(JOURNAL_SOCKET)
+
+
+class JournalListener:
+    """Pass the entries a journal reader returns to callback as they are
+    added to the journal, without hogging the event loop.
+
+    A burst of thousands of entries (as curtin produces while installing
+    packages) is read as soon as the journal says there are new entries
+    but handed to callback at most batch_size at a time, and for at most
+    time_slice seconds, before yielding to the loop.  backlog is the
+    number of entries read but not yet dispatched and max_backlog the
+    largest it has been.
+
+    If fields is passed, only those fields are read from each entry.
+    """
+
+    def __init__(self, loop, reader, callback, *, fields=None,
+                 batch_size=100, time_slice=0.01):
+        self.loop = loop
+        self.reader = reader
+        self.callback = callback
+        self.fields = fields
+        self.batch_size = batch_size
+        self.time_slice = time_slice
+        self.max_backlog = 0
+        self._pending = collections.deque()
+        self._dispatch_handle = None
+        self._reported_backlog = batch_size
+        loop.add_reader(reader.fileno(), self._watch)
+
+    @property
+    def backlog(self):
+        return len(self._pending)
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def close(self):
+        self.loop.remove_reader(self.reader.fileno())
+        if self._dispatch_handle is not None:
+            self._dispatch_handle.cancel()
+            self._dispatch_handle = None
+        self._pending.clear()
+
+    def _read_entry(self):
+        """Return the next entry, or None if there are no more.
+
+        Reading only some fields relies on the private methods of
+        systemd.journal.Reader that get_next() is built on.  If they are
+        not there, the whole entry is read and the other fields dropped.
+        """
+        reader = self.reader
+        if self.fields is not None:
+            try:
+                next_entry = reader._next
+                get_field = reader._get
+                convert_field = reader._convert_field
+            except AttributeError:
+                pass
+            else:
+                if not next_entry():
+                    return None
+                entry = {}
+                for field in self.fields:
+                    try:
+                        value = get_field(field)
+                    except KeyError:
+                        continue
+                    entry[field] = convert_field(field, value)
+                return entry
+        # get_next() returns an empty dict at the end of the journal; a
+        # real entry always has at least the fields journald adds.
+        entry = reader.get_next()
+        if not entry:
+            return None
+        if self.fields is not None:
+            entry = {
+                field: entry[field]
+                for field in self.fields
+                if field in entry
+                }
+        return entry
+
+    def _watch(self):
+        if self.reader.process() != journal.APPEND:
+            return
+        while True:
+            entry = self._read_entry()
+            if entry is None:
+                break
+            self._pending.append(entry)
+        backlog = self.backlog
+        if backlog > self.max_backlog:
+            self.max_backlog = backlog
+        if backlog >= 2 * self._reported_backlog:
+            self._reported_backlog = backlog
+            log.debug("%s journal entries waiting to be handled", backlog)
+        if self._dispatch_handle is None:
+            self._dispatch()
+
+    def _dispatch(self):
+        self._dispatch_handle = None
+        deadline = self.loop.time() + self.time_slice
+        try:
+            for _ in range(self.batch_size):
+                if not self._pending:
+                    break
+                self.callback(self._pending.popleft())
+                if self.loop.time() >= deadline:
+                    break
+        finally:
+            if self._pending:
+                self._dispatch_handle = self.loop.call_soon(self._dispatch)
+
+
+def journald_listen(loop, identifiers, callback, seek=False, *,
+                    this_boot=False, fields=None, **kw):
     reader = journal.Reader()
     args = []
     for identifier in identifiers:
         args.append("SYSLOG_IDENTIFIER={}".format(identifier))
     reader.add_match(*args)
+    if this_boot:
+        reader.this_boot()
 
     if seek:
         reader.seek_tail()
 
-    def watch():
-        if reader.process() != journal.APPEND:
-            return
-        for event in reader:
-            callback(event)
-    loop.add_reader(reader.fileno(), watch)
-    return reader.fileno()
+    return JournalListener(loop, reader, callback, fields=fields, **kw)
 
 
 @contextlib.contextmanager
 def journald_subscriptions(loop, ids_callbacks, seek=False):
-    fds = set()
+    listeners = []
     for id, callback in ids_callbacks:
-        fds.add(journald_listen(loop, [id], callback, seek=seek))
+        listeners.append(journald_listen(loop, [id], callback, seek=seek))
     try:
         yield
     finally:
-        for fd in fds:
-            loop.remove_reader(fd)
+        for listener in listeners:
+            listener.close()
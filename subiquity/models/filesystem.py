@@ -15,10 +15,12 @@
 
 from abc import ABC, abstractmethod
 import attr
+import bisect
 import collections
 import copy
 import enum
 import fnmatch
+import heapq
 import itertools
 import logging
 import math
@@ -51,14 +53,19 @@ class NotFinalPartitionError(Exception):
 def _set_backlinks(obj):
     if obj.id is None:
         base = obj.type
-        i = 0
+        # Ids are never freed, so every id for this type with a lower
+        # index than the one recorded in _next_id_index has been taken
+        # and there is no need to check those again.
+        i = obj._m._next_id_index.get(base, 0)
         while True:
             val = "%s-%s" % (base, i)
             if val not in obj._m._all_ids:
                 break
             i += 1
+        obj._m._next_id_index[base] = i + 1
         obj.id = val
     obj._m._all_ids.add(obj.id)
+    obj._m.generation += 1
     for field in attr.fields(type(obj)):
         backlink = field.metadata.get('backlink')
         if backlink is None:
@@ -140,7 +147,10 @@ def fsobj(typ):
         c.type = attributes.const(typ)
         c.id = attr.ib(default=None)
         c._m = attr.ib(repr=None, default=None)
-        c = attr.s(eq=False, repr=False)(c)
+        # There can be a lot of these objects, so do not give each one a
+        # __dict__. attr.s(slots=True) returns a new class, which is the
+        # one that must be registered below.
+        c = attr.s(eq=False, repr=False, slots=True)(c)
         c.__repr__ = fsobj__repr
         _type_to_cls[typ] = c
         return c
@@ -447,7 +457,7 @@ def asdict(inst):
 # in the FilesystemModel or FilesystemController classes.
 
 
-@attr.s(eq=False)
+@attr.s(eq=False, slots=True)
 class _Formattable(ABC):
     # Base class for anything that can be formatted and mounted,
     # e.g. a disk or a RAID or a partition.
@@ -509,7 +519,7 @@ class _Formattable(ABC):
 GPT_OVERHEAD = 2 * (1 << 20)
 
 
-@attr.s(eq=False)
+@attr.s(eq=False, slots=True)
 class _Device(_Formattable, ABC):
     # Anything that can have partitions, e.g. a disk or a RAID.
 
@@ -1058,6 +1068,135 @@ class ActionRenderMode(enum.Enum):
     FORMAT_MOUNT = enum.auto()
 
 
+class _PartitionEmitOrder:
+    # Tracks which partitions of a device can be rendered: a partition
+    # has to come after all the partitions with a lower number.
+
+    def __init__(self, partitions):
+        self._parts = sorted(partitions, key=lambda p: p.number)
+        self._numbers = [p.number for p in self._parts]
+        self._emitted = set()
+        # self._parts[:self._prefix] have all been emitted.
+        self._prefix = 0
+        self._waiters = collections.defaultdict(list)
+
+    def _need(self, part):
+        return bisect.bisect_left(self._numbers, part.number)
+
+    def can_emit(self, part):
+        need = self._need(part)
+        if need <= self._prefix:
+            return True
+        self._waiters[need].append(part)
+        return False
+
+    def emitted(self, part):
+        """Record that part has been emitted and return the partitions
+        that can now be emitted."""
+        self._emitted.add(part.id)
+        old_prefix = self._prefix
+        while self._prefix < len(self._parts) and \
+                self._parts[self._prefix].id in self._emitted:
+            self._prefix += 1
+        woken = []
+        for need in range(old_prefix + 1, self._prefix + 1):
+            woken.extend(self._waiters.pop(need, []))
+        return woken
+
+
+class _ActionList(list):
+    # The actions of a FilesystemModel, indexed by id and by type so that
+    # _one and _all do not have to look at every action. Nearly all
+    # changes to the list are appends and removes, which keep the indexes
+    # up to date; any other change just drops them, to be rebuilt by the
+    # next lookup. (Attributes such as path can change after an action is
+    # added, so they are not indexed.)
+
+    def __init__(self, actions=()):
+        super().__init__(actions)
+        self._by_id = None
+        self._by_type = None
+
+    def _invalidate(self):
+        self._by_id = None
+        self._by_type = None
+
+    def _ensure_indexes(self):
+        if self._by_id is not None:
+            return
+        self._by_id = collections.defaultdict(list)
+        self._by_type = collections.defaultdict(list)
+        for action in self:
+            self._by_id[action.id].append(action)
+            self._by_type[action.type].append(action)
+
+    def with_id(self, id):
+        self._ensure_indexes()
+        return self._by_id.get(id, ())
+
+    def with_type(self, type):
+        self._ensure_indexes()
+        return self._by_type.get(type, ())
+
+    def append(self, action):
+        super().append(action)
+        if self._by_id is not None:
+            self._by_id[action.id].append(action)
+            self._by_type[action.type].append(action)
+
+    def remove(self, action):
+        super().remove(action)
+        if self._by_id is not None:
+            self._by_id[action.id].remove(action)
+            self._by_type[action.type].remove(action)
+
+    def extend(self, actions):
+        self._invalidate()
+        super().extend(actions)
+
+    def insert(self, index, action):
+        self._invalidate()
+        super().insert(index, action)
+
+    def pop(self, index=-1):
+        self._invalidate()
+        return super().pop(index)
+
+    def clear(self):
+        self._invalidate()
+        super().clear()
+
+    def sort(self, **kw):
+        self._invalidate()
+        super().sort(**kw)
+
+    def reverse(self):
+        self._invalidate()
+        super().reverse()
+
+    def __setitem__(self, index, value):
+        self._invalidate()
+        super().__setitem__(index, value)
+
+    def __delitem__(self, index):
+        self._invalidate()
+        super().__delitem__(index)
+
+    def __iadd__(self, actions):
+        self._invalidate()
+        return super().__iadd__(actions)
+
+    def __imul__(self, n):
+        self._invalidate()
+        return super().__imul__(n)
+
+    def __copy__(self):
+        return _ActionList(self)
+
+    def __deepcopy__(self, memo):
+        return _ActionList(copy.deepcopy(list(self), memo))
+
+
 class FilesystemModel(object):
 
     target = None
@@ -1111,13 +1250,19 @@ class FilesystemModel(object):
         self.bootloader = bootloader
         self.storage_version = 1
         self._probe_data = None
+        # Incremented whenever the model changes, so that a client can
+        # cheaply tell whether anything has changed since it last looked.
+        self.generation = 0
         self.reset()
 
     def reset(self):
+        self.generation += 1
         self._all_ids = set()
+        self._next_id_index = {}
         if self._probe_data is not None:
-            self._orig_config = storage_config.extract_storage_config(
-                self._probe_data)["storage"]["config"]
+            # _orig_config was extracted from the probe data once, in
+            # load_probe_data, so this does not have to walk the probe data
+            # again.
             self._actions = self._actions_from_config(
                 self._orig_config,
                 self._probe_data['blockdev'],
@@ -1134,14 +1279,22 @@ class FilesystemModel(object):
         # the original state.  _orig_config plays a similar role, but is
         # expressed in terms of curtin actions, which are not what we want to
         # use on the V2 storage API.
+        #
+        # Each call returns a new model that the caller is free to modify.
+        # It is built from the _orig_config extracted in load_probe_data,
+        # so the probe data is not walked again.
         orig_model = FilesystemModel(self.bootloader)
         orig_model.target = self.target
-        orig_model.load_probe_data(self._probe_data)
+        orig_model._probe_data = self._probe_data
+        orig_model._orig_config = self._orig_config
+        orig_model.reset()
         return orig_model
 
     def load_server_data(self, status):
         log.debug('load_server_data %s', status)
+        self.generation += 1
         self._all_ids = set()
+        self._next_id_index = {}
         self.storage_version = status.storage_version
         self._orig_config = status.orig_config
         self._probe_data = {
@@ -1274,6 +1427,7 @@ class FilesystemModel(object):
                 disks.remove(disk)
                 action['path'] = disk.path
                 action['serial'] = disk.serial
+        self.generation += 1
         self._actions = self._actions_from_config(
             ai_config, self._probe_data['blockdev'], is_probe_data=False)
 
@@ -1407,42 +1561,89 @@ class FilesystemModel(object):
     def _render_actions(self,
                         mode: ActionRenderMode = ActionRenderMode.DEFAULT):
         # The curtin storage config has the constraint that an action must be
-        # preceded by all the things that it depends on.  We handle this by
-        # repeatedly iterating over all actions and checking if we can emit
-        # each action by checking if all of the actions it depends on have been
-        # emitted.  Eventually this will either emit all actions or stop making
-        # progress -- which means there is a cycle in the definitions,
-        # something the UI should have prevented <wink>.
+        # preceded by all the things that it depends on.  We handle this with
+        # a topological sort (Kahn's algorithm): an action that cannot be
+        # emitted yet is parked until the action it is waiting for has been
+        # emitted, rather than being re-checked over and over.  If we run out
+        # of actions to examine before emitting everything there is a cycle
+        # in the definitions, something the UI should have prevented <wink>.
+        #
+        # The order of the output is significant (and tested), and is that of
+        # the obvious algorithm: make repeated passes over a work list,
+        # emitting whatever can be emitted and deferring everything else to
+        # the next pass.  The ready queue is therefore ordered by (pass,
+        # position in the work list).  Dependencies that were not in the work
+        # list (e.g. preserved devices when not rendering everything) are
+        # added to the next pass just before the action that needed them,
+        # which is what the key for the position of an action encodes.
         r = []
         emitted_ids = set()
-
-        def emit(obj):
+        queued_ids = set()
+        queue = []
+        keys = {}
+        pulled_counts = {}
+        waiters = collections.defaultdict(list)
+        dep_lists = {}
+        dep_indexes = {}
+        partition_orders = {}
+
+        def emit(obj, pass_):
             if isinstance(obj, Raid):
                 log.debug(
                     "FilesystemModel: estimated size of %s %s is %s",
                     obj.raidlevel, obj.name, obj.size)
             r.append(asdict(obj))
             emitted_ids.add(obj.id)
+            woken = waiters.pop(obj.id, [])
+            if obj.type == "partition":
+                woken.extend(partition_orders[obj.device.id].emitted(obj))
+            key = keys[obj.id]
+            for waiter in woken:
+                waiter_key = keys[waiter.id]
+                if waiter_key > key:
+                    enqueue(waiter, pass_, waiter_key)
+                else:
+                    enqueue(waiter, pass_ + 1, waiter_key)
+
+        def enqueue(obj, pass_, key):
+            queued_ids.add(obj.id)
+            keys[obj.id] = key
+            heapq.heappush(queue, (pass_, key, obj))
 
-        def ensure_partitions(dev):
+        def pull_in(obj, puller, pass_):
+            n = pulled_counts[puller.id] = pulled_counts.get(puller.id, 0) + 1
+            enqueue(obj, pass_ + 1, keys[puller.id][:-1] + (0, n, 1))
+
+        def ensure_partitions(dev, puller, pass_):
             for part in dev.partitions():
-                if part.id not in emitted_ids:
-                    if part not in work and part not in next_work:
-                        next_work.append(part)
+                if part.id not in queued_ids:
+                    pull_in(part, puller, pass_)
 
-        def can_emit(obj):
+        def can_emit(obj, pass_):
             if obj.type == "partition":
-                ensure_partitions(obj.device)
-                for p in obj.device.partitions():
-                    if p.number < obj.number and p.id not in emitted_ids:
-                        return False
-            for dep in dependencies(obj):
+                ensure_partitions(obj.device, obj, pass_)
+                order = partition_orders.get(obj.device.id)
+                if order is None:
+                    order = partition_orders[obj.device.id] = \
+                        _PartitionEmitOrder(obj.device.partitions())
+                if not order.can_emit(obj):
+                    return False
+            deps = dep_lists.get(obj.id)
+            if deps is None:
+                deps = dep_lists[obj.id] = list(dependencies(obj))
+            i = dep_indexes.get(obj.id, 0)
+            while i < len(deps):
+                dep = deps[i]
                 if dep.id not in emitted_ids:
-                    if dep not in work and dep not in next_work:
-                        next_work.append(dep)
+                    dep_indexes[obj.id] = i
+                    if dep.id not in queued_ids:
+                        pull_in(dep, obj, pass_)
                         if dep.type in ['disk', 'raid']:
-                            ensure_partitions(dep)
+                            ensure_partitions(dep, obj, pass_)
+                    waiters[dep.id].append(obj)
                     return False
+                i += 1
+            dep_indexes[obj.id] = i
             if isinstance(obj, Mount):
                 # Any mount actions for a parent of this one have to be emitted
                 # first.
@@ -1453,6 +1654,7 @@ class FilesystemModel(object):
                             log.debug(
                                 "cannot emit action to mount %s until that "
                                 "for %s is emitted", obj.path, parent)
+                            waiters[mountpoints[parent]].append(obj)
                             return False
             return True
 
@@ -1465,20 +1667,22 @@ class FilesystemModel(object):
             work = [
                 a for a in self._actions if not getattr(a, 'preserve', False)
             ]
-
-        while work:
-            next_work = []
-            for obj in work:
-                if can_emit(obj):
-                    emit(obj)
-                else:
-                    next_work.append(obj)
-            if {a.id for a in next_work} == {a.id for a in work}:
-                msg = ["rendering block devices made no progress processing:"]
-                for w in work:
-                    msg.append(" - " + str(w))
-                raise Exception("\n".join(msg))
-            work = next_work
+        for i, obj in enumerate(work):
+            enqueue(obj, 1, (i, 1))
+
+        while queue:
+            pass_, key, obj = heapq.heappop(queue)
+            if can_emit(obj, pass_):
+                emit(obj, pass_)
+
+        if len(emitted_ids) < len(queued_ids):
+            stuck = sorted(
+                (keys[a.id], a) for a in self._actions
+                if a.id in queued_ids and a.id not in emitted_ids)
+            msg = ["rendering block devices made no progress processing:"]
+            for _key, w in stuck:
+                msg.append(" - " + str(w))
+            raise Exception("\n".join(msg))
 
         if mode == ActionRenderMode.DEVICES:
             r = [act for act in r if act['type'] not in ('format', 'mount')]
@@ -1533,10 +1737,28 @@ class FilesystemModel(object):
                 "computing size on unformatted dasd from %s as %s", data, size)
             devdata['attrs']['size'] = str(size)
         self._probe_data = probe_data
+        self._orig_config = storage_config.extract_storage_config(
+            probe_data)["storage"]["config"]
         self.reset()
 
+    @property
+    def _actions(self):
+        return self._action_list
+
+    @_actions.setter
+    def _actions(self, actions):
+        if not isinstance(actions, _ActionList):
+            actions = _ActionList(actions)
+        self._action_list = actions
+
     def _matcher(self, kw):
-        for a in self._actions:
+        if 'id' in kw:
+            candidates = self._actions.with_id(kw['id'])
+        elif 'type' in kw:
+            candidates = self._actions.with_type(kw['type'])
+        else:
+            candidates = self._actions
+        for a in candidates:
             for k, v in kw.items():
                 if getattr(a, k) != v:
                     break
@@ -1584,6 +1806,7 @@ class FilesystemModel(object):
     def _remove(self, obj):
         _remove_backlinks(obj)
         self._actions.remove(obj)
+        self.generation += 1
 
     def add_partition(self, device, *, size, offset, flag="", wipe=None,
                       grub_device=None, partition_name=None,
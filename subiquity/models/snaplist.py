@@ -35,18 +35,46 @@ class SnapListModel:
         self._snaps_by_name = {}
         self.selections = []  # [SnapSelection]
         self.complete_snaps = set()
+        # Incremented whenever the model changes, so that a client can
+        # cheaply tell whether anything has changed since it last looked.
+        self.generation = 0
 
     def _snap_for_name(self, name):
         s = self._snaps_by_name.get(name)
         if s is None:
             s = self._snaps_by_name[name] = SnapInfo(name=name)
             self._snap_info.append(s)
+            self.generation += 1
         return s
 
     def load_find_data(self, data):
         for info in data['result']:
             self.update(self._snap_for_name(info['name']), info)
 
+    def replace_find_data(self, data):
+        """Make the snaps in data the list of snaps.
+
+        What is already known about a snap that stays in the list is kept.
+        A selected snap stays in the list even if data does not mention
+        it.
+        """
+        names = [info['name'] for info in data['result']]
+        names.extend(selection.name for selection in self.selections)
+        old = self._snaps_by_name
+        self._snaps_by_name = {}
+        self._snap_info = []
+        for name in names:
+            if name in self._snaps_by_name:
+                continue
+            snap = old.get(name)
+            if snap is None:
+                snap = SnapInfo(name=name)
+            self._snaps_by_name[name] = snap
+            self._snap_info.append(snap)
+        self.complete_snaps &= set(self._snap_info)
+        self.generation += 1
+        self.load_find_data(data)
+
     def add_partial_snap(self, name):
         self._snaps_for_name(name)
 
@@ -59,6 +87,7 @@ class SnapListModel:
         snap.confinement = data['confinement']
         snap.license = data['license']
         self.complete_snaps.add(snap)
+        self.generation += 1
 
     def load_info_data(self, data):
         info = data['result'][0]
@@ -85,6 +114,7 @@ class SnapListModel:
                             channel_data['released-at'],
                             '%Y-%m-%dT%H:%M:%S.%fZ'),
                     ))
+        self.generation += 1
         return snap
 
     def get_snap_list(self):
@@ -94,6 +124,7 @@ class SnapListModel:
         for selection in selections:
             self._snap_for_name(selection.name)
         self.selections = selections
+        self.generation += 1
 
     def make_cloudconfig(self):
         if not self.selections:
@@ -13,6 +13,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import pathlib
+import random
 import unittest
 from unittest import mock
 
@@ -23,6 +25,7 @@ from subiquity.models.filesystem import (
     ActionRenderMode,
     Bootloader,
     dehumanize_size,
+    dependencies,
     Disk,
     Filesystem,
     FilesystemModel,
@@ -1023,6 +1026,264 @@ class TestAutoInstallConfig(unittest.TestCase):
         self.assertTrue(disk2p1.id in rendered_ids)
 
 
+def render_ids_by_passes(model, mode):
+    # The algorithm FilesystemModel._render_actions used to use, which
+    # defines the order in which actions must be rendered.
+    r = []
+    emitted_ids = set()
+
+    def ensure_partitions(dev):
+        for part in dev.partitions():
+            if part.id not in emitted_ids:
+                if part not in work and part not in next_work:
+                    next_work.append(part)
+
+    def can_emit(obj):
+        if obj.type == "partition":
+            ensure_partitions(obj.device)
+            for p in obj.device.partitions():
+                if p.number < obj.number and p.id not in emitted_ids:
+                    return False
+        for dep in dependencies(obj):
+            if dep.id not in emitted_ids:
+                if dep not in work and dep not in next_work:
+                    next_work.append(dep)
+                    if dep.type in ['disk', 'raid']:
+                        ensure_partitions(dep)
+                return False
+        if obj.type == 'mount':
+            for parent in pathlib.Path(obj.path).parents:
+                parent = str(parent)
+                if parent in mountpoints:
+                    if mountpoints[parent] not in emitted_ids:
+                        return False
+        return True
+
+    mountpoints = {m.path: m.id for m in model.all_mounts()}
+    if mode == ActionRenderMode.ALL:
+        work = list(model._actions)
+    else:
+        work = [a for a in model._actions if not getattr(a, 'preserve', False)]
+    while work:
+        next_work = []
+        for obj in work:
+            if can_emit(obj):
+                r.append(obj.id)
+                emitted_ids.add(obj.id)
+            else:
+                next_work.append(obj)
+        if {a.id for a in next_work} == {a.id for a in work}:
+            raise Exception("no progress")
+        work = next_work
+    return r
+
+
+def make_shuffled_layout(seed):
+    rng = random.Random(seed)
+    model = make_model(Bootloader.NONE)
+    volumes = []
+    for i in range(rng.randint(1, 4)):
+        disk = make_disk(model, preserve=rng.random() < 0.5)
+        for j in range(rng.randint(0, 4)):
+            volumes.append(make_partition(
+                model, disk, preserve=disk.preserve and rng.random() < 0.5,
+                size=1 << 30, offset=(1 << 20) + j * (1 << 30)))
+    rng.shuffle(volumes)
+    if len(volumes) >= 4 and rng.random() < 0.5:
+        raid = model.add_raid(
+            'md%s' % seed, 'raid1', {volumes.pop(), volumes.pop()}, set())
+        raid.ptable = 'gpt'
+        for j in range(rng.randint(0, 2)):
+            volumes.append(make_partition(
+                model, raid, size=1 << 20, offset=(1 << 20) + j * (1 << 20)))
+        volumes.append(raid)
+    if len(volumes) >= 2 and rng.random() < 0.7:
+        vg = model.add_volgroup(
+            'vg%s' % seed, {volumes.pop() for j in range(rng.randint(1, 2))})
+        for j in range(rng.randint(1, 3)):
+            volumes.append(make_lv(model, vg, size=1 << 30))
+    paths = ['/', '/home', '/home/a', '/srv', '/srv/b/c', '/var', '/var/d']
+    rng.shuffle(paths)
+    for volume in volumes:
+        if isinstance(volume, Partition) and volume.preserve:
+            continue
+        if not paths or rng.random() < 0.2:
+            continue
+        fs = model.add_filesystem(volume, 'ext4')
+        model.add_mount(fs, paths.pop())
+    rng.shuffle(model._actions)
+    return model
+
+
+class TestRenderOrder(unittest.TestCase):
+
+    def test_same_order_as_multiple_passes(self):
+        for seed in range(200):
+            model = make_shuffled_layout(seed)
+            for mode in ActionRenderMode.DEFAULT, ActionRenderMode.ALL:
+                with self.subTest(seed=seed, mode=mode):
+                    self.assertEqual(
+                        [a['id'] for a in model._render_actions(mode)],
+                        render_ids_by_passes(model, mode))
+
+    def test_parent_mounts_first(self):
+        model, part = make_model_and_partition()
+        fs1 = model.add_filesystem(part, 'ext4')
+        fs2 = model.add_filesystem(make_partition(model), 'ext4')
+        mnt2 = model.add_mount(fs2, '/srv/data')
+        mnt1 = model.add_mount(fs1, '/srv')
+        ids = [a['id'] for a in model._render_actions()]
+        self.assertLess(ids.index(mnt1.id), ids.index(mnt2.id))
+
+    def test_cycle(self):
+        model, raid = make_model_and_raid()
+        part = make_partition(model, raid)
+        raid.devices.add(part)
+        with self.assertRaisesRegex(Exception, 'made no progress'):
+            model._render_actions()
+
+
+class TestIdAllocation(unittest.TestCase):
+
+    def test_sequential(self):
+        model, disk = make_model_and_disk()
+        parts = [
+            make_partition(model, disk, size=1 << 30, offset=(1 + i) << 30)
+            for i in range(3)
+            ]
+        self.assertEqual(
+            [p.id for p in parts],
+            ['partition-0', 'partition-1', 'partition-2'])
+
+    def test_skips_existing_ids(self):
+        model, disk = make_model_and_disk()
+        make_partition(model, disk, id='partition-0', size=1 << 30,
+                       offset=1 << 30)
+        make_partition(model, disk, id='partition-2', size=1 << 30,
+                       offset=2 << 30)
+        new_ids = [
+            make_partition(
+                model, disk, size=1 << 30, offset=(3 + i) << 30).id
+            for i in range(2)
+            ]
+        self.assertEqual(new_ids, ['partition-1', 'partition-3'])
+
+    def test_reset(self):
+        model, disk = make_model_and_disk()
+        self.assertEqual(disk.id, 'disk-0')
+        model._probe_data = None
+        model.reset()
+        self.assertEqual(make_disk(model).id, 'disk-0')
+
+
+class TestOrigModel(unittest.TestCase):
+
+    def load_probe_data(self, model):
+        config = [{
+            'type': 'disk', 'id': 'disk-sda', 'path': '/dev/sda',
+            'ptable': 'gpt', 'serial': 'sda',
+            }]
+        probe_data = {
+            'blockdev': {
+                '/dev/sda': {
+                    'DEVTYPE': 'disk',
+                    'ID_SERIAL': 'sda',
+                    'ID_MODEL': 'disk',
+                    'attrs': {'size': str(100 << 30)},
+                    },
+                },
+            }
+        with mock.patch(
+                'subiquity.models.filesystem.storage_config.'
+                'extract_storage_config',
+                return_value={'storage': {'config': config}}) as extract:
+            model.load_probe_data(probe_data)
+        extract.assert_called_once_with(probe_data)
+
+    def add_partition(self, model):
+        return make_partition(
+            model, model._one(type='disk'), size=1 << 30, offset=1 << 20)
+
+    def test_reset_reuses_orig_config(self):
+        model = make_model()
+        model.target = '/target'
+        self.load_probe_data(model)
+        self.add_partition(model)
+        with mock.patch('subiquity.models.filesystem.storage_config.'
+                        'extract_storage_config') as extract:
+            model.reset()
+        extract.assert_not_called()
+        [disk] = model._all(type='disk')
+        self.assertEqual(disk.id, 'disk-sda')
+        self.assertEqual(disk.partitions(), [])
+
+    def test_get_orig_model(self):
+        model = make_model()
+        model.target = '/target'
+        self.load_probe_data(model)
+        self.add_partition(model)
+        with mock.patch('subiquity.models.filesystem.storage_config.'
+                        'extract_storage_config') as extract:
+            orig_model = model.get_orig_model()
+        extract.assert_not_called()
+        [orig_disk] = orig_model._all(type='disk')
+        self.assertIsNot(orig_disk, model._one(type='disk'))
+        self.assertEqual(orig_disk.partitions(), [])
+        # Changing the model handed out does not affect later ones.
+        self.add_partition(orig_model)
+        [disk] = model.get_orig_model()._all(type='disk')
+        self.assertEqual(disk.partitions(), [])
+
+
+class TestActionIndexes(unittest.TestCase):
+
+    def assertLookupsMatch(self, model):
+        for action in model._actions:
+            self.assertIs(model._one(id=action.id), action)
+        for type in 'disk', 'partition', 'format', 'mount', 'nonesuch':
+            self.assertEqual(
+                model._all(type=type),
+                [a for a in model._actions if a.type == type])
+
+    def test_lookups(self):
+        model = make_shuffled_layout(1)
+        self.assertLookupsMatch(model)
+        disk = make_disk(model)
+        part = make_partition(model, disk)
+        self.assertLookupsMatch(model)
+        model.remove_partition(part)
+        self.assertIsNone(model._one(id=part.id))
+        self.assertLookupsMatch(model)
+        model._actions.reverse()
+        self.assertLookupsMatch(model)
+        model._actions[:] = model._actions[1:]
+        self.assertLookupsMatch(model)
+        model._actions = list(model._actions)
+        self.assertLookupsMatch(model)
+
+    def test_unindexed_attributes(self):
+        model, disk = make_model_and_disk()
+        self.assertIs(model._one(type='disk', path=disk.path), disk)
+        disk.path = '/dev/changed'
+        self.assertIs(model._one(type='disk', path='/dev/changed'), disk)
+        self.assertIs(model._one(path='/dev/changed'), disk)
+
+
+class TestSlots(unittest.TestCase):
+
+    def test_no_instance_dict(self):
+        model = make_shuffled_layout(1)
+        make_raid(model)
+        make_lv(model)
+        for action in model._actions:
+            self.assertFalse(hasattr(action, '__dict__'), action)
+
+    def test_undeclared_attribute(self):
+        model, part = make_model_and_partition()
+        with self.assertRaises(AttributeError):
+            part.nonesuch = 1
+
+
 class TestPartitionNumbering(unittest.TestCase):
     def setUp(self):
         self.cur_idx = 1
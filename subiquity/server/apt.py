@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import contextlib
 import logging
 import os
@@ -48,7 +49,10 @@ class AptConfigurer:
     # apply_apt_config method.
     #
     # Then in configure_for_install we create a fresh overlay ('install_tree')
-    # over the first one and configure it for the installation. This means:
+    # over the first one and configure it for the installation (this is split
+    # into setup_install_tree, for steps 1 to 3, and update_install_tree, for
+    # step 4, so that the slow apt-get update can run while the install gets
+    # on with other things). This means:
     #
     # 1. Bind-mounting /cdrom into this new overlay.
     #
@@ -80,6 +84,13 @@ class AptConfigurer:
         self.configured_tree: Optional[OverlayMountpoint] = None
         self.install_tree: Optional[OverlayMountpoint] = None
         self.install_mount = None
+        # The overlay handed out by overlay() and how many callers are
+        # using it.
+        self._overlay: Optional[OverlayMountpoint] = None
+        self._overlay_users = 0
+        self._overlay_lock = asyncio.Lock()
+        self._overlay_idle = asyncio.Event()
+        self._overlay_idle.set()
 
     def apt_config(self):
         cfg = {}
@@ -100,6 +111,12 @@ class AptConfigurer:
             config=config_location, private_mounts=True)
 
     async def configure_for_install(self, context):
+        await self.setup_install_tree()
+        await self.update_install_tree(context)
+        return self.install_tree.p()
+
+    async def setup_install_tree(self):
+        """Create the 'install_tree' overlay and return its path."""
         assert self.configured_tree is not None
 
         self.install_tree = await self.mounter.setup_overlay(
@@ -125,35 +142,67 @@ class AptConfigurer:
             self.install_tree.p('etc/apt/sources.list'),
             f'deb [check-date=no] file:///cdrom {codename} main restricted\n')
 
+        return self.install_tree.p()
+
+    async def update_install_tree(self, context):
         await run_curtin_command(
             self.app, context, "in-target", "-t", self.install_tree.p(),
             "--", "apt-get", "update", private_mounts=True)
 
-        return self.install_tree.p()
-
     @contextlib.asynccontextmanager
     async def overlay(self):
-        overlay = await self.mounter.setup_overlay([
+        """Yield an overlay over the install tree that can be changed
+        without affecting the install.
+
+        The overlay is shared: the first caller sets it up, later callers
+        reuse it (and see any changes earlier ones made) and cleanup()
+        unmounts it once no caller is using it.
+        """
+        async with self._overlay_lock:
+            if self._overlay is None:
+                self._overlay = await self._setup_overlay()
+            self._overlay_users += 1
+            self._overlay_idle.clear()
+        try:
+            yield self._overlay
+        finally:
+            self._overlay_users -= 1
+            if self._overlay_users == 0:
+                self._overlay_idle.set()
+
+    async def _setup_overlay(self) -> OverlayMountpoint:
+        return await self.mounter.setup_overlay([
                 self.install_tree.upperdir,
                 self.configured_tree.upperdir,
                 self.source
             ])
+
+    async def _unmount_overlay(self, overlay: OverlayMountpoint) -> None:
+        # TODO self.unmount expects a Mountpoint object. Unfortunately, the
+        # one we created in setup_overlay was discarded and replaced by an
+        # OverlayMountPoint object instead. Here we re-create a new
+        # Mountpoint object and (thanks to attr.s) make sure that it
+        # compares equal to the one we discarded earlier.
+        # But really, there should be better ways to handle this.
         try:
-            yield overlay
-        finally:
-            # TODO self.unmount expects a Mountpoint object. Unfortunately, the
-            # one we created in setup_overlay was discarded and replaced by an
-            # OverlayMountPoint object instead. Here we re-create a new
-            # Mountpoint object and (thanks to attr.s) make sure that it
-            # compares equal to the one we discarded earlier.
-            # But really, there should be better ways to handle this.
+            await self.mounter.unmount(
+                Mountpoint(mountpoint=overlay.mountpoint))
+        except subprocess.CalledProcessError as exc:
+            raise OverlayCleanupError from exc
+
+    async def _release_overlay(self) -> None:
+        async with self._overlay_lock:
+            await self._overlay_idle.wait()
+            if self._overlay is None:
+                return
+            overlay, self._overlay = self._overlay, None
             try:
-                await self.mounter.unmount(
-                    Mountpoint(mountpoint=overlay.mountpoint))
-            except subprocess.CalledProcessError as exc:
-                raise OverlayCleanupError from exc
+                await self._unmount_overlay(overlay)
+            except OverlayCleanupError:
+                log.exception("Failed to cleanup overlay. Continuing anyway.")
 
     async def cleanup(self):
+        await self._release_overlay()
         await self.mounter.cleanup()
 
     async def deconfigure(self, context, target: str) -> None:
@@ -191,9 +240,11 @@ class AptConfigurer:
 
 class DryRunAptConfigurer(AptConfigurer):
 
-    @contextlib.asynccontextmanager
-    async def overlay(self):
-        yield await self.mounter.setup_overlay(self.install_tree.mountpoint)
+    async def _setup_overlay(self) -> OverlayMountpoint:
+        return await self.mounter.setup_overlay(self.install_tree.mountpoint)
+
+    async def _unmount_overlay(self, overlay: OverlayMountpoint) -> None:
+        pass
 
     async def deconfigure(self, context, target):
         await self.cleanup()
@@ -19,12 +19,15 @@ import shlex
 from typing import List, Sequence, Union
 
 import attr
-from systemd import journal
 
 from subiquitycore.context import with_context
 from subiquitycore.utils import arun_command
 
 from subiquity.common.types import ApplicationState
+from subiquity.journald import (
+    journal,
+    journald_available,
+    )
 from subiquity.server.controller import NonInteractiveController
 
 
@@ -80,7 +83,7 @@ class CmdListController(NonInteractiveController):
             desc = cmd.desc()
             with context.child("command_{}".format(i), desc):
                 args = cmd.as_args_list()
-                if self.syslog_id:
+                if self.syslog_id and journald_available():
                     journal.send(
                         "  running " + desc, SYSLOG_IDENTIFIER=self.syslog_id)
                     args = [
@@ -22,6 +22,7 @@ import os
 import pathlib
 import platform
 import select
+import time
 from typing import Dict, List, Optional
 
 from curtin.storage_config import ptable_uuid_to_flag_entry
@@ -40,6 +41,8 @@ from subiquitycore.utils import (
     )
 from subiquitycore.lsb_release import lsb_release
 
+from subiquity.common import jsoncodec
+from subiquity.common.api.server import with_etag
 from subiquity.common.apidef import API
 from subiquity.common.errorreport import ErrorReportKind
 from subiquity.common.filesystem.actions import (
@@ -115,6 +118,76 @@ class NoSnapdSystemsOnSource(Exception):
     pass
 
 
+def _storage_etag(controller):
+    for task in controller._probe_task, controller._get_system_task:
+        if task.task is None or not task.task.done():
+            return None
+    os_probe = controller._os_probe_task.task
+    if os_probe is not None and not os_probe.done():
+        # Merging the os-prober results will change the responses.
+        return None
+    source = controller.app.base_model.source.current
+    return '{}-{}-{}-{}'.format(
+        controller._probe_generation, controller.model.generation,
+        source.id, source.size)
+
+
+# The probe timeout is this many times how long probing the devices found
+# is expected to take, based on how long recent probes took per device.
+_PROBE_TIMEOUT_FACTOR = 3
+# Per-device probing time to assume before any probe has been timed.
+_DEFAULT_PROBE_SECONDS_PER_DEVICE = 0.1
+
+
+# Sections of probe data that are keyed by device name and say nothing
+# about other devices.
+_PER_DEVICE_PROBE_SECTIONS = ('blockdev', 'dasd', 'filesystem', 'os')
+
+# Filesystem types that make a device part of something bigger (a RAID, a
+# volume group, ...) that probe data describes in other sections.
+_MEMBER_FSTYPES = {
+    'bcache', 'crypto_LUKS', 'linux_raid_member', 'LVM2_member', 'zfs_member',
+    }
+
+
+def remove_devices_from_probe_data(probe_data, devnames):
+    """Return a copy of probe_data without the block devices in devnames
+    and their partitions, or None if removing them would affect other parts
+    of the probe data (for example because one was a RAID member) and a
+    full probe is needed."""
+    blockdevs = probe_data.get('blockdev', {})
+    removed = set()
+    for devname in devnames:
+        if devname not in blockdevs:
+            continue
+        devpath = blockdevs[devname].get('DEVPATH', '')
+        for name, data in blockdevs.items():
+            if name == devname or \
+               data.get('DEVPATH', '').startswith(devpath + '/'):
+                removed.add(name)
+    for name in removed:
+        data = blockdevs[name]
+        if data.get('DEVTYPE') not in ('disk', 'partition'):
+            return None
+        if data.get('ID_FS_TYPE') in _MEMBER_FSTYPES:
+            return None
+        if data.get('DM_NAME') or data.get('MD_LEVEL'):
+            return None
+        if data.get('DM_MULTIPATH_DEVICE_PATH') == '1':
+            return None
+    for mount in probe_data.get('mount', []):
+        if mount.get('source') in removed:
+            return None
+    new_data = dict(probe_data)
+    for section in _PER_DEVICE_PROBE_SECTIONS:
+        if section in probe_data:
+            new_data[section] = {
+                k: v for k, v in probe_data[section].items()
+                if k not in removed
+                }
+    return new_data
+
+
 class FilesystemController(SubiquityController, FilesystemManipulator):
 
     endpoint = API.storage
@@ -134,11 +207,25 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
             self.model.bootloader = getattr(Bootloader, name)
         self.model.storage_version = self.opts.storage_version
         self._monitor = None
+        # (action, devname) for udev events received since the last probe.
+        self._udev_changes = []
+        # Where the pretty-printed copy of the current probe data lives.
+        self._probe_data_path = None
+        # Used to pick the probe timeout, see _probe_timeout.
+        self._probe_device_count = 0
+        self._probe_seconds_per_device = _DEFAULT_PROBE_SECONDS_PER_DEVICE
+        # The thread running os-prober, see _merge_os_probe.
+        self._os_prober_thread = None
         self._errors = {}
+        # Incremented when probing or fetching the snapd system starts, as
+        # both change the responses of the GET endpoints.
+        self._probe_generation = 0
         self._probe_once_task = SingleInstanceTask(
             self._probe_once, propagate_errors=False)
         self._probe_task = SingleInstanceTask(
             self._probe, propagate_errors=False, cancel_restart=False)
+        self._os_probe_task = SingleInstanceTask(
+            self._merge_os_probe, propagate_errors=False)
         self._get_system_task = SingleInstanceTask(self._get_system)
         self.supports_resilient_boot = False
         self.app.hub.subscribe(
@@ -194,6 +281,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
             self._system_mounter = None
 
     async def _get_system(self):
+        self._probe_generation += 1
         await self._unmount_system()
         try:
             await self._mount_system()
@@ -381,6 +469,8 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
                 await self._probe_task.wait()
             else:
                 return resp_cls(status=ProbeStatus.PROBING)
+        if wait and self._os_probe_task.task is not None:
+            await self._os_probe_task.wait()
         if True in self._errors:
             return resp_cls(
                 status=ProbeStatus.FAILED,
@@ -410,6 +500,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
             dasd=self.model._probe_data.get('dasd', {}),
             storage_version=self.model.storage_version)
 
+    @with_etag(_storage_etag)
     async def GET(self, wait: bool = False, use_cached_result: bool = False) \
             -> StorageResponse:
         if not use_cached_result:
@@ -447,6 +538,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
             disks.append(disk)
         return disks
 
+    @with_etag(_storage_etag)
     async def guided_GET(self, wait: bool = False) -> GuidedStorageResponse:
         probe_resp = await self._probe_response(wait, GuidedStorageResponse)
         if probe_resp is not None:
@@ -643,6 +735,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
                 install_minimum_size=minsize,
                 )
 
+    @with_etag(_storage_etag)
     async def v2_GET(self, wait: bool = False) -> StorageResponseV2:
         return await self.get_v2_storage_response(self.model, wait)
 
@@ -650,6 +743,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         await self.configured()
         return await self.v2_GET()
 
+    @with_etag(_storage_etag)
     async def v2_orig_config_GET(self) -> StorageResponseV2:
         model = self.model.get_orig_model()
         return await self.get_v2_storage_response(model, False)
@@ -659,6 +753,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         self.model.reset()
         return await self.v2_GET()
 
+    @with_etag(_storage_etag)
     async def v2_guided_GET(self, wait: bool = False) \
             -> GuidedStorageResponseV2:
         """Acquire a list of possible guided storage configuration scenarios.
@@ -787,6 +882,89 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         self.partition_disk_handler(disk, spec, partition=partition)
         return await self.v2_GET()
 
+    def _get_storage(self, probe_types, cache_key):
+        # Runs in a thread. Returns the probe data and whether it came from
+        # the cache, which is keyed by a fingerprint of the udev state of
+        # the block devices so that a restarted server, or a re-probe of an
+        # unchanged system, does not have to run probert again.
+        prober = self.app.prober
+        fingerprint = prober.storage_fingerprint(probe_types)
+        if fingerprint is None:
+            return prober.get_storage(probe_types), False
+        cache_dir = self.app.state_path('probe-cache')
+        cache_path = os.path.join(
+            cache_dir, '{}-{}.json'.format(cache_key, fingerprint))
+        try:
+            with open(cache_path) as fp:
+                storage = jsoncodec.loads(fp.read())
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            log.exception("ignoring unreadable probe cache %s", cache_path)
+        else:
+            log.debug("using cached probe data from %s", cache_path)
+            return storage, True
+        storage = prober.get_storage(probe_types)
+        os.makedirs(cache_dir, exist_ok=True)
+        for stale in glob.glob(os.path.join(cache_dir, cache_key + '-*')):
+            os.unlink(stale)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            fp.write(jsoncodec.dumps(storage))
+        os.replace(tmp_path, cache_path)
+        return storage, False
+
+    def _write_probe_data(self, fpath, storage):
+        with open(fpath, 'w') as fp:
+            json.dump(storage, fp, indent=4)
+
+    async def _merge_os_probe(self, probe_data, *, context):
+        # os-prober mounts each partition it looks at, so it only runs once
+        # the main probe has finished reading the mount table and sizing
+        # filesystems, and _probe waits for it to finish before probing
+        # again.
+        self._os_prober_thread = asyncio.ensure_future(run_in_thread(
+            self._get_storage, {'os'}, "ProbeDataOS"))
+        try:
+            with context.child("os_prober", "running os-prober"):
+                os_data, cached = await asyncio.shield(
+                    self._os_prober_thread)
+        except Exception:
+            block_discover_log.exception("os probing failed")
+            return
+        if self.model._probe_data is not probe_data:
+            # A newer probe has replaced the data this was started for.
+            return
+        # The os data is only consulted when partitions are described to
+        # the client, so it can be slotted in without rebuilding the model.
+        probe_data['os'] = os_data.get('os', {})
+        self.model.generation += 1
+        if self._probe_data_path is not None:
+            schedule_task(run_in_thread(
+                self._write_probe_data, self._probe_data_path, probe_data))
+
+    def _probe_timeout(self):
+        if platform.machine() == 'riscv64':
+            # block probing is taking much longer on RISC-V - but why?
+            minimum = 60.0
+        else:
+            minimum = 15.0
+        expected = self._probe_device_count * self._probe_seconds_per_device
+        return max(minimum, _PROBE_TIMEOUT_FACTOR * expected)
+
+    def _record_probe_time(self, elapsed):
+        if self._probe_device_count == 0:
+            return
+        per_device = elapsed / self._probe_device_count
+        self._probe_seconds_per_device = \
+            (self._probe_seconds_per_device + per_device) / 2
+
+    async def _wait_for_os_prober(self):
+        thread = self._os_prober_thread
+        if thread is not None and not thread.done():
+            log.debug("waiting for os-prober to finish before probing")
+            await asyncio.wait([thread])
+
     @with_context(name='probe_once', description='restricted={restricted}')
     async def _probe_once(self, *, context, restricted):
         if restricted:
@@ -795,12 +973,15 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
             key = "ProbeDataRestricted"
         else:
             probe_types = {'defaults', 'filesystem_sizing'}
-            if self.app.opts.use_os_prober:
-                probe_types |= {'os'}
             fname = 'probe-data.json'
             key = "ProbeData"
-        storage = await run_in_thread(
-            self.app.prober.get_storage, probe_types)
+        start = time.monotonic()
+        with context.child(
+                "probert", "probing " + ", ".join(sorted(probe_types))):
+            storage, cached = await run_in_thread(
+                self._get_storage, probe_types, key)
+        if not restricted and not cached:
+            self._record_probe_time(time.monotonic() - start)
         # It is possible for the user to submit filesystem config
         # while a probert probe is running. We don't want to overwrite
         # the users config with a blank one if this happens! (See
@@ -808,35 +989,80 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         if self._configured:
             return
         fpath = os.path.join(self.app.block_log_dir, fname)
-        with open(fpath, 'w') as fp:
-            json.dump(storage, fp, indent=4)
+        self._probe_data_path = fpath
+        if not cached or not os.path.exists(fpath):
+            # The pretty-printed copy is only for people and apport to
+            # read, so do not make the probe wait for it.
+            schedule_task(
+                run_in_thread(self._write_probe_data, fpath, storage))
         self.app.note_file_for_apport(key, fpath)
         self.model.load_probe_data(storage)
+        if not restricted and self.app.opts.use_os_prober:
+            # os-prober is by far the slowest part of probing and nothing
+            # needs its results to offer guided storage, so the probe is
+            # done without it and its results are merged in later.
+            self._os_probe_task.start_sync(storage, context=context)
+
+    def _reprobe_locally(self, changes):
+        # Try to bring the probe data up to date after the udev events in
+        # changes without running probert. Only removals can be handled
+        # this way: dropping a device needs no new information, but
+        # anything else does.
+        probe_data = self.model._probe_data
+        if probe_data is None or self._probe_data_path is None:
+            return False
+        task = self._os_probe_task.task
+        if task is not None and not task.done():
+            return False
+        if any(action != 'remove' for action, devname in changes):
+            return False
+        new_data = remove_devices_from_probe_data(
+            probe_data, {devname for action, devname in changes})
+        if new_data is None:
+            return False
+        log.debug(
+            "removing %s from probe data",
+            sorted(devname for action, devname in changes))
+        schedule_task(run_in_thread(
+            self._write_probe_data, self._probe_data_path, new_data))
+        self.model.load_probe_data(new_data)
+        return True
 
     @with_context()
     async def _probe(self, *, context=None):
+        self._probe_generation += 1
+        changes, self._udev_changes = self._udev_changes, []
+        if changes and not self._configured and \
+           self._reprobe_locally(changes):
+            return
         self._errors = {}
+        await self._wait_for_os_prober()
+        with context.child("enumerate", "counting block devices") as c:
+            self._probe_device_count = await run_in_thread(
+                self.app.prober.count_block_devices)
+            c.description = "found {} block devices, timeout {:.0f}s".format(
+                self._probe_device_count, self._probe_timeout())
         for (restricted, kind) in [
                 (False, ErrorReportKind.BLOCK_PROBE_FAIL),
                 (True,  ErrorReportKind.DISK_PROBE_FAIL),
                 ]:
+            timeout = self._probe_timeout()
             try:
                 await self._probe_once_task.start(
                     context=context, restricted=restricted)
                 # We wait on the task directly here, not
                 # self._probe_once_task.wait as if _probe_once_task
                 # gets cancelled, we should be cancelled too.
-                if platform.machine() == 'riscv64':
-                    # block probing is taking much longer on RISC-V - but why?
-                    timeout = 60.0
-                else:
-                    timeout = 15.0
                 await asyncio.wait_for(self._probe_once_task.task, timeout)
             except asyncio.CancelledError:
                 # asyncio.CancelledError is a subclass of Exception in
                 # Python 3.6 (sadface)
                 raise
             except Exception as exc:
+                if isinstance(exc, asyncio.TimeoutError) and not restricted:
+                    # The probe took at least this long, so give the next
+                    # one longer.
+                    self._record_probe_time(timeout)
                 block_discover_log.exception(
                     "block probing failed restricted=%s", restricted)
                 report = self.app.make_apport_report(kind, "block probing")
@@ -925,6 +1151,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         while select.select([self._monitor.fileno()], [], [], 0)[0]:
             action, dev = self._monitor.receive_device()
             log.debug("_udev_event %s %s", action, dev)
+            self._udev_changes.append((action, dev.device_node))
         try:
             self._probe_task.start_sync()
         except TaskAlreadyRunningError:
@@ -22,7 +22,7 @@ from pathlib import Path
 import re
 import shutil
 import tempfile
-from typing import Any, Callable, Dict, List
+from typing import Any, Awaitable, Callable, Dict, List
 
 import attr
 import yaml
@@ -30,7 +30,7 @@ import yaml
 from subiquitycore.async_helpers import (
     run_in_thread,
     )
-from subiquitycore.context import with_context
+from subiquitycore.context import Status, with_context
 from subiquitycore.file_util import write_file, generate_config_yaml
 
 from subiquity.common.errorreport import ErrorReportKind
@@ -48,6 +48,10 @@ from subiquity.server.curtin import (
     run_curtin_command,
     start_curtin_command,
     )
+from subiquity.server.extract import (
+    ExtractProgress,
+    ParallelExtractor,
+    )
 from subiquity.server.types import (
     InstallerChannels,
     )
@@ -75,6 +79,48 @@ class TracebackExtractor:
             self.traceback.append(line)
 
 
+@attr.s(auto_attribs=True)
+class InstallStep:
+    """A step of the install and the names of the steps it needs to wait
+    for."""
+    name: str
+    run: Callable[..., Awaitable[Any]]
+    requires: List[str] = attr.Factory(list)
+
+
+async def run_install_steps(steps: List[InstallStep], *, context):
+    """Run steps, starting each one as soon as the steps it requires are
+    done.
+
+    A step can only require steps that come before it in the list, so
+    running them in order is always possible.  If a step fails, the
+    others are cancelled and the exception is raised.
+    """
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run_step(step):
+        for name in step.requires:
+            await tasks[name]
+        await step.run(context=context)
+
+    seen = set()
+    for step in steps:
+        for name in step.requires:
+            if name not in seen:
+                raise ValueError(
+                    f"step {step.name} requires {name} which is not an "
+                    f"earlier step")
+        seen.add(step.name)
+    for step in steps:
+        tasks[step.name] = asyncio.create_task(run_step(step))
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+
 @attr.s(auto_attribs=True)
 class CurtinInstallStep:
     """Represents the parameters of a single invocation of curtin install."""
@@ -135,6 +181,9 @@ class InstallController(SubiquityController):
         self.unattended_upgrades_cmd = None
         self.unattended_upgrades_ctx = None
         self.tb_extractor = TracebackExtractor()
+        # The contexts of the packages being installed that dpkg has not
+        # set up yet.
+        self._package_contexts = {}
 
     def interactive(self):
         return True
@@ -145,15 +194,27 @@ class InstallController(SubiquityController):
             asyncio.create_task(self.stop_unattended_upgrades())
 
     def start(self):
-        journald_listen(
-            self.app.aio_loop, [self.app.log_syslog_id], self.log_event)
+        if self.app.use_journal:
+            journald_listen(
+                self.app.aio_loop, [self.app.log_syslog_id], self.log_event,
+                this_boot=True, fields=('MESSAGE',))
         self.install_task = asyncio.create_task(self.install())
 
     def tpath(self, *path):
         return os.path.join(self.model.target, *path)
 
+    setting_up_re = re.compile(r"^Setting up ([^ :]+)(:\S+)? ")
+
     def log_event(self, event):
-        self.tb_extractor.feed(event['MESSAGE'])
+        message = event['MESSAGE']
+        self.tb_extractor.feed(message)
+        if self._package_contexts:
+            match = self.setting_up_re.match(message)
+            if match:
+                package_context = self._package_contexts.pop(
+                    match.group(1), None)
+                if package_context is not None:
+                    package_context.exit()
 
     def write_config(self, config_file: Path, config: Any) -> None:
         """ Create a YAML file that represents the curtin install configuration
@@ -207,12 +268,19 @@ class InstallController(SubiquityController):
         if not self.app.opts.dry_run:
             shutil.rmtree(target)
 
+    async def setup_install_source(self):
+        """Create the apt overlay the system is installed from and return
+        its path."""
+        mirror = self.app.controllers.Mirror
+        configurer = await mirror.wait_config()
+        return await configurer.setup_install_tree()
+
     @with_context(
         description="configuring apt", level="INFO", childlevel="DEBUG")
     async def configure_apt(self, *, context):
-        mirror = self.app.controllers.Mirror
-        configurer = await mirror.wait_config()
-        return await configurer.configure_for_install(context)
+        configurer = self.app.controllers.Mirror.apt_configurer
+        await configurer.update_install_tree(context)
+        await self.app.hub.abroadcast(InstallerChannels.APT_CONFIGURED)
 
     async def setup_target(self, context):
         mirror = self.app.controllers.Mirror
@@ -252,17 +320,33 @@ class InstallController(SubiquityController):
                 **kw,
             )
 
+        def make_extract_step():
+            if self.app.opts.parallel_extract and source.startswith('cp://'):
+                return functools.partial(
+                    self.extract_source, source=source[len('cp://'):],
+                    log_file=install_log_file)
+            return make_curtin_step(
+                name="extract", stages=["extract"],
+                acquire_config=self.acquire_generic_config,
+                ).run
+
+        # Partitioning and formatting only need the storage config, so
+        # they run while apt is being configured in the source.  Extracting
+        # the source has to wait for that.
         steps = [
-            make_curtin_step(
-                "initial",
-                stages=[],
-                acquire_config=self.acquire_initial_config
-            ).run,
+            InstallStep(
+                "apt", self.configure_apt),
+            InstallStep(
+                "initial", make_curtin_step(
+                    "initial",
+                    stages=[],
+                    acquire_config=self.acquire_initial_config
+                    ).run),
             ]
         fs_controller = self.app.controllers.Filesystem
         if fs_controller.is_core_boot_classic():
-            steps.append(
-                make_curtin_step(
+            steps.append(InstallStep(
+                "partitioning", make_curtin_step(
                     name="partitioning", stages=["partitioning"],
                     acquire_config=functools.partial(
                         self.acquire_filesystem_config,
@@ -270,24 +354,32 @@ class InstallController(SubiquityController):
                     cls=CurtinPartitioningStep,
                     device_map_path=logs_dir / "device-map-partition.json",
                     ).run,
-                )
+                requires=["initial"]))
+            formatting_requires = ["partitioning"]
             if fs_controller.use_tpm:
-                steps.append(fs_controller.setup_encryption)
+                steps.append(InstallStep(
+                    "encryption", fs_controller.setup_encryption,
+                    requires=["partitioning"]))
+                formatting_requires = ["encryption"]
             steps.extend([
-                make_curtin_step(
-                    name="formatting", stages=["partitioning"],
-                    acquire_config=functools.partial(
-                        self.acquire_filesystem_config,
-                        mode=ActionRenderMode.FORMAT_MOUNT),
-                    cls=CurtinPartitioningStep,
-                    device_map_path=logs_dir / "device-map-format.json",
-                    ).run,
-                make_curtin_step(
-                    name="extract", stages=["extract"],
-                    acquire_config=self.acquire_generic_config,
-                    ).run,
-                self.create_core_boot_classic_fstab,
-                make_curtin_step(
+                InstallStep(
+                    "formatting", make_curtin_step(
+                        name="formatting", stages=["partitioning"],
+                        acquire_config=functools.partial(
+                            self.acquire_filesystem_config,
+                            mode=ActionRenderMode.FORMAT_MOUNT),
+                        cls=CurtinPartitioningStep,
+                        device_map_path=logs_dir / "device-map-format.json",
+                        ).run,
+                    requires=formatting_requires),
+                InstallStep(
+                    "extract", make_extract_step(),
+                    requires=["formatting", "apt"]),
+                InstallStep(
+                    "fstab", self.create_core_boot_classic_fstab,
+                    requires=["extract"]),
+                InstallStep(
+                    "swap", make_curtin_step(
                         name="swap", stages=["swap"],
                         acquire_config=functools.partial(
                             self.acquire_generic_config,
@@ -297,35 +389,88 @@ class InstallController(SubiquityController):
                                     '--fstab', self.tpath('etc/fstab'),
                                     ],
                                 }),
-                    ).run,
-                fs_controller.finish_install,
-                self.setup_target,
+                        ).run,
+                    requires=["fstab"]),
+                InstallStep(
+                    "finish", fs_controller.finish_install,
+                    requires=["swap"]),
+                InstallStep(
+                    "setup_target", self.setup_target,
+                    requires=["finish"]),
                 ])
         else:
             steps.extend([
-                make_curtin_step(
-                    name="partitioning", stages=["partitioning"],
-                    acquire_config=self.acquire_filesystem_config,
-                    cls=CurtinPartitioningStep,
-                    device_map_path=logs_dir / "device-map.json",
-                    ).run,
-                make_curtin_step(
-                    name="extract", stages=["extract"],
-                    acquire_config=self.acquire_generic_config,
-                    ).run,
-                self.setup_target,
-                make_curtin_step(
+                InstallStep(
+                    "partitioning", make_curtin_step(
+                        name="partitioning", stages=["partitioning"],
+                        acquire_config=self.acquire_filesystem_config,
+                        cls=CurtinPartitioningStep,
+                        device_map_path=logs_dir / "device-map.json",
+                        ).run,
+                    requires=["initial"]),
+                InstallStep(
+                    "extract", make_extract_step(),
+                    requires=["partitioning", "apt"]),
+                InstallStep(
+                    "setup_target", self.setup_target,
+                    requires=["extract"]),
+                InstallStep(
+                    "curthooks", make_curtin_step(
                         name="curthooks", stages=["curthooks"],
                         acquire_config=self.acquire_generic_config,
-                    ).run,
+                        ).run,
+                    requires=["setup_target"]),
                 ])
             # If the current source has a snapd_system_label here we should
             # really write recovery_system={snapd_system_label} to
             # {target}/var/lib/snapd/modeenv to get snapd to pick it up on
             # first boot. But not needed for now.
 
-        for step in steps:
-            await step(context=context)
+        await run_install_steps(steps, context=context)
+
+    @with_context(
+        description="extracting the install source", level="INFO",
+        childlevel="INFO")
+    async def extract_source(self, *, context, source, log_file):
+        """Copy source into the target with a ParallelExtractor instead of
+        running curtin's extract stage."""
+        loop = asyncio.get_running_loop()
+        reported = -1
+
+        def report(progress: ExtractProgress):
+            # Add a line to the progress view every 10%, rather than
+            # every time the extractor reports.
+            nonlocal reported
+            step = progress.percent // 10
+            if step <= reported:
+                return
+            reported = step
+            child = context.child("progress", progress.describe())
+            child.enter()
+            child.exit()
+
+        def progress(progress: ExtractProgress):
+            loop.call_soon_threadsafe(report, progress)
+
+        extractor = ParallelExtractor(
+            source, self.tpath(),
+            threads=self.app.opts.extract_threads,
+            verify=self.app.opts.verify_extract,
+            progress=progress)
+        with open(str(log_file), mode="a") as fh:
+            fh.write(
+                f"\n---- [[ subiquity step extract ]] ----\n"
+                f"copying {source} to {self.tpath()} with "
+                f"{extractor.threads} threads\n")
+        try:
+            result = await run_in_thread(extractor.run)
+        except asyncio.CancelledError:
+            extractor.cancel()
+            raise
+        description = result.describe()
+        with open(str(log_file), mode="a") as fh:
+            fh.write(f"{description}\n")
+        context.description = description
 
     @with_context(description="creating fstab")
     async def create_core_boot_classic_fstab(self, *, context):
@@ -352,9 +497,7 @@ class InstallController(SubiquityController):
 
             self.app.update_state(ApplicationState.RUNNING)
 
-            for_install_path = await self.configure_apt(context=context)
-
-            await self.app.hub.abroadcast(InstallerChannels.APT_CONFIGURED)
+            for_install_path = await self.setup_install_source()
 
             if os.path.exists(self.model.target):
                 await self.unmount_target(
@@ -391,8 +534,7 @@ class InstallController(SubiquityController):
         write_file(autoinstall_path, autoinstall_config)
         await self.configure_cloud_init(context=context)
         packages = await self.get_target_packages(context=context)
-        for package in packages:
-            await self.install_package(context=context, package=package)
+        await self.install_packages(context=context, packages=packages)
         if self.model.drivers.do_install:
             with context.child(
                     "ubuntu-drivers-install",
@@ -415,14 +557,40 @@ class InstallController(SubiquityController):
     async def get_target_packages(self, context):
         return await self.app.base_model.target_packages()
 
-    @with_context(
-        name="install_{package}",
-        description="installing {package}")
-    async def install_package(self, *, context, package):
-        await run_curtin_command(
-            self.app, context, 'system-install', '-t', self.tpath(),
-            '--', package,
-            private_mounts=False)
+    async def install_packages(self, *, context, packages):
+        """Install packages in the target in one apt transaction.
+
+        Each package still gets its own context, which finishes when dpkg
+        reports setting the package up (or when the install finishes, if
+        the log is not available).
+        """
+        packages = list(dict.fromkeys(packages))
+        if not packages:
+            return
+        contexts = {}
+        for package in packages:
+            contexts[package] = context.child(
+                f"install_{package}", f"installing {package}")
+            contexts[package].enter()
+        self._package_contexts = dict(contexts)
+        try:
+            await run_curtin_command(
+                self.app, context, 'system-install', '-t', self.tpath(),
+                '--', *packages,
+                private_mounts=False)
+        except BaseException as exc:
+            if isinstance(exc, asyncio.CancelledError):
+                description = "cancelled"
+            else:
+                description = str(exc)
+            for package_context in self._package_contexts.values():
+                package_context.exit(description, Status.FAIL)
+            raise
+        else:
+            for package_context in self._package_contexts.values():
+                package_context.exit()
+        finally:
+            self._package_contexts = {}
 
     @with_context(description="restoring apt configuration")
     async def restore_apt_config(self, context):
@@ -33,6 +33,7 @@ from subiquitycore.models.network import (
 from subiquitycore.utils import arun_command
 
 from subiquity.common.api.client import make_client_for_conn
+from subiquity.common.api.server import with_etag
 from subiquity.common.apidef import (
     API,
     LinkAction,
@@ -87,6 +88,15 @@ NETPLAN_SCHEMA = {
     }
 
 
+def _network_etag(controller):
+    # The first GET applies the config, so it always has to run.
+    if not controller.view_shown:
+        return None
+    return '{}-{}'.format(
+        controller.model.generation,
+        controller.wlan_support_install_state().name)
+
+
 class NetworkController(BaseNetworkController, SubiquityController):
 
     endpoint = API.network
@@ -264,6 +274,7 @@ class NetworkController(BaseNetworkController, SubiquityController):
     def make_autoinstall(self):
         return self.model.render_config()['network']
 
+    @with_etag(_network_etag)
     async def GET(self) -> NetworkStatus:
         if not self.view_shown:
             self.apply_config(silent=True)
@@ -26,6 +26,7 @@ from subiquitycore.async_helpers import (
     )
 from subiquitycore.context import with_context
 
+from subiquity.common.api.server import with_etag
 from subiquity.common.apidef import API
 from subiquity.common.types import (
     SnapCheckState,
@@ -36,6 +37,7 @@ from subiquity.common.types import (
 from subiquity.server.controller import (
     SubiquityController,
     )
+from subiquity.server.snapcache import SnapdResponseCache
 from subiquity.server.types import InstallerChannels
 
 
@@ -48,16 +50,25 @@ class SnapListFetchError(Exception):
 
 class SnapdSnapInfoLoader:
 
-    def __init__(self, model, snapd, store_section, context):
+    def __init__(self, model, snapd, store_section, context,
+                 *, max_concurrent_fetches=4, cache=None):
         self.model = model
         self.store_section = store_section
         self.context = context
+        # A SnapdResponseCache, or None to always ask snapd.
+        self.cache = cache
+        # The cached list _load_list used if it needs refreshing.
+        self.stale_list = None
 
         self.main_task = None
 
         self.snapd = snapd
         self.pending_snaps = []
         self.tasks = {}  # {snap:task}
+        # Limits the fetches started by _start. A fetch asked for with
+        # get_snap_info_task does not wait for the semaphore, so the snap
+        # the user is looking at is never queued behind the prefetches.
+        self.fetch_semaphore = asyncio.Semaphore(max_concurrent_fetches)
 
         self.load_list_task_created = asyncio.Event()
 
@@ -99,33 +110,102 @@ class SnapdSnapInfoLoader:
                 return
             self.pending_snaps = self.model.get_snap_list()
             log.debug("fetched list of %s snaps", len(self.pending_snaps))
-            while self.pending_snaps:
-                snap = self.pending_snaps.pop(0)
-                task = self.tasks[snap] = schedule_task(
-                    self._fetch_info_for_snap(snap=snap))
-                await task
+            prefetches = []
+            try:
+                refresh = None
+                if self.stale_list is not None:
+                    refresh = schedule_task(
+                        self._refresh_list(cached=self.stale_list))
+                    prefetches.append(refresh)
+                await self._prefetch(prefetches)
+                if refresh is not None:
+                    await refresh
+                    # The refreshed list may have snaps the cached one did
+                    # not.
+                    await self._prefetch(prefetches)
+                await asyncio.gather(*prefetches)
+            except asyncio.CancelledError:
+                for task in prefetches:
+                    task.cancel()
+                raise
+
+    async def _prefetch(self, prefetches):
+        while True:
+            await self.fetch_semaphore.acquire()
+            # get_snap_info_task may have taken the remaining snaps while
+            # we waited.
+            if not self.pending_snaps:
+                self.fetch_semaphore.release()
+                return
+            snap = self.pending_snaps.pop(0)
+            task = self.tasks[snap] = schedule_task(
+                self._fetch_info_for_snap(snap=snap))
+            task.add_done_callback(
+                lambda task: self.fetch_semaphore.release())
+            prefetches.append(task)
 
     @with_context(name="list")
     async def _load_list(self, context=None):
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.lookup('v2/find', section=self.store_section)
+        if cached is not None:
+            # Show the last good list straight away, even if it is stale.
+            self.model.load_find_data(cached.data)
+            if not cached.fresh:
+                self.stale_list = cached
+            return
         try:
             result = await self.snapd.get(
                 'v2/find', section=self.store_section)
         except requests.exceptions.RequestException:
             raise SnapListFetchError
+        self._store('v2/find', result, section=self.store_section)
         self.model.load_find_data(result)
 
+    @with_context(name="refresh")
+    async def _refresh_list(self, cached, context=None):
+        try:
+            result = await self.snapd.get(
+                'v2/find', section=self.store_section)
+        except requests.exceptions.RequestException:
+            log.warning("refreshing list of snaps failed, using cached list")
+            return
+        etag = self._store('v2/find', result, section=self.store_section)
+        if etag != cached.etag:
+            self.model.replace_find_data(result)
+            self.pending_snaps = [
+                snap for snap in self.model.get_snap_list()
+                if snap not in self.tasks
+                ]
+
+    def _store(self, path, data, **args):
+        if self.cache is not None:
+            return self.cache.store(path, data, **args)
+
     def stop(self):
         if self.main_task is not None:
             self.main_task.cancel()
 
     @with_context(name="fetch/{snap.name}")
     async def _fetch_info_for_snap(self, snap, context=None):
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.lookup('v2/find', name=snap.name)
+        if cached is not None and cached.fresh:
+            self.model.load_info_data(cached.data)
+            return
         try:
             data = await self.snapd.get('v2/find', name=snap.name)
         except requests.exceptions.RequestException:
-            log.exception("loading snap info failed")
-            # XXX something better here?
-            return
+            if cached is None:
+                log.exception("loading snap info failed")
+                # XXX something better here?
+                return
+            log.warning("loading snap info failed, using cached info")
+            data = cached.data
+        else:
+            self._store('v2/find', data, name=snap.name)
         self.model.load_info_data(data)
 
     def get_snap_list_task(self):
@@ -140,6 +220,13 @@ class SnapdSnapInfoLoader:
         return self.tasks[snap]
 
 
+def _snaplist_etag(controller):
+    if not controller.loader.fetch_list_completed() \
+            or not controller.app.base_model.network.has_network:
+        return None
+    return str(controller.model.generation)
+
+
 class SnapListController(SubiquityController):
 
     endpoint = API.snaplist
@@ -162,9 +249,13 @@ class SnapListController(SubiquityController):
     model_name = "snaplist"
 
     def _make_loader(self):
+        cache = None
+        if self.opts.snap_cache_ttl > 0:
+            cache = SnapdResponseCache(
+                self.app.state_path('snap-cache'), self.opts.snap_cache_ttl)
         return SnapdSnapInfoLoader(
             self.model, self.app.snapd, self.opts.snap_section,
-            self.context.child("loader"))
+            self.context.child("loader"), cache=cache)
 
     def __init__(self, app):
         super().__init__(app)
@@ -196,6 +287,7 @@ class SnapListController(SubiquityController):
     def make_autoinstall(self):
         return [attr.asdict(sel) for sel in self.model.selections]
 
+    @with_etag(_snaplist_etag)
     async def GET(self, wait: bool = False) -> SnapListResponse:
         if self.loader.fetch_list_failed() \
                 or not self.app.base_model.network.has_network:
@@ -13,13 +13,21 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import copy
+import functools
+import os
 from unittest import mock, TestCase, IsolatedAsyncioTestCase
 import uuid
 
 from parameterized import parameterized
 
-from subiquitycore.snapd import AsyncSnapd, get_fake_connection
+from subiquitycore.snapd import (
+    AsyncSnapd,
+    get_fake_connection,
+    ThreadedSnapdConnection,
+    )
+from subiquitycore.tests import SubiTestCase
 from subiquitycore.tests.mocks import make_app
 from subiquitycore.tests.util import random_string
 
@@ -38,7 +46,11 @@ from subiquity.models.tests.test_filesystem import (
     make_partition,
     )
 from subiquity.server import snapdapi
-from subiquity.server.controllers.filesystem import FilesystemController
+from subiquity.server.controllers.filesystem import (
+    _storage_etag,
+    FilesystemController,
+    remove_devices_from_probe_data,
+    )
 from subiquity.server.dryrun import DRConfig
 
 bootloaders = [(bl, ) for bl in list(Bootloader)]
@@ -54,6 +66,8 @@ class TestSubiquityControllerFilesystem(IsolatedAsyncioTestCase):
         self.app.report_start_event = mock.Mock()
         self.app.report_finish_event = mock.Mock()
         self.app.prober = mock.Mock()
+        self.app.prober.storage_fingerprint.return_value = None
+        self.app.prober.count_block_devices.return_value = 0
         self.fsc = FilesystemController(app=self.app)
         self.fsc._configured = True
 
@@ -70,10 +84,244 @@ class TestSubiquityControllerFilesystem(IsolatedAsyncioTestCase):
 
     async def test_probe_os_prober_true(self):
         self.app.opts.use_os_prober = True
+        self.app.block_log_dir = '/var/log/installer/block'
+        self.app.note_file_for_apport = mock.Mock()
+        self.fsc._configured = False
+        self.fsc._write_probe_data = mock.Mock()
         await self.fsc._probe_once(context=None, restricted=False)
-        actual = self.app.prober.get_storage.call_args.args[0]
+        await self.fsc._os_probe_task.wait()
+        calls = self.app.prober.get_storage.call_args_list
+        actual = set().union(*(call.args[0] for call in calls))
         self.assertTrue({'defaults', 'os'} <= actual)
 
+    async def test_udev_remove_reprobes_locally(self):
+        self.fsc._configured = False
+        self.fsc._write_probe_data = mock.Mock()
+        self.fsc._probe_data_path = '/probe-data.json'
+        self.fsc.model._probe_data = {
+            'blockdev': {
+                '/dev/sda': {'DEVTYPE': 'disk', 'DEVPATH': '/a'},
+                '/dev/sdb': {'DEVTYPE': 'disk', 'DEVPATH': '/b'},
+                },
+            }
+        self.fsc._udev_changes = [('remove', '/dev/sdb')]
+        await self.fsc._probe(context=None)
+        self.app.prober.get_storage.assert_not_called()
+        self.fsc.model.load_probe_data.assert_called_once_with({
+            'blockdev': {
+                '/dev/sda': {'DEVTYPE': 'disk', 'DEVPATH': '/a'},
+                },
+            })
+        self.assertEqual([], self.fsc._udev_changes)
+
+    async def test_os_probe_merged(self):
+        self.app.opts.use_os_prober = True
+        self.app.block_log_dir = '/var/log/installer/block'
+        self.app.note_file_for_apport = mock.Mock()
+        self.fsc._configured = False
+        self.fsc._write_probe_data = mock.Mock()
+
+        def get_storage(probe_types):
+            if probe_types == {'os'}:
+                return {'os': {'/dev/sda1': {'long': 'Ubuntu'}}}
+            return {'blockdev': {}}
+
+        def load_probe_data(probe_data):
+            self.fsc.model._probe_data = probe_data
+
+        self.app.prober.get_storage.side_effect = get_storage
+        self.fsc.model.load_probe_data.side_effect = load_probe_data
+        self.fsc.model.generation = 0
+        await self.fsc._probe_once(context=None, restricted=False)
+        await self.fsc._os_probe_task.wait()
+        self.assertEqual(
+            {
+                'blockdev': {},
+                'os': {'/dev/sda1': {'long': 'Ubuntu'}},
+            },
+            self.fsc.model._probe_data)
+        self.assertEqual(1, self.fsc.model.generation)
+
+    async def test_os_probe_after_main_probe(self):
+        # os-prober mounts partitions, so it must not run while the mount
+        # table is read or filesystems are sized.
+        self.app.opts.use_os_prober = True
+        self.app.block_log_dir = '/var/log/installer/block'
+        self.app.note_file_for_apport = mock.Mock()
+        self.fsc._configured = False
+        self.fsc._write_probe_data = mock.Mock()
+        events = []
+
+        def get_storage(probe_types):
+            events.append(('start', sorted(probe_types)))
+            events.append(('finish', sorted(probe_types)))
+            return {'blockdev': {}}
+
+        self.app.prober.get_storage.side_effect = get_storage
+        await self.fsc._probe_once(context=None, restricted=False)
+        await self.fsc._os_probe_task.wait()
+        self.assertEqual(events, [
+            ('start', ['defaults', 'filesystem_sizing']),
+            ('finish', ['defaults', 'filesystem_sizing']),
+            ('start', ['os']),
+            ('finish', ['os']),
+            ])
+
+    async def test_no_etag_while_os_probe_runs(self):
+        self.app.base_model.source.current.id = 'source'
+        self.app.base_model.source.current.size = 1
+        for task in self.fsc._probe_task, self.fsc._get_system_task:
+            task.task = asyncio.get_running_loop().create_future()
+            task.task.set_result(None)
+        self.assertIsNotNone(_storage_etag(self.fsc))
+        self.fsc._os_probe_task.task = \
+            asyncio.get_running_loop().create_future()
+        self.assertIsNone(_storage_etag(self.fsc))
+        self.fsc._os_probe_task.task.set_result(None)
+        self.assertIsNotNone(_storage_etag(self.fsc))
+
+    async def test_probe_waits_for_os_prober(self):
+        self.fsc._os_prober_thread = asyncio.get_running_loop().create_future()
+        probe = asyncio.create_task(self.fsc._probe(context=None))
+        await asyncio.sleep(0.01)
+        self.app.prober.count_block_devices.assert_not_called()
+        self.fsc._os_prober_thread.set_result(({}, False))
+        await probe
+        self.app.prober.count_block_devices.assert_called_once_with()
+
+    @mock.patch('platform.machine', return_value='x86_64')
+    async def test_probe_timeout_scales(self, machine):
+        self.fsc._probe_device_count = 10
+        self.assertEqual(15.0, self.fsc._probe_timeout())
+        self.fsc._probe_device_count = 1000
+        self.assertEqual(300.0, self.fsc._probe_timeout())
+        self.fsc._record_probe_time(300.0)
+        self.assertEqual(0.2, self.fsc._probe_seconds_per_device)
+        self.assertEqual(600.0, self.fsc._probe_timeout())
+
+    async def test_probe_time_recorded(self):
+        self.fsc._probe_device_count = 4
+        with mock.patch(
+                'subiquity.server.controllers.filesystem.time') as m_time:
+            m_time.monotonic.side_effect = [100.0, 104.0]
+            await self.fsc._probe_once(context=None, restricted=False)
+        self.assertEqual(0.55, self.fsc._probe_seconds_per_device)
+
+    @mock.patch('platform.machine', return_value='x86_64')
+    async def test_probe_timeout_recorded(self, machine):
+        self.app.prober.count_block_devices.return_value = 1000
+        self.app.make_apport_report = mock.Mock(return_value=None)
+
+        async def wait_for(task, timeout):
+            task.cancel()
+            raise asyncio.TimeoutError
+
+        with mock.patch(
+                'subiquity.server.controllers.filesystem.asyncio.wait_for',
+                wait_for):
+            await self.fsc._probe(context=None)
+        # The full probe timing out after 300s counts as taking 300s; the
+        # restricted probe timing out does not count.
+        self.assertEqual(0.2, self.fsc._probe_seconds_per_device)
+        self.assertEqual(600.0, self.fsc._probe_timeout())
+
+    async def test_udev_add_probes_fully(self):
+        self.fsc._probe_data_path = '/probe-data.json'
+        self.fsc.model._probe_data = {'blockdev': {}}
+        self.fsc._udev_changes = [('add', '/dev/sdb')]
+        await self.fsc._probe(context=None)
+        self.app.prober.get_storage.assert_called()
+        self.assertEqual([], self.fsc._udev_changes)
+
+
+class TestRemoveDevicesFromProbeData(TestCase):
+    def make_probe_data(self, **sdb_props):
+        return {
+            'blockdev': {
+                '/dev/sda': {'DEVTYPE': 'disk', 'DEVPATH': '/block/sda'},
+                '/dev/sdb': dict(
+                    DEVTYPE='disk', DEVPATH='/block/sdb', **sdb_props),
+                '/dev/sdb1': {
+                    'DEVTYPE': 'partition', 'DEVPATH': '/block/sdb/sdb1'},
+                },
+            'filesystem': {'/dev/sdb1': {'TYPE': 'ext4'}},
+            'os': {'/dev/sdb1': {'long': 'Ubuntu'}},
+            'mount': [],
+            }
+
+    def test_remove_disk_and_partitions(self):
+        probe_data = self.make_probe_data()
+        self.assertEqual(
+            {
+                'blockdev': {
+                    '/dev/sda': {
+                        'DEVTYPE': 'disk', 'DEVPATH': '/block/sda'},
+                    },
+                'filesystem': {},
+                'os': {},
+                'mount': [],
+            },
+            remove_devices_from_probe_data(probe_data, {'/dev/sdb'}))
+        self.assertIn('/dev/sdb', probe_data['blockdev'])
+
+    def test_unknown_device(self):
+        probe_data = self.make_probe_data()
+        self.assertEqual(
+            probe_data,
+            remove_devices_from_probe_data(probe_data, {'/dev/sdz', None}))
+
+    def test_raid_member(self):
+        probe_data = self.make_probe_data(ID_FS_TYPE='linux_raid_member')
+        self.assertIsNone(
+            remove_devices_from_probe_data(probe_data, {'/dev/sdb'}))
+
+    def test_mounted(self):
+        probe_data = self.make_probe_data()
+        probe_data['mount'].append({'source': '/dev/sdb1', 'target': '/x'})
+        self.assertIsNone(
+            remove_devices_from_probe_data(probe_data, {'/dev/sdb'}))
+
+
+class TestProbeCache(SubiTestCase):
+    def setUp(self):
+        self.app = make_app()
+        self.app.opts.bootloader = 'UEFI'
+        self.state_dir = self.tmp_dir()
+        self.app.state_path = functools.partial(
+            os.path.join, self.state_dir)
+        self.app.prober = mock.Mock()
+        self.app.prober.storage_fingerprint.return_value = 'abc'
+        self.app.prober.get_storage.return_value = {'blockdev': {}}
+        self.fsc = FilesystemController(app=self.app)
+
+    def test_reuse(self):
+        self.assertEqual(
+            ({'blockdev': {}}, False),
+            self.fsc._get_storage({'blockdev'}, 'ProbeData'))
+        self.assertEqual(
+            ({'blockdev': {}}, True),
+            self.fsc._get_storage({'blockdev'}, 'ProbeData'))
+        self.app.prober.get_storage.assert_called_once_with({'blockdev'})
+
+    def test_fingerprint_changed(self):
+        self.fsc._get_storage({'blockdev'}, 'ProbeData')
+        self.fsc._get_storage({'blockdev'}, 'ProbeDataRestricted')
+        self.app.prober.storage_fingerprint.return_value = 'def'
+        self.app.prober.get_storage.return_value = {'blockdev': {'a': {}}}
+        self.assertEqual(
+            ({'blockdev': {'a': {}}}, False),
+            self.fsc._get_storage({'blockdev'}, 'ProbeData'))
+        self.assertEqual(
+            ['ProbeData-def.json', 'ProbeDataRestricted-abc.json'],
+            sorted(os.listdir(os.path.join(self.state_dir, 'probe-cache'))))
+
+    def test_no_fingerprint(self):
+        self.app.prober.storage_fingerprint.return_value = None
+        self.fsc._get_storage({'blockdev'}, 'ProbeData')
+        self.fsc._get_storage({'blockdev'}, 'ProbeData')
+        self.assertEqual(2, self.app.prober.get_storage.call_count)
+        self.assertFalse(os.path.exists(self.state_dir + '/probe-cache'))
+
 
 class TestGuided(TestCase):
     boot_expectations = [
@@ -473,7 +721,8 @@ class TestCoreBootInstallMethods(IsolatedAsyncioTestCase):
         self.app.report_finish_event = mock.Mock()
         self.app.prober = mock.Mock()
         self.app.snapdapi = snapdapi.make_api_client(
-            AsyncSnapd(get_fake_connection()))
+            AsyncSnapd(
+                ThreadedSnapdConnection(get_fake_connection())))
         self.app.dr_cfg = DRConfig()
         self.fsc = FilesystemController(app=self.app)
         self.fsc._configured = True
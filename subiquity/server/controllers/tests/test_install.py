@@ -13,15 +13,21 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import os
 from pathlib import Path
+import tempfile
 import unittest
-from unittest.mock import ANY, Mock, mock_open, patch
+from unittest.mock import ANY, AsyncMock, Mock, mock_open, patch
 
 from subiquity.server.controllers.install import (
     InstallController,
+    InstallStep,
     CurtinInstallStep,
+    run_install_steps,
     )
 
+from subiquitycore.context import Status
 from subiquitycore.tests.mocks import make_app
 
 
@@ -112,3 +118,226 @@ class TestWriteConfig(unittest.IsolatedAsyncioTestCase):
                          "/error-partitioning.tar")
         self.assertEqual(config["install"]["resume_data"],
                          "/resume-data.json")
+
+
+class TestRunInstallSteps(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.events = []
+
+    def step(self, name, requires=(), wait=None, fail=False):
+        async def run(*, context):
+            self.events.append(('start', name))
+            if wait is not None:
+                await wait.wait()
+            if fail:
+                raise Exception(name)
+            self.events.append(('finish', name))
+        return InstallStep(name, run, requires=list(requires))
+
+    async def test_order(self):
+        await run_install_steps([
+            self.step("a"),
+            self.step("b", requires=["a"]),
+            self.step("c", requires=["b"]),
+            ], context=None)
+        self.assertEqual(self.events, [
+            ('start', 'a'), ('finish', 'a'),
+            ('start', 'b'), ('finish', 'b'),
+            ('start', 'c'), ('finish', 'c'),
+            ])
+
+    async def test_overlap(self):
+        slow = asyncio.Event()
+        steps = run_install_steps([
+            self.step("slow", wait=slow),
+            self.step("a"),
+            self.step("b", requires=["a"]),
+            self.step("c", requires=["b", "slow"]),
+            ], context=None)
+        task = asyncio.create_task(steps)
+        await asyncio.sleep(0.01)
+        self.assertIn(('finish', 'b'), self.events)
+        self.assertNotIn(('start', 'c'), self.events)
+        slow.set()
+        await task
+        self.assertEqual(self.events[-1], ('finish', 'c'))
+
+    async def test_failure_cancels(self):
+        never = asyncio.Event()
+        with self.assertRaisesRegex(Exception, "a"):
+            await run_install_steps([
+                self.step("slow", wait=never),
+                self.step("a", fail=True),
+                self.step("b", requires=["a"]),
+                ], context=None)
+        self.assertNotIn(('start', 'b'), self.events)
+        self.assertNotIn(('finish', 'slow'), self.events)
+
+    async def test_requires_earlier_step(self):
+        with self.assertRaises(ValueError):
+            await run_install_steps([
+                self.step("a", requires=["b"]),
+                self.step("b"),
+                ], context=None)
+        self.assertEqual(self.events, [])
+
+
+class TestCurtinInstall(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.controller = InstallController(make_app())
+        self.controller.app.report_start_event = Mock()
+        self.controller.app.report_finish_event = Mock()
+        self.controller.app.note_file_for_apport = Mock()
+        output_base = tempfile.TemporaryDirectory()
+        self.addCleanup(output_base.cleanup)
+        self.controller.app.opts.output_base = output_base.name
+        self.controller.app.opts.parallel_extract = False
+        self.controller.model.target = "/target"
+        fs = self.controller.app.controllers.Filesystem
+        fs.is_core_boot_classic.return_value = False
+        self.controller.app.controllers.Mirror.apt_configurer = AsyncMock()
+
+    @patch("subiquity.server.controllers.install.run_curtin_command")
+    async def test_apt_overlaps_partitioning(self, run_cmd):
+        events = []
+        apt_done = asyncio.Event()
+
+        async def update_install_tree(context):
+            events.append('apt start')
+            await apt_done.wait()
+            events.append('apt finish')
+
+        async def curtin(app, context, command, source, *args, **kw):
+            stages = args[1]
+            events.append(stages)
+            if stages == 'json:stages=["partitioning"]':
+                apt_done.set()
+
+        configurer = self.controller.app.controllers.Mirror.apt_configurer
+        configurer.update_install_tree.side_effect = update_install_tree
+        run_cmd.side_effect = curtin
+        self.controller.acquire_filesystem_config = Mock(return_value={})
+        self.controller.acquire_generic_config = Mock(return_value={})
+        self.controller.write_config = Mock()
+
+        with patch("subiquity.server.controllers.install.open",
+                   mock_open(read_data="{}")):
+            await self.controller.curtin_install(
+                context=self.controller.context, source='cp:///source')
+
+        self.assertEqual(events, [
+            'apt start',
+            'json:stages=[]',
+            'json:stages=["partitioning"]',
+            'apt finish',
+            'json:stages=["extract"]',
+            'json:stages=["curthooks"]',
+            ])
+
+    @patch("subiquity.server.controllers.install.run_curtin_command")
+    async def test_parallel_extract(self, run_cmd):
+        self.controller.app.opts.parallel_extract = True
+        self.controller.extract_source = AsyncMock()
+        self.controller.acquire_filesystem_config = Mock(return_value={})
+        self.controller.acquire_generic_config = Mock(return_value={})
+        self.controller.write_config = Mock()
+
+        with patch("subiquity.server.controllers.install.open",
+                   mock_open(read_data="{}")):
+            await self.controller.curtin_install(
+                context=self.controller.context, source='cp:///source')
+
+        self.controller.extract_source.assert_awaited_once_with(
+            context=ANY, source='/source', log_file=ANY)
+        self.assertEqual(
+            [c.args[5] for c in run_cmd.call_args_list], [
+                'json:stages=[]',
+                'json:stages=["partitioning"]',
+                'json:stages=["curthooks"]',
+                ])
+
+    async def test_extract_source(self):
+        source = tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        target = tempfile.TemporaryDirectory()
+        self.addCleanup(target.cleanup)
+        for i in range(3):
+            with open(os.path.join(source.name, str(i)), 'w') as fp:
+                fp.write('x' * 1000)
+        self.controller.model.target = target.name
+        self.controller.app.opts.extract_threads = 2
+        self.controller.app.opts.verify_extract = True
+        log_file = os.path.join(self.controller.app.opts.output_base, 'log')
+
+        await self.controller.extract_source(
+            context=self.controller.context, source=source.name,
+            log_file=log_file)
+
+        self.assertEqual(sorted(os.listdir(target.name)), ['0', '1', '2'])
+        started = [
+            c.args[0]
+            for c in self.controller.app.report_start_event.call_args_list]
+        self.assertEqual(
+            [c.name for c in started], ['extract_source', 'progress'])
+        self.assertTrue(started[1].description.startswith('100% copied'))
+        with open(log_file) as fp:
+            self.assertIn('100% copied (3/3 files', fp.read())
+
+
+class TestInstallPackages(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.controller = InstallController(make_app())
+        self.controller.app.report_start_event = Mock()
+        self.controller.app.report_finish_event = Mock()
+        self.controller.model.target = "/target"
+
+    def finished(self):
+        return [
+            (c.args[0].name, c.args[2])
+            for c in self.controller.app.report_finish_event.call_args_list]
+
+    @patch("subiquity.server.controllers.install.run_curtin_command")
+    async def test_one_transaction(self, run_cmd):
+        async def run(*args, **kw):
+            self.controller.log_event({'MESSAGE': 'Setting up b (1.0) ...'})
+            self.controller.log_event(
+                {'MESSAGE': 'Setting up a:amd64 (2.0) ...'})
+        run_cmd.side_effect = run
+        await self.controller.install_packages(
+            context=self.controller.context, packages=['a', 'b', 'c', 'a'])
+        run_cmd.assert_called_once_with(
+            self.controller.app, ANY, 'system-install', '-t', '/target',
+            '--', 'a', 'b', 'c', private_mounts=False)
+        self.assertEqual(
+            [c.args[0].name
+             for c in self.controller.app.report_start_event.call_args_list],
+            ['install_a', 'install_b', 'install_c'])
+        self.assertEqual(self.finished(), [
+            ('install_b', Status.SUCCESS),
+            ('install_a', Status.SUCCESS),
+            ('install_c', Status.SUCCESS),
+            ])
+
+    @patch("subiquity.server.controllers.install.run_curtin_command")
+    async def test_failure(self, run_cmd):
+        async def run(*args, **kw):
+            self.controller.log_event({'MESSAGE': 'Setting up a (1.0) ...'})
+            raise Exception("boom")
+        run_cmd.side_effect = run
+        with self.assertRaises(Exception):
+            await self.controller.install_packages(
+                context=self.controller.context, packages=['a', 'b'])
+        self.assertEqual(self.finished(), [
+            ('install_a', Status.SUCCESS),
+            ('install_b', Status.FAIL),
+            ])
+        self.assertEqual(self.controller._package_contexts, {})
+
+    @patch("subiquity.server.controllers.install.run_curtin_command")
+    async def test_no_packages(self, run_cmd):
+        await self.controller.install_packages(
+            context=self.controller.context, packages=[])
+        run_cmd.assert_not_called()
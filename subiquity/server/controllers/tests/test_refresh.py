@@ -15,7 +15,11 @@
 
 from unittest import mock
 
-from subiquitycore.snapd import AsyncSnapd, get_fake_connection
+from subiquitycore.snapd import (
+    AsyncSnapd,
+    get_fake_connection,
+    ThreadedSnapdConnection,
+    )
 from subiquitycore.tests import SubiTestCase
 from subiquitycore.tests.mocks import make_app
 
@@ -36,7 +40,8 @@ class TestRefreshController(SubiTestCase):
         self.app.note_data_for_apport = mock.Mock()
         self.app.prober = mock.Mock()
         self.app.snapdapi = snapdapi.make_api_client(
-            AsyncSnapd(get_fake_connection()))
+            AsyncSnapd(
+                ThreadedSnapdConnection(get_fake_connection())))
         self.rc = RefreshController(app=self.app)
 
     async def test_configure_snapd_kernel_autoinstall(self):
@@ -13,7 +13,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import json
+import os
 import requests
+import tempfile
 import unittest
 from unittest.mock import AsyncMock, Mock
 
@@ -22,6 +26,7 @@ from subiquity.server.controllers.snaplist import (
     SnapListFetchError,
 )
 from subiquity.models.snaplist import SnapListModel
+from subiquity.server.snapcache import SnapdResponseCache
 from subiquitycore.tests.mocks import make_app
 
 
@@ -56,3 +61,185 @@ class TestSnapdSnapInfoLoader(unittest.IsolatedAsyncioTestCase):
         await self.loader.get_snap_list_task()
         self.assertTrue(self.loader.fetch_list_completed())
         self.assertFalse(self.loader.fetch_list_failed())
+
+
+class TestSnapdSnapInfoLoaderPrefetch(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.model = SnapListModel()
+        for name in 'abcdef':
+            self.model._snap_for_name(name)
+        self.model.load_info_data = Mock()
+        self.app = make_app()
+        self.app.report_start_event = Mock()
+        self.app.report_finish_event = Mock()
+        self.app.snapd = Mock()
+        self.app.snapd.get = self.get
+        self.release = asyncio.Event()
+        self.in_flight = set()
+        self.max_in_flight = 0
+        self.loader = SnapdSnapInfoLoader(
+            self.model, self.app.snapd, "server", self.app.context,
+            max_concurrent_fetches=2)
+        self.loader._load_list = AsyncMock()
+
+    async def get(self, path, *, name):
+        self.in_flight.add(name)
+        self.max_in_flight = max(self.max_in_flight, len(self.in_flight))
+        try:
+            await self.release.wait()
+        finally:
+            self.in_flight.discard(name)
+        return {}
+
+    async def test_bounded(self):
+        self.loader.start()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.in_flight, {'a', 'b'})
+        self.release.set()
+        await self.loader.main_task
+        self.assertEqual(self.max_in_flight, 2)
+        self.assertEqual(self.model.load_info_data.call_count, 6)
+
+    async def test_requested_snap_not_queued(self):
+        self.loader.start()
+        await asyncio.sleep(0.01)
+        snap = self.model._snap_for_name('e')
+        task = self.loader.get_snap_info_task(snap)
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.in_flight, {'a', 'b', 'e'})
+        self.assertNotIn(snap, self.loader.pending_snaps)
+        self.release.set()
+        await task
+        await self.loader.main_task
+        self.assertEqual(self.model.load_info_data.call_count, 6)
+
+    async def test_stop_cancels_prefetches(self):
+        self.loader.start()
+        await asyncio.sleep(0.01)
+        tasks = [self.loader.tasks[self.model._snap_for_name(name)]
+                 for name in 'ab']
+        self.loader.stop()
+        await asyncio.sleep(0.01)
+        self.assertTrue(all(task.cancelled() for task in tasks))
+        self.assertEqual(self.in_flight, set())
+
+
+def example_response(name):
+    path = os.path.join(
+        os.path.dirname(__file__), '..', '..', '..', '..',
+        'examples', 'snaps', name + '.json')
+    with open(path) as fp:
+        return json.load(fp)
+
+
+class TestSnapdSnapInfoLoaderCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.list_data = example_response('v2-find-section=server')
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cache = SnapdResponseCache(tmpdir.name, ttl=60)
+        self.app = make_app()
+        self.app.report_start_event = Mock()
+        self.app.report_finish_event = Mock()
+        self.app.snapd = AsyncMock()
+        self.app.snapd.get.side_effect = self.get
+        self.offline = False
+
+    async def get(self, path, *, section=None, name=None):
+        if self.offline:
+            raise requests.exceptions.ConnectionError
+        if section is not None:
+            return self.list_data
+        return example_response('v2-find-name=' + name)
+
+    def make_loader(self):
+        model = SnapListModel()
+        return model, SnapdSnapInfoLoader(
+            model, self.app.snapd, "server", self.app.context,
+            cache=self.cache)
+
+    async def load(self):
+        model, loader = self.make_loader()
+        loader.start()
+        await loader.main_task
+        return model, loader
+
+    async def test_fresh(self):
+        model1, loader = await self.load()
+        self.app.snapd.get.reset_mock()
+        model2, loader = await self.load()
+        self.app.snapd.get.assert_not_called()
+        self.assertTrue(loader.fetch_list_completed())
+        self.assertEqual(
+            [s.name for s in model1.get_snap_list()],
+            [s.name for s in model2.get_snap_list()])
+        juju = model2._snap_for_name('juju')
+        self.assertNotEqual(juju.channels, [])
+        self.assertEqual(juju.channels, model1._snap_for_name('juju').channels)
+
+    async def test_stale_unchanged(self):
+        await self.load()
+        self.cache.ttl = 0
+        model, loader = self.make_loader()
+        model.load_find_data = Mock(wraps=model.load_find_data)
+        loader.start()
+        await loader.main_task
+        # The cached list was used and the refreshed one was the same.
+        model.load_find_data.assert_called_once_with(self.list_data)
+        self.app.snapd.get.assert_any_call('v2/find', section='server')
+
+    async def test_stale_changed(self):
+        await self.load()
+        self.cache.ttl = 0
+        old = self.list_data
+        self.list_data = {'result': old['result'][:1]}
+        model, loader = self.make_loader()
+        model.load_find_data = Mock(wraps=model.load_find_data)
+        loader.start()
+        await loader.main_task
+        self.assertEqual(
+            [c.args[0] for c in model.load_find_data.call_args_list],
+            [old, self.list_data])
+        self.assertEqual(
+            self.cache.lookup('v2/find', section='server').data,
+            self.list_data)
+        # Snaps that are no longer listed are dropped.
+        self.assertEqual(
+            [s.name for s in model.get_snap_list()],
+            [old['result'][0]['name']])
+
+    async def test_stale_new_snaps_prefetched(self):
+        full = self.list_data
+        self.list_data = {'result': full['result'][:1]}
+        await self.load()
+        self.cache.ttl = 0
+        self.list_data = full
+        self.app.snapd.get.reset_mock()
+        model, loader = await self.load()
+        names = [info['name'] for info in full['result']]
+        self.assertEqual([s.name for s in model.get_snap_list()], names)
+        fetched = [
+            c.kwargs['name'] for c in self.app.snapd.get.call_args_list
+            if 'name' in c.kwargs]
+        # The cached info is stale too, so every snap is fetched, not only
+        # the one that was in the cached list.
+        self.assertEqual(sorted(fetched), sorted(names))
+        for name in names:
+            self.assertNotEqual(model._snap_for_name(name).channels, [])
+
+    async def test_offline(self):
+        model1, loader = await self.load()
+        self.cache.ttl = 0
+        self.offline = True
+        model2, loader = await self.load()
+        self.assertTrue(loader.fetch_list_completed())
+        self.assertEqual(
+            len(model1.get_snap_list()), len(model2.get_snap_list()))
+        self.assertEqual(
+            model2._snap_for_name('juju').channels,
+            model1._snap_for_name('juju').channels)
+
+    async def test_offline_no_cache(self):
+        self.offline = True
+        model, loader = await self.load()
+        self.assertTrue(loader.fetch_list_failed())
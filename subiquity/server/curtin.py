@@ -15,37 +15,282 @@
 
 
 import asyncio
+import itertools
 import json
 import logging
 import os
 import re
+import secrets
+import signal
 import subprocess
 import sys
-from typing import Dict, List, Type
+from typing import Callable, Dict, List, Optional, Type
+
+from aiohttp import web
 import yaml
 
 from subiquitycore.context import Context, Status
 
 from subiquity.journald import (
+    journald_available,
     journald_listen,
     )
 
 log = logging.getLogger('subiquity.server.curtin')
 
 
+class _WorkerChild:
+    """A curtin command running in a CurtinWorker."""
+
+    def __init__(self, worker, req_id):
+        self.worker = worker
+        self.req_id = req_id
+        self.returncode = None
+        self._done = asyncio.get_running_loop().create_future()
+
+    def send_signal(self, sig):
+        self.worker._send({'id': self.req_id, 'signal': sig})
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    async def wait(self) -> int:
+        self.returncode = await asyncio.shield(self._done)
+        return self.returncode
+
+
+_WORKER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'curtin_worker.py')
+_RUN_WORKER = (
+    'import runpy, sys; '
+    'runpy.run_path(sys.argv.pop(1), run_name="__main__")'
+    )
+
+
+class CurtinWorker:
+    """Run curtin commands in a subiquity.server.curtin_worker process.
+
+    The worker imports curtin once and forks a child for each command, so
+    commands do not pay for starting an interpreter and importing curtin.
+    The worker itself is started by the command runner without private
+    mounts.  A command that wants private mounts gets a mount namespace of
+    its own in the child, so mounts one command leaves behind are not seen
+    by the next.  The runner's environment allowlist is read again for
+    each command.
+    """
+
+    start_timeout = 30
+
+    def __init__(self, runner, socket_path):
+        self.runner = runner
+        self.socket_path = socket_path
+        self.proc = None
+        self.alive = False
+        self._ids = itertools.count(1)
+        self._children: Dict[int, _WorkerChild] = {}
+        self._reader = self._writer = None
+        self._tasks = []
+
+    def make_command(self) -> List[str]:
+        # With "-m subiquity.server.curtin_worker", the subiquity and
+        # subiquity.server packages would be imported first and end up in
+        # every curtin child.  Running the file as a script would put this
+        # directory, with its curtin.py, at the front of sys.path, so it
+        # is run with runpy, which does neither.
+        return [
+            sys.executable, '-c', _RUN_WORKER, _WORKER_PATH,
+            self.socket_path,
+            ]
+
+    async def start(self) -> bool:
+        """Start the worker and return whether that worked."""
+        connected = asyncio.get_running_loop().create_future()
+
+        def on_connect(reader, writer):
+            if not connected.done():
+                connected.set_result((reader, writer))
+            else:
+                writer.close()
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(
+            on_connect, path=self.socket_path)
+        try:
+            self.proc = await self.runner.start(
+                self.make_command(), private_mounts=False)
+            exited = asyncio.create_task(self._wait_proc())
+            self._tasks.append(exited)
+            await asyncio.wait(
+                [connected, exited], timeout=self.start_timeout,
+                return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            server.close()
+            os.unlink(self.socket_path)
+        if not connected.done():
+            connected.cancel()
+            log.warning("curtin worker did not start")
+            if self.proc.returncode is None:
+                self.proc.terminate()
+            return False
+        self._reader, self._writer = connected.result()
+        self._tasks.append(asyncio.create_task(self._read_replies()))
+        self.alive = True
+        return True
+
+    async def _wait_proc(self):
+        try:
+            await self.runner.wait(self.proc)
+        except subprocess.CalledProcessError as cpe:
+            log.warning("curtin worker failed: %s", cpe)
+        self.alive = False
+
+    async def _read_replies(self):
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                break
+            reply = json.loads(line)
+            child = self._children.pop(reply['id'], None)
+            if child is not None:
+                child._done.set_result(reply['returncode'])
+        self.alive = False
+        for child in self._children.values():
+            child._done.set_exception(
+                ConnectionError("curtin worker went away"))
+        self._children.clear()
+
+    def _send(self, msg):
+        self._writer.write(json.dumps(msg).encode('utf-8') + b'\n')
+
+    def _env(self) -> Dict[str, Optional[str]]:
+        return {
+            key: os.environ.get(key)
+            for key in getattr(self.runner, 'env_allowlist', [])
+            }
+
+    async def spawn(self, argv: List[str], *,
+                    private_mounts: bool = False) -> _WorkerChild:
+        """Run "python3 -m curtin" with argv in the worker."""
+        child = _WorkerChild(self, next(self._ids))
+        self._children[child.req_id] = child
+        self._send({
+            'id': child.req_id,
+            'argv': argv,
+            'private_mounts': private_mounts,
+            'env': self._env(),
+            })
+        await self._writer.drain()
+        return child
+
+    async def close(self):
+        """Tell the worker to exit once its commands have finished."""
+        self.alive = False
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+
+
+async def get_curtin_worker(app, private_mounts: bool) \
+        -> Optional[CurtinWorker]:
+    """Return the running curtin worker, starting it if need be, or None
+    if the command should be run by itself."""
+    if not app.use_curtin_worker:
+        return None
+    if private_mounts and os.geteuid() != 0:
+        # Only root can give a child its own mount namespace.
+        return None
+    if app.curtin_worker is None:
+        worker = CurtinWorker(
+            app.command_runner, app.state_path('curtin-worker.socket'))
+        app.curtin_worker = (worker, asyncio.create_task(worker.start()))
+    worker, start_task = app.curtin_worker
+    if not await asyncio.shield(start_task) or not worker.alive:
+        return None
+    return worker
+
+
+class CurtinEventReceiver:
+    """Receive the events curtin's webhook reporting handler posts.
+
+    curtin normally reports progress to the server through the journal.
+    Without one, each curtin command is given its own URL on a listener
+    on the loopback interface to post its events to instead.
+    """
+
+    def __init__(self):
+        self.url_base = None
+        self._runner = None
+        self._callbacks: Dict[str, Callable[[dict], None]] = {}
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/{key}', self._post)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        self._runner = runner
+        host, port = runner.addresses[0][:2]
+        self.url_base = 'http://{}:{}/'.format(host, port)
+
+    def add(self, callback: Callable[[dict], None]) -> str:
+        """Return a URL that passes the events posted to it to callback."""
+        # The key also stops other local users from posting events.
+        key = secrets.token_urlsafe(16)
+        self._callbacks[key] = callback
+        return self.url_base + key
+
+    def remove(self, url: str):
+        self._callbacks.pop(url[len(self.url_base):], None)
+
+    async def _post(self, request):
+        callback = self._callbacks.get(request.match_info['key'])
+        if callback is None:
+            raise web.HTTPNotFound()
+        callback(await request.json())
+        return web.Response()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# The fields of the events curtin's webhook handler posts and what
+# curtin's journald handler calls them.
+_webhook_fields = {
+    'event_type': 'CURTIN_EVENT_TYPE',
+    'name': 'CURTIN_NAME',
+    'description': 'CURTIN_MESSAGE',
+    'result': 'CURTIN_RESULT',
+    }
+
+
 class _CurtinCommand:
 
     _count = 0
 
     def __init__(self, opts, runner, command: str, *args: str,
-                 config=None, private_mounts: bool):
+                 config=None, private_mounts: bool,
+                 worker: Optional[CurtinWorker] = None,
+                 event_receiver: Optional[CurtinEventReceiver] = None):
         self.opts = opts
         self.runner = runner
+        self.worker = worker
         self._event_contexts: Dict[str, Context] = {}
         _CurtinCommand._count += 1
         self._event_syslog_id = 'curtin_event.%s.%s' % (
             os.getpid(), _CurtinCommand._count)
-        self._fd = None
+        self._listener = None
+        self._event_receiver = None
+        self._event_url = None
+        if not journald_available() and event_receiver is not None:
+            self._event_receiver = event_receiver
+            self._event_url = event_receiver.add(self._webhook_event)
         self.proc = None
         self._cmd = self.make_command(command, *args, config=config)
         self.private_mounts = private_mounts
@@ -83,17 +328,38 @@ class _CurtinCommand:
             if curtin_ctx is not None:
                 curtin_ctx.exit(result=status)
 
+    def _webhook_event(self, event):
+        self._event({
+            field: event[key]
+            for key, field in _webhook_fields.items()
+            if key in event
+            })
+
     def make_command(self, command: str, *args: str, config=None) -> List[str]:
-        reporting_conf = {
-            'subiquity': {
-                'type': 'journald',
-                'identifier': self._event_syslog_id,
-                },
-            }
         cmd = [
             sys.executable, '-m', 'curtin', '--showtrace', '-vvv',
-            '--set', 'json:reporting=' + json.dumps(reporting_conf),
             ]
+        # curtin reports events to us via the journal if there is one and
+        # otherwise by posting them to the event receiver.
+        reporting_conf = None
+        if journald_available():
+            reporting_conf = {
+                'subiquity': {
+                    'type': 'journald',
+                    'identifier': self._event_syslog_id,
+                    },
+                }
+        elif self._event_url is not None:
+            reporting_conf = {
+                'subiquity': {
+                    'type': 'webhook',
+                    'endpoint': self._event_url,
+                    },
+                }
+        if reporting_conf is not None:
+            cmd.extend([
+                '--set', 'json:reporting=' + json.dumps(reporting_conf),
+                ])
         if config is not None:
             cmd.extend([
                 '-c', config,
@@ -103,24 +369,43 @@ class _CurtinCommand:
         return cmd
 
     async def start(self, context, **opts):
-        self._fd = journald_listen(
-            asyncio.get_running_loop(), [self._event_syslog_id], self._event)
+        if journald_available():
+            self._listener = journald_listen(
+                asyncio.get_running_loop(), [self._event_syslog_id],
+                self._event, this_boot=True)
         # Yield to the event loop before starting curtin to avoid missing the
         # first couple of events.
         await asyncio.sleep(0)
         self._event_contexts[''] = context
+        if self.worker is not None:
+            # The worker runs "python3 -m curtin" with the rest of _cmd.
+            self.proc = await self.worker.spawn(
+                self._cmd[3:], private_mounts=self.private_mounts)
+            return
         self.proc = await self.runner.start(
                 self._cmd, **opts, private_mounts=self.private_mounts)
 
+    async def _wait_worker(self) -> subprocess.CompletedProcess:
+        returncode = await self.proc.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self._cmd)
+        return subprocess.CompletedProcess(self._cmd, returncode)
+
     async def wait(self):
-        result = await self.runner.wait(self.proc)
+        if self.worker is not None:
+            result = await self._wait_worker()
+        else:
+            result = await self.runner.wait(self.proc)
         waited = 0.0
         while len(self._event_contexts) > 1 and waited < 5.0:
             await asyncio.sleep(0.1)
             waited += 0.1
             log.debug("waited %s seconds for events to drain", waited)
         self._event_contexts.pop('', None)
-        asyncio.get_running_loop().remove_reader(self._fd)
+        if self._listener is not None:
+            self._listener.close()
+        if self._event_receiver is not None:
+            self._event_receiver.remove(self._event_url)
         return result
 
     async def run(self, context):
@@ -191,8 +476,13 @@ async def start_curtin_command(app, context,
             cls = _DryRunCurtinCommand
     else:
         cls = _CurtinCommand
+    worker = None
+    # The worker cannot capture the output of a single command.
+    if cls is _CurtinCommand and not opts.get('capture'):
+        worker = await get_curtin_worker(app, private_mounts)
     curtin_cmd = cls(app.opts, app.command_runner, command, *args,
-                     config=config, private_mounts=private_mounts)
+                     config=config, private_mounts=private_mounts,
+                     worker=worker, event_receiver=app.curtin_event_receiver)
     await curtin_cmd.start(context, **opts)
     return curtin_cmd
 
@@ -0,0 +1,237 @@
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" A process that runs curtin commands without starting a new interpreter
+and importing curtin for each one.
+
+It imports curtin once, connects to the unix socket named on its command
+line and reads requests from it, one JSON object per line:
+
+    {"id": 1, "argv": ["--showtrace", "install", ...],
+     "private_mounts": true, "env": {"PATH": "...", "SNAP": null}}
+        fork a child that runs "python3 -m curtin" with argv.  With
+        private_mounts, the child gets its own mount namespace, as
+        systemd-run's PrivateMounts=yes would give it.  The variables in
+        env are set in the child (or unset, if null).
+    {"id": 1, "signal": 15}
+        send a signal to the child running request 1.
+
+When a child exits, {"id": 1, "returncode": 0} is sent back.  A child
+inherits the worker's stdout, stderr and the rest of its environment, so
+it behaves just like curtin run by itself under systemd-run.
+
+When the socket is closed the worker waits for its children and exits.
+
+Keep the imports here to the standard library and curtin: anything this
+module imports ends up in every curtin child.  For the same reason the
+server runs this file by path rather than as a module of the subiquity
+package.
+"""
+
+import ctypes
+import importlib
+import json
+import os
+import runpy
+import selectors
+import signal
+import socket
+import sys
+import traceback
+
+
+PRELOAD_MODULES = [
+    'curtin.commands.main',
+    'curtin.commands.apt_config',
+    'curtin.commands.block_meta',
+    'curtin.commands.curthooks',
+    'curtin.commands.extract',
+    'curtin.commands.in_target',
+    'curtin.commands.install',
+    'curtin.commands.swap',
+    'curtin.commands.system_install',
+    'curtin.commands.unmount',
+    ]
+
+
+CLONE_NEWNS = 0x00020000
+MS_REC = 0x4000
+MS_SLAVE = 0x80000
+
+
+def make_mounts_private():
+    """Move this process into a new mount namespace.
+
+    Like systemd's PrivateMounts=yes, the mounts are made slaves of the
+    ones outside: mounts made outside still show up in here, but nothing
+    mounted in here is seen outside or by any other command.
+    """
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.unshare(CLONE_NEWNS) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, "unshare: " + os.strerror(err))
+    if libc.mount(b"none", b"/", None, MS_REC | MS_SLAVE, None) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, "mount --make-rslave /: " + os.strerror(err))
+
+
+def apply_env(env):
+    for key, value in env.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+
+
+def preload():
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as exc:
+            print("not preloading {}: {}".format(name, exc), file=sys.stderr)
+
+
+def run_curtin(argv):
+    """Run curtin with argv the way "python3 -m curtin" would and return
+    the exit code."""
+    sys.argv = ['curtin'] + argv
+    try:
+        runpy.run_module('curtin', run_name='__main__', alter_sys=True)
+    except SystemExit as exc:
+        if exc.code is None:
+            return 0
+        if isinstance(exc.code, int):
+            return exc.code
+        print(exc.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+class Worker:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.children = {}  # {pid: request id}
+        self.buffer = b''
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+
+    def send(self, msg):
+        try:
+            self.sock.sendall(json.dumps(msg).encode('utf-8') + b'\n')
+        except OSError:
+            # The server has gone away, there is no one to tell.
+            pass
+
+    def spawn(self, req_id, argv, private_mounts=False, env=None):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self.sock.close()
+                os.close(self.wakeup_r)
+                os.close(self.wakeup_w)
+                signal.set_wakeup_fd(-1)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                apply_env(env or {})
+                if private_mounts:
+                    make_mounts_private()
+                code = run_curtin(argv)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.children[pid] = req_id
+
+    def kill(self, req_id, sig):
+        for pid, child_id in self.children.items():
+            if child_id == req_id:
+                os.kill(pid, sig)
+
+    def handle(self, line):
+        req = json.loads(line)
+        if 'argv' in req:
+            self.spawn(
+                req['id'], req['argv'],
+                private_mounts=req.get('private_mounts', False),
+                env=req.get('env'))
+        elif 'signal' in req:
+            self.kill(req['id'], req['signal'])
+
+    def read_requests(self):
+        data = self.sock.recv(65536)
+        if not data:
+            return False
+        self.buffer += data
+        while b'\n' in self.buffer:
+            line, self.buffer = self.buffer.split(b'\n', 1)
+            self.handle(line)
+        return True
+
+    def reap(self):
+        try:
+            while os.read(self.wakeup_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            req_id = self.children.pop(pid, None)
+            if req_id is not None:
+                self.send({
+                    'id': req_id,
+                    'returncode': os.waitstatus_to_exitcode(status),
+                    })
+
+    def run(self):
+        signal.set_wakeup_fd(self.wakeup_w)
+        # A handler has to be installed for SIGCHLD to wake us up.
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        sel = selectors.DefaultSelector()
+        sel.register(self.sock, selectors.EVENT_READ)
+        sel.register(self.wakeup_r, selectors.EVENT_READ)
+        connected = True
+        while connected or self.children:
+            for key, mask in sel.select():
+                if key.fileobj is self.sock:
+                    if not self.read_requests():
+                        connected = False
+                        sel.unregister(self.sock)
+                else:
+                    self.reap()
+            # SIGCHLD may arrive before the child is in self.children.
+            self.reap()
+
+
+def main():
+    socket_path = sys.argv[1]
+    preload()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    Worker(sock).run()
+
+
+if __name__ == '__main__':
+    main()
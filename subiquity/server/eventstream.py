@@ -0,0 +1,131 @@
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import collections
+import heapq
+import itertools
+from typing import Optional
+import uuid
+
+from subiquity.common.types import (
+    ServerEvent,
+    ServerEventKind,
+    )
+
+
+def _seq(event):
+    return event.seq
+
+
+def _after(events, after):
+    # events is in seq order and usually only the last few are wanted.
+    i = len(events)
+    while i > 0 and events[i - 1].seq > after:
+        i -= 1
+    return itertools.islice(events, i, None)
+
+
+class EventStream:
+    """Hand out the events sent by the meta.events endpoint.
+
+    Every published event gets the next sequence number and is put on
+    the queue of each current subscriber.  Enough history is kept for a
+    new subscriber to catch up: the latest status, the start of every
+    context that has not finished, the start and finish of the last
+    max_contexts contexts that have and the last max_log_lines log lines.
+
+    Each stream has a random id that is sent with every event, so a
+    client can tell when the seq it passes back belongs to a stream in a
+    previous server process.
+    """
+
+    def __init__(self, max_log_lines=5000, max_contexts=1000):
+        self.id = uuid.uuid4().hex
+        self.seq = 0
+        self._status_event = None
+        self._open_contexts = {}
+        self._finished_contexts = collections.deque(maxlen=max_contexts)
+        self._log_events = collections.deque(maxlen=max_log_lines)
+        self._queues = set()
+
+    def publish(self, kind: ServerEventKind, **kw) -> ServerEvent:
+        self.seq += 1
+        event = ServerEvent(
+            seq=self.seq, kind=kind, stream_id=self.id, **kw)
+        if kind == ServerEventKind.STATUS:
+            self._status_event = event
+        elif kind == ServerEventKind.LOG:
+            self._log_events.append(event)
+        elif kind == ServerEventKind.CONTEXT_START:
+            self._open_contexts[event.context_id] = event
+        else:
+            start = self._open_contexts.pop(event.context_id, None)
+            self._finished_contexts.append((start, event))
+        for queue in self._queues:
+            queue.put_nowait(event)
+        return event
+
+    def _context_events(self):
+        events = [
+            event
+            for pair in self._finished_contexts
+            for event in pair
+            if event is not None
+            ]
+        events.extend(self._open_contexts.values())
+        events.sort(key=_seq)
+        return events
+
+    def history(self, after: Optional[int] = None):
+        """Return the latest status followed by the other events kept that
+        have a seq greater than after.
+
+        The status is always included because a client reconnecting
+        after a server restart has no way to know its idea of the status
+        is stale.
+        """
+        if after is None:
+            after = 0
+        events = list(heapq.merge(
+            _after(self._context_events(), after),
+            _after(self._log_events, after),
+            key=_seq))
+        if self._status_event is not None:
+            events.insert(0, self._status_event)
+        return events
+
+    async def subscribe(self, after: Optional[int] = None,
+                        stream_id: Optional[str] = None):
+        """Yield the events after `after` and then new events forever.
+
+        after is only meaningful for the stream it came from, so it is
+        ignored if stream_id is not this stream's id.
+        """
+        if stream_id != self.id:
+            # The client saw events from a previous server process, if
+            # any.
+            after = None
+        queue = asyncio.Queue()
+        # There is no await between registering the queue and taking the
+        # history, so every event ends up in exactly one of them.
+        self._queues.add(queue)
+        try:
+            for event in self.history(after):
+                yield event
+            while True:
+                yield await queue.get()
+        finally:
+            self._queues.discard(queue)
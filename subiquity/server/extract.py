@@ -0,0 +1,392 @@
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Copy a directory tree, such as the overlay the system is installed
+from, into the target using several threads.
+
+Everything "cp -a" would preserve is preserved: ownership, permissions,
+timestamps, extended attributes, symlinks, device nodes, hardlinks
+within the tree and the holes in sparse files.  Like "cp -x", other
+filesystems mounted in the tree are not copied, only the directories
+they are mounted on.
+"""
+
+import concurrent.futures
+import errno
+import hashlib
+import logging
+import os
+import stat
+import threading
+import time
+from typing import Callable, Optional
+
+import attr
+
+
+log = logging.getLogger('subiquity.server.extract')
+
+# Errors that mean the filesystem does not do extended attributes (at
+# least not this kind of them) or copy_file_range between these two files.
+_XATTR_UNSUPPORTED = (errno.ENOTSUP, errno.EOPNOTSUPP)
+_COPY_RANGE_UNSUPPORTED = (
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+
+
+class ExtractError(Exception):
+    pass
+
+
+class ExtractCancelled(ExtractError):
+    pass
+
+
+@attr.s(auto_attribs=True)
+class ExtractProgress:
+    files: int = 0
+    bytes: int = 0
+    total_files: int = 0
+    total_bytes: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def percent(self) -> int:
+        if self.total_bytes == 0:
+            return 100 if self.files >= self.total_files else 0
+        return self.bytes * 100 // self.total_bytes
+
+    def describe(self) -> str:
+        elapsed = max(self.elapsed, 0.001)
+        return (
+            f"{self.percent}% copied ({self.files}/{self.total_files} "
+            f"files, {self.bytes / elapsed / 2**20:.1f} MiB/s, "
+            f"{self.files / elapsed:.0f} files/s)")
+
+
+class ParallelExtractor:
+    """Copy the tree at source into target.
+
+    The tree is walked by a pool of threads, then directories are created
+    and the files are copied by the same pool.  progress, if given, is
+    called from the copying threads with an ExtractProgress at most every
+    progress_interval seconds and once more when everything is copied.
+
+    With verify, the content of each copied file is hashed again after it
+    is written and compared with what was read from the source.
+    """
+
+    buffer_size = 8 * 2**20
+
+    def __init__(self, source, target, *, threads=None, verify=False,
+                 progress: Optional[Callable[[ExtractProgress], None]] = None,
+                 progress_interval=1.0):
+        self.source = source
+        self.target = target
+        if not threads:
+            threads = min(32, (os.cpu_count() or 1) + 4)
+        self.threads = threads
+        self.verify = verify
+        self.progress_callback = progress
+        self.progress_interval = progress_interval
+        self.progress = ExtractProgress()
+        self._as_root = os.geteuid() == 0
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._start = self._last_report = 0.0
+        self._dev = None
+
+    def cancel(self):
+        """Make run() stop copying and raise ExtractCancelled."""
+        self._cancelled.set()
+
+    def run(self) -> ExtractProgress:
+        self._start = self._last_report = time.monotonic()
+        self._dev = os.lstat(self.source).st_dev
+        with concurrent.futures.ThreadPoolExecutor(self.threads) as pool:
+            try:
+                entries = self._walk(pool)
+                self._extract(pool, entries)
+            except BaseException:
+                self._cancelled.set()
+                raise
+        self.progress.elapsed = time.monotonic() - self._start
+        self._report(final=True)
+        return self.progress
+
+    def _check_cancelled(self):
+        if self._cancelled.is_set():
+            raise ExtractCancelled("extraction cancelled")
+
+    def _scan(self, rel):
+        self._check_cancelled()
+        result = []
+        with os.scandir(os.path.join(self.source, rel)) as it:
+            for entry in it:
+                result.append((
+                    os.path.join(rel, entry.name),
+                    entry.stat(follow_symlinks=False),
+                    ))
+        return result
+
+    def _walk(self, pool):
+        """Return (relative path, stat) for everything under source on
+        the same filesystem.  A directory always comes before its
+        contents."""
+        entries = []
+        pending = {pool.submit(self._scan, '')}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in done:
+                for rel, st in fut.result():
+                    entries.append((rel, st))
+                    if not stat.S_ISDIR(st.st_mode):
+                        continue
+                    if st.st_dev != self._dev:
+                        # A mount point: make the directory but leave
+                        # the filesystem mounted on it alone.
+                        log.debug("not copying %s, another filesystem", rel)
+                        continue
+                    pending.add(pool.submit(self._scan, rel))
+        return entries
+
+    def _extract(self, pool, entries):
+        dirs = []
+        files = []
+        links = []  # (first path, later path) for hardlinked files
+        others = []
+        first_link = {}
+        for rel, st in entries:
+            if stat.S_ISDIR(st.st_mode):
+                dirs.append((rel, st))
+            elif stat.S_ISREG(st.st_mode):
+                if st.st_nlink > 1:
+                    key = (st.st_dev, st.st_ino)
+                    if key in first_link:
+                        links.append((first_link[key], rel))
+                        continue
+                    first_link[key] = rel
+                files.append((rel, st))
+            else:
+                others.append((rel, st))
+        with self._lock:
+            self.progress.total_files = len(files) + len(links)
+            self.progress.total_bytes = sum(st.st_size for rel, st in files)
+
+        # Create directories before anything goes in them but set their
+        # metadata last, so the timestamps are not changed by the copying
+        # and read-only directories can still be written to.
+        os.makedirs(self.target, exist_ok=True)
+        for rel, st in dirs:
+            try:
+                os.mkdir(self._dst(rel), 0o700)
+            except FileExistsError:
+                if not os.path.isdir(self._dst(rel)):
+                    raise
+        futures = [pool.submit(self._copy_file, rel, st) for rel, st in files]
+        futures.extend(
+            pool.submit(self._copy_other, rel, st) for rel, st in others)
+        for fut in concurrent.futures.as_completed(futures):
+            fut.result()
+        for first, rel in links:
+            self._check_cancelled()
+            self._replace(rel)
+            os.link(self._dst(first), self._dst(rel))
+            self._advance(1, 0)
+        for rel, st in reversed(dirs):
+            self._copy_metadata(rel, st)
+        self._copy_metadata('', os.lstat(self.source))
+
+    def _dst(self, rel):
+        return os.path.join(self.target, rel)
+
+    def _replace(self, rel):
+        try:
+            os.unlink(self._dst(rel))
+        except FileNotFoundError:
+            pass
+
+    def _copy_file(self, rel, st):
+        self._check_cancelled()
+        src = os.path.join(self.source, rel)
+        self._replace(rel)
+        with open(src, 'rb', buffering=0) as fsrc:
+            with open(self._dst(rel), 'wb', buffering=0) as fdst:
+                if st.st_blocks * 512 < st.st_size and \
+                   self._copy_sparse(fsrc, fdst, st.st_size):
+                    if self.verify:
+                        digest = self._hash_file(src)
+                elif self.verify:
+                    digest = self._copy_hashing(fsrc, fdst)
+                else:
+                    self._copy_range(fsrc, fdst)
+        self._copy_metadata(rel, st)
+        if self.verify and self._hash_file(self._dst(rel)) != digest:
+            raise ExtractError(f"{rel} differs from the source after copying")
+        self._advance(1, 0)
+
+    def _copy_range(self, fsrc, fdst):
+        while True:
+            self._check_cancelled()
+            try:
+                n = os.copy_file_range(
+                    fsrc.fileno(), fdst.fileno(), self.buffer_size)
+            except OSError as exc:
+                if exc.errno not in _COPY_RANGE_UNSUPPORTED:
+                    raise
+                # copy_file_range moves the file offsets as it goes, so
+                # carry on from wherever it got to.
+                self._copy_buffered(fsrc, fdst)
+                return
+            if n == 0:
+                return
+            self._advance(0, n)
+
+    def _copy_sparse(self, fsrc, fdst, size):
+        """Copy only the data in fsrc, leaving holes where it has them.
+        Return False, having copied nothing, if the filesystem cannot
+        say where the holes are."""
+        src, dst = fsrc.fileno(), fdst.fileno()
+        offset = 0
+        while offset < size:
+            self._check_cancelled()
+            try:
+                start = os.lseek(src, offset, os.SEEK_DATA)
+            except OSError as exc:
+                if exc.errno == errno.ENXIO:
+                    # There is only a hole after offset.
+                    break
+                if exc.errno == errno.EINVAL and offset == 0:
+                    return False
+                raise
+            end = min(os.lseek(src, start, os.SEEK_HOLE), size)
+            self._advance(0, start - offset)
+            self._copy_span(src, dst, start, end)
+            offset = end
+        self._advance(0, max(size - offset, 0))
+        os.ftruncate(dst, size)
+        return True
+
+    def _copy_span(self, src, dst, offset, end):
+        while offset < end:
+            self._check_cancelled()
+            count = min(self.buffer_size, end - offset)
+            try:
+                n = os.copy_file_range(src, dst, count, offset, offset)
+            except OSError as exc:
+                if exc.errno not in _COPY_RANGE_UNSUPPORTED:
+                    raise
+                n = os.pwrite(dst, os.pread(src, count, offset), offset)
+            if n == 0:
+                # The file has shrunk since it was looked at.
+                return
+            offset += n
+            self._advance(0, n)
+
+    def _copy_buffered(self, fsrc, fdst, hasher=None):
+        buf = bytearray(self.buffer_size)
+        view = memoryview(buf)
+        while True:
+            self._check_cancelled()
+            n = fsrc.readinto(buf)
+            if not n:
+                return
+            if hasher is not None:
+                hasher.update(view[:n])
+            fdst.write(view[:n])
+            self._advance(0, n)
+
+    def _copy_hashing(self, fsrc, fdst):
+        hasher = hashlib.sha256()
+        self._copy_buffered(fsrc, fdst, hasher)
+        return hasher.hexdigest()
+
+    def _hash_file(self, path):
+        hasher = hashlib.sha256()
+        buf = bytearray(self.buffer_size)
+        view = memoryview(buf)
+        with open(path, 'rb', buffering=0) as fp:
+            while True:
+                n = fp.readinto(buf)
+                if not n:
+                    return hasher.hexdigest()
+                hasher.update(view[:n])
+
+    def _copy_other(self, rel, st):
+        self._check_cancelled()
+        self._replace(rel)
+        dst = self._dst(rel)
+        if stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(os.path.join(self.source, rel)), dst)
+        elif stat.S_ISSOCK(st.st_mode):
+            # Like cp, do not try to copy sockets.
+            log.debug("not copying socket %s", rel)
+            return
+        else:
+            os.mknod(dst, st.st_mode, st.st_rdev)
+        self._copy_metadata(rel, st)
+
+    def _copy_metadata(self, rel, st):
+        src = os.path.join(self.source, rel)
+        dst = self._dst(rel)
+        is_link = stat.S_ISLNK(st.st_mode)
+        # chown can clear setuid bits and file capabilities, so it goes
+        # before chmod and the xattrs.
+        try:
+            os.chown(dst, st.st_uid, st.st_gid, follow_symlinks=False)
+        except PermissionError:
+            if self._as_root:
+                raise
+        if not is_link:
+            os.chmod(dst, stat.S_IMODE(st.st_mode))
+        self._copy_xattrs(src, dst)
+        os.utime(
+            dst, ns=(st.st_atime_ns, st.st_mtime_ns), follow_symlinks=False)
+
+    def _copy_xattrs(self, src, dst):
+        try:
+            names = os.listxattr(src, follow_symlinks=False)
+        except OSError as exc:
+            if exc.errno in _XATTR_UNSUPPORTED:
+                return
+            raise
+        for name in names:
+            value = os.getxattr(src, name, follow_symlinks=False)
+            try:
+                os.setxattr(dst, name, value, follow_symlinks=False)
+            except OSError as exc:
+                if exc.errno in _XATTR_UNSUPPORTED:
+                    continue
+                if exc.errno == errno.EPERM and not self._as_root:
+                    continue
+                raise
+
+    def _advance(self, files, nbytes):
+        with self._lock:
+            self.progress.files += files
+            self.progress.bytes += nbytes
+        self._report()
+
+    def _report(self, final=False):
+        if self.progress_callback is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not final and now - self._last_report < self.progress_interval:
+                return
+            self._last_report = now
+            self.progress.elapsed = now - self._start
+            progress = attr.evolve(self.progress)
+        self.progress_callback(progress)
@@ -28,8 +28,6 @@ from cloudinit.distros import ug_util
 
 import jsonschema
 
-from systemd import journal
-
 import yaml
 
 from subiquitycore.async_helpers import run_in_thread
@@ -46,6 +44,7 @@ from subiquitycore.ssh import (
     )
 from subiquitycore.utils import arun_command, run_command
 
+from subiquity.common.api.defs import Stream
 from subiquity.common.api.server import (
     bind,
     controller_for_request,
@@ -63,6 +62,13 @@ from subiquity.common.types import (
     KeyFingerprint,
     LiveSessionSSHInfo,
     PasswordKind,
+    ServerEvent,
+    ServerEventKind,
+    )
+from subiquity.journald import (
+    journal,
+    journald_available,
+    journald_listen,
     )
 from subiquity.models.subiquity import (
     ModelNames,
@@ -70,19 +76,22 @@ from subiquity.models.subiquity import (
     )
 from subiquity.server.dryrun import DRConfig
 from subiquity.server.controller import SubiquityController
+from subiquity.server.curtin import CurtinEventReceiver
 from subiquity.server.geoip import (
     GeoIP,
     DryRunGeoIPStrategy,
     HTTPGeoIPStrategy,
     )
 from subiquity.server.errors import ErrorController
+from subiquity.server.eventstream import EventStream
 from subiquity.server.runner import get_command_runner
 from subiquity.server.snapdapi import make_api_client
 from subiquity.server.types import InstallerChannels
 from subiquitycore.snapd import (
     AsyncSnapd,
+    AsyncSnapdConnection,
     get_fake_connection,
-    SnapdConnection,
+    ThreadedSnapdConnection,
     )
 
 NOPROBERARG = "NOPROBER"
@@ -105,15 +114,14 @@ class MetaController:
             -> ApplicationStatus:
         if cur == self.app.state:
             await self.app.state_event.wait()
-        return ApplicationStatus(
-            state=self.app.state,
-            confirming_tty=self.app.confirming_tty,
-            error=self.app.fatal_error,
-            cloud_init_ok=self.app.cloud_init_ok,
-            interactive=self.app.interactive,
-            echo_syslog_id=self.app.echo_syslog_id,
-            event_syslog_id=self.app.event_syslog_id,
-            log_syslog_id=self.app.log_syslog_id)
+        return self.app.application_status()
+
+    async def events_GET(self, after: Optional[int] = None,
+                         stream_id: Optional[str] = None) \
+            -> Stream[ServerEvent]:
+        events = self.app.event_stream.subscribe(after, stream_id)
+        async for event in events:
+            yield event
 
     async def confirm_POST(self, tty: str) -> None:
         self.app.confirming_tty = tty
@@ -281,7 +289,7 @@ class SubiquityServer(Application):
         self.cloud = None
         self.cloud_init_ok = None
         self.state_event = asyncio.Event()
-        self.update_state(ApplicationState.STARTING_UP)
+        self.event_stream = EventStream()
         self.interactive = None
         self.confirming_tty = ''
         self.fatal_error = None
@@ -293,7 +301,21 @@ class SubiquityServer(Application):
         self.echo_syslog_id = 'subiquity_echo.{}'.format(os.getpid())
         self.event_syslog_id = 'subiquity_event.{}'.format(os.getpid())
         self.log_syslog_id = 'subiquity_log.{}'.format(os.getpid())
+        self.use_journal = journald_available()
+        # Clients get progress events from meta.events. Copying them to
+        # the journal is only for the benefit of people reading it.
+        self.journal_events = self.use_journal and \
+            getattr(opts, 'journal_events', True)
+        self.update_state(ApplicationState.STARTING_UP)
         self.command_runner = get_command_runner(self)
+        # Dry runs replay curtin logs rather than running curtin.
+        self.use_curtin_worker = not opts.dry_run and \
+            getattr(opts, 'curtin_worker', True)
+        self.curtin_worker = None
+        # Without a journal, curtin posts its events to this instead.
+        self.curtin_event_receiver = None
+        if not self.use_journal:
+            self.curtin_event_receiver = CurtinEventReceiver()
 
         self.error_reporter = ErrorReporter(
             self.context.child("ErrorReporter"), self.opts.dry_run, self.root)
@@ -305,11 +327,12 @@ class SubiquityServer(Application):
         if opts.snaps_from_examples:
             connection = get_fake_connection(
                 self.scale_factor, opts.output_base)
-            self.snapd = AsyncSnapd(connection)
+            self.snapd = AsyncSnapd(ThreadedSnapdConnection(connection))
             self.snapdapi = make_api_client(self.snapd)
         elif os.path.exists(self.snapd_socket_path):
-            connection = SnapdConnection(self.root, self.snapd_socket_path)
-            self.snapd = AsyncSnapd(connection)
+            connection = AsyncSnapdConnection(
+                self.root, self.snapd_socket_path)
+            self.snapd = AsyncSnapd(connection, use_notices=True)
             self.snapdapi = make_api_client(self.snapd)
         else:
             log.info("no snapd socket found. Snap support is disabled")
@@ -337,7 +360,7 @@ class SubiquityServer(Application):
     def add_event_listener(self, listener):
         self.event_listeners.append(listener)
 
-    def _maybe_push_to_journal(self, event_type, context, description):
+    def _publish_context_event(self, event_type, context, description):
         if not context.get('is-install-context') and \
           self.interactive in [True, None]:
             controller = context.get('controller')
@@ -358,6 +381,15 @@ class SubiquityServer(Application):
             parent_id = str(context.parent.id)
         else:
             parent_id = ''
+        if event_type == 'start':
+            kind = ServerEventKind.CONTEXT_START
+        else:
+            kind = ServerEventKind.CONTEXT_FINISH
+        self.event_stream.publish(
+            kind, context_id=str(context.id), context_parent_id=parent_id,
+            message=msg)
+        if not self.journal_events:
+            return
         journal.send(
             msg,
             PRIORITY=context.level,
@@ -370,22 +402,39 @@ class SubiquityServer(Application):
     def report_start_event(self, context, description):
         for listener in self.event_listeners:
             listener.report_start_event(context, description)
-        self._maybe_push_to_journal('start', context, description)
+        self._publish_context_event('start', context, description)
 
     def report_finish_event(self, context, description, status):
         for listener in self.event_listeners:
             listener.report_finish_event(context, description, status)
-        self._maybe_push_to_journal('finish', context, description)
+        self._publish_context_event('finish', context, description)
 
     @property
     def state(self):
         return self._state
 
+    def application_status(self):
+        return ApplicationStatus(
+            state=self.state,
+            confirming_tty=self.confirming_tty,
+            error=self.fatal_error,
+            cloud_init_ok=self.cloud_init_ok,
+            interactive=self.interactive,
+            echo_syslog_id=self.echo_syslog_id,
+            event_syslog_id=self.event_syslog_id,
+            log_syslog_id=self.log_syslog_id)
+
     def update_state(self, state):
         self._state = state
         write_file(self.state_path("server-state"), state.name)
         self.state_event.set()
         self.state_event.clear()
+        self.event_stream.publish(
+            ServerEventKind.STATUS, status=self.application_status())
+
+    def _log_line(self, event):
+        self.event_stream.publish(
+            ServerEventKind.LOG, message=event['MESSAGE'])
 
     def note_file_for_apport(self, key, path):
         self.error_reporter.note_file_for_apport(key, path)
@@ -441,6 +490,13 @@ class SubiquityServer(Application):
             resp = web.Response(headers={'x-status': override_status})
         else:
             resp = await handler(request)
+            if request.method != 'GET' and \
+               isinstance(controller, SubiquityController):
+                # Anything other than a GET may have changed the model
+                # behind its back, so invalidate cached GET responses.
+                model = getattr(controller, 'model', None)
+                if hasattr(model, 'generation'):
+                    model.generation += 1
         if self.updated:
             resp.headers['x-updated'] = 'yes'
         else:
@@ -628,8 +684,14 @@ class SubiquityServer(Application):
             self.installer_user_passwd_kind = PasswordKind.NONE
 
     async def start(self):
+        if self.use_journal and self.log_syslog_id:
+            journald_listen(
+                self.aio_loop, [self.log_syslog_id], self._log_line,
+                this_boot=True, fields=('MESSAGE',))
         self.controllers.load_all()
         await self.start_api_server()
+        if self.curtin_event_receiver is not None:
+            await self.curtin_event_receiver.start()
         self.update_state(ApplicationState.CLOUD_INIT_WAIT)
         await self.wait_for_cloudinit()
         self.set_installer_password()
@@ -658,6 +720,15 @@ class SubiquityServer(Application):
         await super().start()
         await self.apply_autoinstall_config()
 
+    async def run(self):
+        try:
+            await super().run()
+        finally:
+            if self.snapd is not None:
+                await self.snapd.close()
+            if self.curtin_event_receiver is not None:
+                await self.curtin_event_receiver.close()
+
     def exit(self):
         self.update_state(ApplicationState.EXITED)
         super().exit()
@@ -0,0 +1,91 @@
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Optional
+from urllib.parse import urlencode
+
+import attr
+
+from subiquitycore.file_util import write_file
+
+
+log = logging.getLogger('subiquity.server.snapcache')
+
+
+def _etag(data):
+    content = json.dumps(data, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+@attr.s(auto_attribs=True)
+class CachedResponse:
+    data: Any
+    etag: str
+    fresh: bool
+
+
+class SnapdResponseCache:
+    """Keep the last good response to snapd GET requests on disk.
+
+    Responses are stored one to a file, named the way the files in
+    examples/snaps are.  An entry younger than ttl seconds is fresh and
+    can be used instead of asking snapd; an older one is still handed
+    out so that a caller can use it when snapd cannot reach the store.
+
+    The etag of a response is a hash of its content, so a caller can
+    tell whether a new response is any different from the cached one.
+    """
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, path, args):
+        filename = path.replace('/', '-')
+        if args:
+            filename += '-' + urlencode(sorted(args.items()))
+        return os.path.join(self.directory, filename + '.json')
+
+    def lookup(self, path, **args) -> Optional[CachedResponse]:
+        filepath = self._path(path, args)
+        try:
+            with open(filepath) as fp:
+                entry = json.load(fp)
+            data = entry['data']
+            if _etag(data) != entry['etag']:
+                raise ValueError("etag does not match data")
+            age = time.time() - float(entry['stored'])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            log.warning("ignoring snap cache entry %s: %s", filepath, exc)
+            return None
+        return CachedResponse(
+            data=data, etag=entry['etag'], fresh=0 <= age < self.ttl)
+
+    def store(self, path, data, **args) -> str:
+        """Store data as the response to path and return its etag."""
+        etag = _etag(data)
+        entry = {'stored': time.time(), 'etag': etag, 'data': data}
+        try:
+            write_file(self._path(path, args), json.dumps(entry))
+        except OSError as exc:
+            log.warning("could not write snap cache entry: %s", exc)
+        return etag
@@ -14,7 +14,6 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import aiohttp
-import asyncio
 import contextlib
 import enum
 import logging
@@ -235,7 +234,7 @@ class _FakeResponse:
     def raise_for_status(self):
         pass
 
-    async def json(self):
+    async def json(self, loads=None):
         return self.data
 
 
@@ -269,21 +268,22 @@ def make_api_client(async_snapd):
             yield _FakeError()
         yield _FakeResponse(content)
 
-    return make_client(SnapdAPI, make_request, serializer=snapd_serializer)
+    client = make_client(
+        SnapdAPI, make_request, serializer=snapd_serializer)
+    client.async_snapd = async_snapd
+    return client
 
 
 snapd_serializer = Serializer(
-    ignore_unknown_fields=True, serialize_enums_by='value')
+    ignore_unknown_fields=True, serialize_enums_by='value', compiled=True)
 
 
 async def post_and_wait(client, meth, *args, **kw):
     change_id = await meth(*args, **kw)
     log.debug('post_and_wait %s', change_id)
 
-    while True:
-        result = await client.v2.changes[change_id].GET()
-        if result.status == TaskStatus.DONE:
-            return result.data
-        elif result.status == TaskStatus.ERROR:
-            raise aiohttp.ClientError(result.err)
-        await asyncio.sleep(0.1)
+    result = snapd_serializer.deserialize(
+        Change, await client.async_snapd.wait_change(change_id))
+    if result.status == TaskStatus.DONE:
+        return result.data
+    raise aiohttp.ClientError(result.err)
@@ -13,12 +13,15 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import subprocess
 from unittest.mock import Mock, patch, AsyncMock
 
 from subiquitycore.tests import SubiTestCase
 from subiquitycore.tests.mocks import make_app
 from subiquity.server.apt import (
     AptConfigurer,
+    Mountpoint,
     OverlayMountpoint,
 )
 from subiquity.models.mirror import MirrorModel, DEFAULT
@@ -65,3 +68,69 @@ class TestAptConfigurer(SubiTestCase):
                           create=True, new_callable=AsyncMock):
             async with self.configurer.overlay():
                 pass
+
+    def setup_trees(self):
+        self.configurer.install_tree = OverlayMountpoint(
+                upperdir="upperdir-install-tree",
+                lowers=["lowers1-install-tree"],
+                mountpoint="mountpoint-install-tree",
+                )
+        self.configurer.configured_tree = OverlayMountpoint(
+                upperdir="upperdir-configured-tree",
+                lowers=["lowers1-configured-tree"],
+                mountpoint="mountpoint-configured-tree",
+                )
+        self.configurer.mounter.setup_overlay.side_effect = [
+            OverlayMountpoint(
+                upperdir="upper-1", lowers=[], mountpoint="overlay-1"),
+            OverlayMountpoint(
+                upperdir="upper-2", lowers=[], mountpoint="overlay-2"),
+            ]
+
+    async def test_overlay_shared(self):
+        self.setup_trees()
+        mounter = self.configurer.mounter
+        async with self.configurer.overlay() as first:
+            async with self.configurer.overlay() as second:
+                self.assertIs(first, second)
+        async with self.configurer.overlay() as third:
+            self.assertIs(first, third)
+        mounter.setup_overlay.assert_called_once()
+        mounter.unmount.assert_not_called()
+        await self.configurer.cleanup()
+        mounter.unmount.assert_called_once_with(
+            Mountpoint(mountpoint="overlay-1"))
+        mounter.cleanup.assert_called_once_with()
+        # A new overlay is set up after cleanup.
+        async with self.configurer.overlay() as fourth:
+            self.assertEqual(fourth.mountpoint, "overlay-2")
+
+    async def test_cleanup_waits_for_users(self):
+        self.setup_trees()
+        mounter = self.configurer.mounter
+        entered = asyncio.Event()
+        leave = asyncio.Event()
+
+        async def user():
+            async with self.configurer.overlay():
+                entered.set()
+                await leave.wait()
+
+        user_task = asyncio.create_task(user())
+        await entered.wait()
+        cleanup_task = asyncio.create_task(self.configurer.cleanup())
+        await asyncio.sleep(0)
+        mounter.unmount.assert_not_called()
+        leave.set()
+        await user_task
+        await cleanup_task
+        mounter.unmount.assert_called_once()
+
+    async def test_cleanup_unmount_failure(self):
+        self.setup_trees()
+        mounter = self.configurer.mounter
+        mounter.unmount.side_effect = subprocess.CalledProcessError(1, [])
+        async with self.configurer.overlay():
+            pass
+        await self.configurer.cleanup()
+        mounter.cleanup.assert_called_once_with()
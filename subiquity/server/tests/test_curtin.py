@@ -0,0 +1,227 @@
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import signal
+import subprocess
+import sys
+from unittest import mock
+
+import aiohttp
+
+from subiquitycore.context import Context, Status
+from subiquitycore.tests import SubiTestCase
+from subiquitycore.tests.mocks import make_app
+
+from subiquity.server.curtin import (
+    _CurtinCommand,
+    CurtinEventReceiver,
+    CurtinWorker,
+    )
+from subiquity.server.runner import LoggedCommandRunner
+
+
+fake_curtin_main = '''\
+import json, os, subprocess, sys, time
+args = sys.argv[1:]
+if args[-2] == 'sleep':
+    time.sleep(60)
+if args[-2] == 'mount':
+    subprocess.run(['mount', '-t', 'tmpfs', 'none', args[-1]], check=True)
+with open(os.environ['FAKE_CURTIN_LOG'], 'a') as fp:
+    fp.write(json.dumps({
+        'ppid': os.getppid(),
+        'argv': sys.argv,
+        'value': os.environ.get('FAKE_CURTIN_VALUE'),
+        'ismount': os.path.ismount(args[-1]),
+        'subiquity_imported': any(
+            name.split('.')[0] in ('subiquity', 'subiquitycore')
+            for name in sys.modules),
+        }) + '\\n')
+sys.exit(int(args[-1]) if args[-1].isdigit() else 0)
+'''
+
+
+class DirectCommandRunner(LoggedCommandRunner):
+
+    def _forge_systemd_cmd(self, cmd, private_mounts, capture):
+        return cmd
+
+
+class TestCurtinWorker(SubiTestCase):
+
+    async def asyncSetUp(self):
+        curtin_dir = os.path.join(self.tmp_dir(), 'curtin')
+        os.mkdir(curtin_dir)
+        open(os.path.join(curtin_dir, '__init__.py'), 'w').close()
+        with open(os.path.join(curtin_dir, '__main__.py'), 'w') as fp:
+            fp.write(fake_curtin_main)
+        self.log = os.path.join(self.tmp_dir(), 'log')
+        top = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__)))))
+        patcher = mock.patch.dict(os.environ, {
+            'PYTHONPATH': os.pathsep.join([os.path.dirname(curtin_dir), top]),
+            'FAKE_CURTIN_LOG': self.log,
+            })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.worker = CurtinWorker(
+            DirectCommandRunner('test'),
+            os.path.join(self.tmp_dir(), 'worker.socket'))
+
+    async def asyncTearDown(self):
+        await self.worker.close()
+        if self.worker.proc is not None:
+            await self.worker.proc.wait()
+
+    def runs(self):
+        with open(self.log) as fp:
+            return [json.loads(line) for line in fp]
+
+    async def test_spawn(self):
+        self.assertTrue(await self.worker.start())
+        first = await self.worker.spawn(['install', 'exit', '0'])
+        second = await self.worker.spawn(['install', 'exit', '3'])
+        self.assertEqual(await first.wait(), 0)
+        self.assertEqual(await second.wait(), 3)
+        runs = self.runs()
+        self.assertEqual(
+            sorted(run['argv'][1:] for run in runs),
+            [['install', 'exit', '0'], ['install', 'exit', '3']])
+        # Both ran in a child of the same worker.
+        self.assertEqual(runs[0]['ppid'], runs[1]['ppid'])
+        # The worker did not bring subiquity along.
+        self.assertEqual([run['subiquity_imported'] for run in runs],
+                         [False, False])
+
+    async def test_env_read_per_command(self):
+        self.worker.runner.env_allowlist = ['FAKE_CURTIN_VALUE']
+        self.assertTrue(await self.worker.start())
+        with mock.patch.dict(os.environ, {'FAKE_CURTIN_VALUE': 'later'}):
+            child = await self.worker.spawn(['install', 'exit', '0'])
+        self.assertEqual(await child.wait(), 0)
+        child = await self.worker.spawn(['install', 'exit', '0'])
+        self.assertEqual(await child.wait(), 0)
+        self.assertEqual(
+            [run['value'] for run in self.runs()], ['later', None])
+
+    async def test_private_mounts(self):
+        if os.geteuid() != 0:
+            self.skipTest("making mounts needs root")
+        mountpoint = self.tmp_dir()
+        self.assertTrue(await self.worker.start())
+        # The first command mounts something and leaves it mounted.
+        child = await self.worker.spawn(
+            ['mount', mountpoint], private_mounts=True)
+        if await child.wait() != 0:
+            self.skipTest("cannot make mounts here")
+        for private_mounts in True, False:
+            child = await self.worker.spawn(
+                ['check', mountpoint], private_mounts=private_mounts)
+            self.assertEqual(await child.wait(), 0)
+        self.assertEqual(
+            [run['ismount'] for run in self.runs()], [True, False, False])
+        self.assertFalse(os.path.ismount(mountpoint))
+
+    async def test_terminate(self):
+        self.assertTrue(await self.worker.start())
+        child = await self.worker.spawn(['sleep', '0'])
+        child.terminate()
+        self.assertEqual(await child.wait(), -signal.SIGTERM)
+
+    async def test_start_failure(self):
+        self.worker.make_command = lambda: [
+            sys.executable, '-c', 'import sys; sys.exit(1)']
+        self.assertFalse(await self.worker.start())
+        self.assertFalse(os.path.exists(self.worker.socket_path))
+
+    @mock.patch('subiquity.server.curtin.journald_available',
+                return_value=False)
+    async def test_curtin_command(self, m_journald):
+        self.assertTrue(await self.worker.start())
+        app = make_app()
+        context = Context.new(app)
+        cmd = _CurtinCommand(
+            app.opts, None, 'install', 'exit', '0', config='/config',
+            private_mounts=False, worker=self.worker)
+        result = await cmd.run(context)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(
+            self.runs()[0]['argv'][1:],
+            ['--showtrace', '-vvv', '-c', '/config', 'install', 'exit', '0'])
+        cmd = _CurtinCommand(
+            app.opts, None, 'install', 'exit', '2',
+            private_mounts=False, worker=self.worker)
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            await cmd.run(context)
+        self.assertEqual(cm.exception.returncode, 2)
+        self.assertEqual(cm.exception.cmd[1:3], ['-m', 'curtin'])
+
+
+class TestCurtinEventReceiver(SubiTestCase):
+
+    async def asyncSetUp(self):
+        self.receiver = CurtinEventReceiver()
+        await self.receiver.start()
+        self.addAsyncCleanup(self.receiver.close)
+
+    async def post(self, url, event):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json=event) as resp:
+                return resp.status
+
+    @mock.patch('subiquity.server.curtin.journald_available',
+                return_value=False)
+    async def test_webhook_events(self, m_journald):
+        cmd = _CurtinCommand(
+            None, None, 'install', private_mounts=False,
+            event_receiver=self.receiver)
+        reporting = json.loads(
+            cmd._cmd[cmd._cmd.index('--set') + 1].split('=', 1)[1])
+        url = reporting['subiquity']['endpoint']
+        self.assertEqual(reporting['subiquity']['type'], 'webhook')
+        self.assertTrue(url.startswith('http://127.0.0.1:'))
+
+        context = mock.Mock()
+        cmd._event_contexts[''] = context
+        status = await self.post(url, {
+            'event_type': 'start', 'name': 'cmd-install',
+            'description': 'curtin command install', 'origin': 'curtin',
+            'timestamp': 0,
+            })
+        self.assertEqual(status, 200)
+        context.child.assert_called_once_with(
+            'cmd-install', 'curtin command install')
+        child = context.child.return_value
+        child.enter.assert_called_once_with()
+        await self.post(url, {
+            'event_type': 'finish', 'name': 'cmd-install',
+            'description': 'curtin command install', 'result': 'SUCCESS',
+            })
+        child.exit.assert_called_once_with(result=Status.SUCCESS)
+
+        cmd._event_contexts.pop('')
+        self.receiver.remove(url)
+        self.assertEqual(await self.post(url, {}), 404)
+
+    @mock.patch('subiquity.server.curtin.journald_available',
+                return_value=True)
+    async def test_journal_preferred(self, m_journald):
+        cmd = _CurtinCommand(
+            None, None, 'install', private_mounts=False,
+            event_receiver=self.receiver)
+        self.assertIn('"type": "journald"', ' '.join(cmd._cmd))
+        self.assertEqual(self.receiver._callbacks, {})
@@ -0,0 +1,94 @@
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from subiquitycore.tests import SubiTestCase
+from subiquity.common.types import ServerEventKind
+from subiquity.server.eventstream import EventStream
+
+
+class TestEventStream(SubiTestCase):
+
+    def publish_some(self, stream):
+        stream.publish(ServerEventKind.STATUS, message='s1')
+        stream.publish(ServerEventKind.CONTEXT_START, context_id='1')
+        stream.publish(ServerEventKind.LOG, message='l1')
+        stream.publish(ServerEventKind.STATUS, message='s2')
+        stream.publish(ServerEventKind.LOG, message='l2')
+        stream.publish(ServerEventKind.CONTEXT_FINISH, context_id='1')
+
+    def test_history(self):
+        stream = EventStream()
+        self.publish_some(stream)
+        # Only the latest status is kept and it always comes first.
+        self.assertEqual(
+            [e.seq for e in stream.history()], [4, 2, 3, 5, 6])
+        self.assertEqual(
+            [e.seq for e in stream.history(after=4)], [4, 5, 6])
+        self.assertEqual([e.seq for e in stream.history(after=6)], [4])
+
+    def test_history_log_lines_bounded(self):
+        stream = EventStream(max_log_lines=1)
+        self.publish_some(stream)
+        self.assertEqual(
+            [e.message for e in stream.history()
+             if e.kind == ServerEventKind.LOG],
+            ['l2'])
+
+    async def test_subscribe(self):
+        stream = EventStream()
+        self.publish_some(stream)
+        events = stream.subscribe(after=5, stream_id=stream.id)
+        self.assertEqual((await events.__anext__()).seq, 4)
+        self.assertEqual((await events.__anext__()).seq, 6)
+        stream.publish(ServerEventKind.LOG, message='l3')
+        event = await events.__anext__()
+        self.assertEqual((event.seq, event.message), (7, 'l3'))
+        await events.aclose()
+        self.assertEqual(stream._queues, set())
+
+    async def test_subscribe_after_restart(self):
+        old = EventStream()
+        self.publish_some(old)
+        stream = EventStream()
+        self.publish_some(stream)
+        self.assertNotEqual(old.id, stream.id)
+        # A client that saw events from a previous server gets
+        # everything, even if the seq it saw is one this server has
+        # also sent.
+        events = stream.subscribe(after=5, stream_id=old.id)
+        event = await events.__anext__()
+        self.assertEqual((event.seq, event.stream_id), (4, stream.id))
+        self.assertEqual((await events.__anext__()).seq, 2)
+        await events.aclose()
+
+    def test_history_contexts_bounded(self):
+        stream = EventStream(max_contexts=2)
+        stream.publish(ServerEventKind.CONTEXT_START, context_id='open')
+        for i in range(5):
+            stream.publish(ServerEventKind.CONTEXT_START, context_id=str(i))
+            stream.publish(ServerEventKind.CONTEXT_FINISH, context_id=str(i))
+        # A context that is still running is kept however long ago it
+        # started; only the last two finished contexts are.
+        self.assertEqual(
+            [(e.kind, e.context_id) for e in stream.history()],
+            [
+                (ServerEventKind.CONTEXT_START, 'open'),
+                (ServerEventKind.CONTEXT_START, '3'),
+                (ServerEventKind.CONTEXT_FINISH, '3'),
+                (ServerEventKind.CONTEXT_START, '4'),
+                (ServerEventKind.CONTEXT_FINISH, '4'),
+            ])
+        self.assertEqual(
+            [e.context_id for e in stream.history(after=9)], ['4', '4'])
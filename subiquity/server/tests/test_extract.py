@@ -0,0 +1,243 @@
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import errno
+import os
+from unittest import mock
+
+from subiquitycore.tests import SubiTestCase
+from subiquity.server.extract import (
+    ExtractCancelled,
+    ExtractError,
+    ParallelExtractor,
+    )
+
+
+class _OtherDevice:
+    """A stat result for something on another filesystem."""
+
+    def __init__(self, st):
+        self._st = st
+
+    def __getattr__(self, name):
+        return getattr(self._st, name)
+
+    @property
+    def st_dev(self):
+        return self._st.st_dev + 1
+
+
+class _Entry:
+
+    def __init__(self, entry, other_device):
+        self._entry = entry
+        self._other_device = other_device
+        self.name = entry.name
+
+    def stat(self, follow_symlinks=True):
+        st = self._entry.stat(follow_symlinks=follow_symlinks)
+        if self._other_device:
+            st = _OtherDevice(st)
+        return st
+
+
+def scandir_with_mounts(mounts):
+    """Return an os.scandir that reports the directories in mounts as
+    being on another filesystem."""
+    real_scandir = os.scandir
+
+    @contextlib.contextmanager
+    def scandir(path):
+        with real_scandir(path) as it:
+            yield [_Entry(e, e.path in mounts) for e in it]
+
+    return scandir
+
+
+class TestParallelExtractor(SubiTestCase):
+
+    def setUp(self):
+        self.source = self.tmp_dir()
+        self.target = self.tmp_dir()
+
+    def make_file(self, rel, content=b'', mode=0o644):
+        path = os.path.join(self.source, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fp:
+            fp.write(content)
+        os.chmod(path, mode)
+        return path
+
+    def extractor(self, **kw):
+        kw.setdefault('threads', 4)
+        extractor = ParallelExtractor(self.source, self.target, **kw)
+        # Make the copies take several reads.
+        extractor.buffer_size = 4096
+        return extractor
+
+    def assertSameTree(self):
+        for dirpath, dirnames, filenames in os.walk(self.source):
+            rel = os.path.relpath(dirpath, self.source)
+            tdir = os.path.normpath(os.path.join(self.target, rel))
+            self.assertEqual(
+                sorted(dirnames + filenames),
+                sorted(os.listdir(tdir)))
+            for name in dirnames + filenames + ['.']:
+                src = os.path.join(dirpath, name)
+                dst = os.path.join(tdir, name)
+                sst = os.lstat(src)
+                dst_st = os.lstat(dst)
+                self.assertEqual(sst.st_mode, dst_st.st_mode, src)
+                self.assertEqual(sst.st_mtime_ns, dst_st.st_mtime_ns, src)
+                self.assertEqual(
+                    (sst.st_uid, sst.st_gid), (dst_st.st_uid, dst_st.st_gid))
+                if os.path.islink(src):
+                    self.assertEqual(os.readlink(src), os.readlink(dst))
+                elif os.path.isfile(src):
+                    with open(src, 'rb') as a, open(dst, 'rb') as b:
+                        self.assertEqual(a.read(), b.read(), src)
+
+    def test_copy(self):
+        self.make_file('etc/hostname', b'ubuntu\n')
+        self.make_file('usr/bin/sudo', os.urandom(10000), mode=0o4755)
+        self.make_file('usr/share/doc/empty')
+        self.make_file('var/lib/secret', b'x', mode=0o600)
+        os.symlink('usr/bin', os.path.join(self.source, 'bin'))
+        os.symlink('missing', os.path.join(self.source, 'etc/dangling'))
+        os.mkfifo(os.path.join(self.source, 'var/fifo'))
+        os.chmod(os.path.join(self.source, 'var/lib'), 0o700)
+        os.utime(os.path.join(self.source, 'etc'), ns=(1, 10**18))
+
+        result = self.extractor().run()
+
+        self.assertSameTree()
+        self.assertEqual(result.total_files, 4)
+        self.assertEqual(result.files, 4)
+        self.assertEqual(result.total_bytes, 10008)
+        self.assertEqual(result.bytes, 10008)
+        self.assertEqual(result.percent, 100)
+
+    def test_hardlinks(self):
+        a = self.make_file('a/file', b'content')
+        os.makedirs(os.path.join(self.source, 'b'))
+        os.link(a, os.path.join(self.source, 'b/file'))
+
+        result = self.extractor().run()
+
+        self.assertSameTree()
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.target, 'a/file'),
+            os.path.join(self.target, 'b/file')))
+        self.assertEqual((result.files, result.bytes), (2, 7))
+
+    def test_overwrites_target(self):
+        self.make_file('etc/hostname', b'ubuntu\n')
+        os.makedirs(os.path.join(self.target, 'etc'))
+        with open(os.path.join(self.target, 'etc/hostname'), 'w') as fp:
+            fp.write('something much longer than the source\n')
+        # A mount point made before the extract is left alone.
+        os.makedirs(os.path.join(self.target, 'boot'))
+
+        self.extractor().run()
+
+        with open(os.path.join(self.target, 'etc/hostname')) as fp:
+            self.assertEqual(fp.read(), 'ubuntu\n')
+        self.assertTrue(os.path.isdir(os.path.join(self.target, 'boot')))
+
+    def test_sparse(self):
+        path = self.make_file('sparse')
+        size = 4 * 2**20
+        with open(path, 'r+b') as fp:
+            fp.seek(2**20)
+            fp.write(b'data')
+            fp.truncate(size)
+        if os.stat(path).st_blocks * 512 >= size:
+            self.skipTest("filesystem does not make sparse files")
+
+        result = self.extractor().run()
+
+        self.assertSameTree()
+        dst = os.stat(os.path.join(self.target, 'sparse'))
+        self.assertEqual(dst.st_size, size)
+        self.assertLess(dst.st_blocks * 512, size)
+        self.assertEqual(result.bytes, size)
+
+    def test_other_filesystems_not_copied(self):
+        self.make_file('etc/hostname', b'ubuntu\n')
+        self.make_file('cdrom/casper/filesystem.squashfs', b'x' * 100)
+        mounts = {os.path.join(self.source, 'cdrom')}
+
+        with mock.patch('os.scandir', scandir_with_mounts(mounts)):
+            result = self.extractor().run()
+
+        self.assertEqual(os.listdir(os.path.join(self.target, 'cdrom')), [])
+        with open(os.path.join(self.target, 'etc/hostname')) as fp:
+            self.assertEqual(fp.read(), 'ubuntu\n')
+        self.assertEqual((result.files, result.bytes), (1, 7))
+
+    def test_xattrs(self):
+        path = self.make_file('file', b'x')
+        try:
+            os.setxattr(path, 'user.subiquity', b'value')
+        except OSError as exc:
+            if exc.errno in (errno.ENOTSUP, errno.EOPNOTSUPP):
+                self.skipTest("filesystem does not support user xattrs")
+            raise
+
+        self.extractor().run()
+
+        self.assertEqual(
+            os.getxattr(os.path.join(self.target, 'file'), 'user.subiquity'),
+            b'value')
+
+    def test_copy_file_range_unsupported(self):
+        self.make_file('file', os.urandom(10000))
+        with mock.patch('os.copy_file_range',
+                        side_effect=OSError(errno.EXDEV, 'cross device')):
+            self.extractor().run()
+        self.assertSameTree()
+
+    def test_verify(self):
+        self.make_file('file', os.urandom(10000))
+        self.extractor(verify=True).run()
+        self.assertSameTree()
+
+    def test_verify_mismatch(self):
+        self.make_file('file', b'content')
+        extractor = self.extractor(verify=True)
+        extractor._hash_file = mock.Mock(return_value='0' * 64)
+        with self.assertRaises(ExtractError):
+            extractor.run()
+
+    def test_progress(self):
+        for i in range(10):
+            self.make_file(f'dir/{i}', b'x' * 1000)
+        reports = []
+        self.extractor(progress=reports.append, progress_interval=0).run()
+        self.assertEqual(
+            [(p.files, p.bytes) for p in reports[-1:]], [(10, 10000)])
+        for p in reports:
+            self.assertEqual((p.total_files, p.total_bytes), (10, 10000))
+        self.assertEqual(
+            [p.bytes for p in reports], sorted(p.bytes for p in reports))
+        self.assertTrue(reports[-1].describe().startswith('100% copied'))
+
+    def test_cancel(self):
+        self.make_file('file', b'content')
+        extractor = self.extractor()
+        extractor.cancel()
+        with self.assertRaises(ExtractCancelled):
+            extractor.run()
@@ -15,10 +15,14 @@
 
 import os
 import shlex
-from unittest.mock import Mock
+from unittest.mock import AsyncMock, Mock, patch
 
 from subiquitycore.utils import run_command
 from subiquitycore.tests import SubiTestCase
+from subiquity.common.types import (
+    ApplicationState,
+    ServerEventKind,
+    )
 from subiquity.server.server import (
     SubiquityServer,
     cloud_autoinstall_path,
@@ -121,3 +125,57 @@ early-commands: ["{cmd}"]
                        'early-commands': [cmd],
                        'stuff': 'things'}
         self.assertEqual(after_early, self.server.autoinstall_config)
+
+
+class TestEventStream(SubiTestCase):
+    async def asyncSetUp(self):
+        opts = Mock()
+        opts.dry_run = True
+        opts.output_base = self.tmp_dir()
+        opts.machine_config = 'examples/simple.json'
+        self.server = SubiquityServer(opts, None)
+
+    async def test_update_state_publishes_status(self):
+        events = self.server.event_stream.subscribe()
+        event = await events.__anext__()
+        self.assertEqual(event.kind, ServerEventKind.STATUS)
+        self.assertEqual(event.status.state, ApplicationState.STARTING_UP)
+        self.server.update_state(ApplicationState.WAITING)
+        event = await events.__anext__()
+        self.assertEqual(event.status, self.server.application_status())
+        await events.aclose()
+
+    async def test_context_events(self):
+        context = self.server.context.child('install')
+        context.set('is-install-context', True)
+        for journal_events in True, False:
+            self.server.journal_events = journal_events
+            with patch('subiquity.server.server.journal') as journal:
+                with context.child('step', 'doing a step'):
+                    pass
+            self.assertEqual(journal.send.called, journal_events)
+        kinds = [e.kind for e in self.server.event_stream.history()]
+        self.assertEqual(kinds, [
+            ServerEventKind.STATUS,
+            ServerEventKind.CONTEXT_START,
+            ServerEventKind.CONTEXT_FINISH,
+            ServerEventKind.CONTEXT_START,
+            ServerEventKind.CONTEXT_FINISH,
+            ])
+
+
+class TestShutdown(SubiTestCase):
+    async def asyncSetUp(self):
+        opts = Mock()
+        opts.dry_run = True
+        opts.output_base = self.tmp_dir()
+        opts.machine_config = 'examples/simple.json'
+        self.server = SubiquityServer(opts, None)
+
+    async def test_run_closes_snapd(self):
+        self.server.snapd = Mock(close=AsyncMock())
+        with patch.object(self.server, 'make_model'), \
+                patch.object(self.server, 'start', AsyncMock()):
+            self.server.exit()
+            await self.server.run()
+        self.server.snapd.close.assert_awaited_once_with()
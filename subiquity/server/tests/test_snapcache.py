@@ -0,0 +1,85 @@
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+from unittest import mock
+
+from subiquitycore.tests import SubiTestCase
+from subiquity.server.snapcache import SnapdResponseCache
+
+
+class TestSnapdResponseCache(SubiTestCase):
+
+    def setUp(self):
+        self.cache = SnapdResponseCache(self.tmp_dir(), ttl=60)
+
+    def test_missing(self):
+        self.assertIsNone(self.cache.lookup('v2/find', section='server'))
+
+    def test_round_trip(self):
+        etag = self.cache.store('v2/find', {'result': [1]}, section='server')
+        self.assertTrue(os.path.exists(os.path.join(
+            self.cache.directory, 'v2-find-section=server.json')))
+        cached = self.cache.lookup('v2/find', section='server')
+        self.assertEqual(cached.data, {'result': [1]})
+        self.assertEqual(cached.etag, etag)
+        self.assertTrue(cached.fresh)
+        self.assertIsNone(self.cache.lookup('v2/find', section='other'))
+
+    def test_etag_depends_on_content(self):
+        etag1 = self.cache.store('v2/find', {'result': [1]}, name='a')
+        etag2 = self.cache.store('v2/find', {'result': [1]}, name='b')
+        etag3 = self.cache.store('v2/find', {'result': [2]}, name='a')
+        self.assertEqual(etag1, etag2)
+        self.assertNotEqual(etag1, etag3)
+
+    def test_stale(self):
+        with mock.patch('subiquity.server.snapcache.time.time') as m_time:
+            m_time.return_value = 1000
+            self.cache.store('v2/find', {'result': []}, section='server')
+            m_time.return_value = 1061
+            cached = self.cache.lookup('v2/find', section='server')
+        self.assertFalse(cached.fresh)
+        self.assertEqual(cached.data, {'result': []})
+
+    def test_corrupt(self):
+        self.cache.store('v2/find', {'result': [1]}, section='server')
+        path = os.path.join(
+            self.cache.directory, 'v2-find-section=server.json')
+        with open(path) as fp:
+            content = fp.read()
+        with open(path, 'w') as fp:
+            fp.write(content.replace('[1]', '[2]'))
+        self.assertIsNone(self.cache.lookup('v2/find', section='server'))
+        with open(path, 'w') as fp:
+            fp.write(content[:10])
+        self.assertIsNone(self.cache.lookup('v2/find', section='server'))
+
+    def test_bad_stored_time(self):
+        self.cache.store('v2/find', {'result': [1]}, section='server')
+        path = os.path.join(
+            self.cache.directory, 'v2-find-section=server.json')
+        with open(path) as fp:
+            entry = json.load(fp)
+        for stored in 'yesterday', None:
+            entry['stored'] = stored
+            with open(path, 'w') as fp:
+                json.dump(entry, fp)
+            self.assertIsNone(self.cache.lookup('v2/find', section='server'))
+        del entry['stored']
+        with open(path, 'w') as fp:
+            json.dump(entry, fp)
+        self.assertIsNone(self.cache.lookup('v2/find', section='server'))
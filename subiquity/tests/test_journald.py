@@ -0,0 +1,149 @@
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+
+from subiquitycore.tests import SubiTestCase
+from subiquity.journald import (
+    journal,
+    JournalListener,
+    )
+
+
+class FakeReader:
+
+    def __init__(self, test):
+        r, w = os.pipe()
+        test.addCleanup(os.close, r)
+        test.addCleanup(os.close, w)
+        self._fd = r
+        self.entries = []
+        self._current = None
+
+    def fileno(self):
+        return self._fd
+
+    def process(self):
+        return journal.APPEND
+
+    def get_next(self):
+        if not self.entries:
+            return {}
+        return self.entries.pop(0)
+
+    def _next(self):
+        if not self.entries:
+            return False
+        self._current = self.entries.pop(0)
+        return True
+
+    def _get(self, field):
+        return self._current[field]
+
+    def _convert_field(self, field, value):
+        return value
+
+
+class PublicReader(FakeReader):
+    """A reader without the private methods of systemd.journal.Reader."""
+
+    def __getattribute__(self, name):
+        if name in ('_next', '_get', '_convert_field'):
+            raise AttributeError(name)
+        return super().__getattribute__(name)
+
+
+class TestJournalListener(SubiTestCase):
+
+    async def test_batches(self):
+        reader = FakeReader(self)
+        seen = []
+        listener = JournalListener(
+            asyncio.get_running_loop(), reader, seen.append,
+            batch_size=2, time_slice=10)
+        self.addCleanup(listener.close)
+        reader.entries = [{'MESSAGE': str(i)} for i in range(5)]
+        listener._watch()
+        self.assertEqual(len(seen), 2)
+        self.assertEqual(listener.backlog, 3)
+        self.assertEqual(listener.max_backlog, 5)
+        await asyncio.sleep(0)
+        self.assertEqual(len(seen), 4)
+        await asyncio.sleep(0)
+        self.assertEqual([e['MESSAGE'] for e in seen], list('01234'))
+        self.assertEqual(listener.backlog, 0)
+
+    async def test_time_slice(self):
+        reader = FakeReader(self)
+        seen = []
+        listener = JournalListener(
+            asyncio.get_running_loop(), reader, seen.append,
+            batch_size=100, time_slice=0)
+        self.addCleanup(listener.close)
+        reader.entries = [{'MESSAGE': str(i)} for i in range(3)]
+        listener._watch()
+        self.assertEqual(len(seen), 1)
+        await asyncio.sleep(0)
+        self.assertEqual(len(seen), 2)
+
+    async def test_fields(self):
+        reader = FakeReader(self)
+        seen = []
+        listener = JournalListener(
+            asyncio.get_running_loop(), reader, seen.append,
+            fields=('MESSAGE', 'MISSING'))
+        self.addCleanup(listener.close)
+        reader.entries = [{'MESSAGE': 'hi', 'OTHER': 'x'}]
+        listener._watch()
+        self.assertEqual(seen, [{'MESSAGE': 'hi'}])
+
+    async def test_fields_entry_without_fields(self):
+        reader = FakeReader(self)
+        seen = []
+        listener = JournalListener(
+            asyncio.get_running_loop(), reader, seen.append,
+            fields=('MESSAGE',))
+        self.addCleanup(listener.close)
+        reader.entries = [{'OTHER': 'x'}, {'MESSAGE': 'hi'}]
+        listener._watch()
+        # An entry with none of the fields does not end the read.
+        self.assertEqual(seen, [{}, {'MESSAGE': 'hi'}])
+
+    async def test_fields_without_private_methods(self):
+        reader = PublicReader(self)
+        seen = []
+        listener = JournalListener(
+            asyncio.get_running_loop(), reader, seen.append,
+            fields=('MESSAGE', 'MISSING'))
+        self.addCleanup(listener.close)
+        reader.entries = [
+            {'MESSAGE': 'hi', 'OTHER': 'x'}, {'OTHER': 'y'},
+            {'MESSAGE': 'there'},
+            ]
+        listener._watch()
+        self.assertEqual(seen, [{'MESSAGE': 'hi'}, {}, {'MESSAGE': 'there'}])
+
+    async def test_close_drops_backlog(self):
+        reader = FakeReader(self)
+        seen = []
+        listener = JournalListener(
+            asyncio.get_running_loop(), reader, seen.append, batch_size=1)
+        reader.entries = [{'MESSAGE': str(i)} for i in range(3)]
+        listener._watch()
+        listener.close()
+        await asyncio.sleep(0)
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(listener.backlog, 0)
@@ -203,6 +203,7 @@ class BaseNetworkController(BaseController):
                 dev.remove_ip_networks_for_version(6)
                 log.debug("disabling %s", dev.name)
                 dev.disabled_reason = _("autoconfiguration failed")
+        self.model.generation += 1
 
     @property
     def netplan_path(self):
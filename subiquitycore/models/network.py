@@ -302,6 +302,7 @@ class NetworkDev(object):
 
     def set_dhcp_state(self, version, state):
         self._dhcp_state[version] = state
+        self._model.generation += 1
 
     @property
     def name(self):
@@ -325,6 +326,7 @@ class NetworkDev(object):
                 dead_device.info = self.info
                 self.info = None
         self._name = new_name
+        self._model.generation += 1
 
     def supports_action(self, action):
         return getattr(self, "_supports_" + action.name)
@@ -417,6 +419,9 @@ class NetworkModel(object):
         self.devices_by_name = {}  # Maps interface names to NetworkDev
         self._has_network = False
         self.project = project
+        # Incremented whenever the model changes, so that a client can
+        # cheaply tell whether anything has changed since it last looked.
+        self.generation = 0
 
     @property
     def has_network(self):
@@ -426,6 +431,7 @@ class NetworkModel(object):
     def has_network(self, val):
         log.debug('has_network %s', val)
         self._has_network = val
+        self.generation += 1
 
     def parse_netplan_configs(self, netplan_root):
         self.config = netplan.Config()
@@ -467,11 +473,13 @@ class NetworkModel(object):
                       ifindex, link.name,
                       netplan.sanitize_interface_config(dev.config))
             self.devices_by_name[link.name] = dev
+        self.generation += 1
         return dev
 
     def update_link(self, ifindex):
         for name, dev in self.devices_by_name.items():
             if dev.ifindex == ifindex:
+                self.generation += 1
                 return dev
 
     def del_link(self, ifindex):
@@ -488,6 +496,7 @@ class NetworkModel(object):
                 else:
                     # If a physical interface disappears on us, it's gone.
                     del self.devices_by_name[name]
+                self.generation += 1
                 return dev
 
     def new_vlan(self, device_name, tag):
@@ -497,11 +506,13 @@ class NetworkModel(object):
             'link': device_name,
             'id': tag,
             }
+        self.generation += 1
         return dev
 
     def new_bond(self, name, bond_config):
         dev = self.devices_by_name[name] = NetworkDev(self, name, 'bond')
         dev.config = bond_config.to_config()
+        self.generation += 1
         return dev
 
     def get_all_netdevs(self, include_deleted=False):
@@ -13,7 +13,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from subiquitycore.models.network import NetworkDev
+from subiquitycore.models.network import (
+    BondConfig,
+    DHCPState,
+    NetworkDev,
+    NetworkModel,
+    )
 from subiquitycore.tests import SubiTestCase
 
 
@@ -39,3 +44,18 @@ class TestRouteManagement(SubiTestCase):
         self.nd.remove_routes(6)
         expected = self.ipv4s
         self.assertEqual(expected, self.nd.config['routes'])
+
+
+class TestGeneration(SubiTestCase):
+    def test_changes_bump_generation(self):
+        model = NetworkModel('test')
+        gen = model.generation
+        dev = model.new_bond(
+            'bond0', BondConfig(interfaces=[], mode='active-backup'))
+        self.assertGreater(model.generation, gen)
+        gen = model.generation
+        dev.set_dhcp_state(4, DHCPState.PENDING)
+        self.assertGreater(model.generation, gen)
+        gen = model.generation
+        model.has_network = True
+        self.assertGreater(model.generation, gen)
@@ -13,7 +13,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import json
 import logging
+import os
+import re
 import time
 import yaml
 
@@ -25,6 +29,38 @@ from probert.network import (
 log = logging.getLogger('subiquitycore.prober')
 
 
+def _unescape_mountinfo(field):
+    return re.sub(
+        r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+
+def mount_state(mountinfo_path='/proc/self/mountinfo'):
+    """Return a string describing what is mounted and how full the
+    mounted block device filesystems are.
+
+    The mount and filesystem_sizing probes depend on these, and udev does
+    not hear about either changing.
+    """
+    with open(mountinfo_path) as fp:
+        mountinfo = fp.read()
+    state = [mountinfo]
+    for line in mountinfo.splitlines():
+        fields = line.split()
+        try:
+            source = fields[fields.index('-') + 2]
+        except (ValueError, IndexError):
+            continue
+        if not source.startswith('/dev/'):
+            continue
+        mountpoint = _unescape_mountinfo(fields[4])
+        try:
+            st = os.statvfs(mountpoint)
+        except OSError:
+            continue
+        state.append('{}={},{}'.format(mountpoint, st.f_bfree, st.f_ffree))
+    return '\0'.join(state)
+
+
 class Prober():
     def __init__(self, machine_config, debug_flags):
         self.saved_config = None
@@ -57,3 +93,36 @@ class Prober():
             return r
         from probert.storage import Storage
         return Storage().probe(probe_types=probe_types)
+
+    def count_block_devices(self):
+        if self.saved_config is not None:
+            return len(self.saved_config['storage'].get('blockdev', {}))
+        import pyudev
+        context = pyudev.Context()
+        return sum(1 for device in context.list_devices(subsystem='block'))
+
+    def storage_fingerprint(self, probe_types=None):
+        """Return a string that changes whenever the block device state
+        get_storage(probe_types) would report on might have changed, or
+        None if that cannot be told."""
+        h = hashlib.sha256()
+        h.update(repr(sorted(probe_types or ())).encode('utf-8'))
+        if self.saved_config is not None:
+            h.update(json.dumps(
+                self.saved_config['storage'], sort_keys=True).encode('utf-8'))
+            return h.hexdigest()
+        import pyudev
+        context = pyudev.Context()
+        devices = sorted(
+            context.list_devices(subsystem='block'), key=lambda d: d.sys_path)
+        for device in devices:
+            h.update(device.sys_path.encode('utf-8'))
+            for key, value in sorted(device.properties.items()):
+                h.update('\0{}={}'.format(key, value).encode('utf-8'))
+            h.update(b'\0' + (device.attributes.get('size') or b''))
+        try:
+            h.update(mount_state().encode('utf-8'))
+        except OSError:
+            log.exception("could not read the mount table")
+            return None
+        return h.hexdigest()
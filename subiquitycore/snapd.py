@@ -14,6 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
+import datetime
 from functools import partial
 import glob
 import json
@@ -28,12 +29,16 @@ from urllib.parse import (
 from subiquitycore.async_helpers import run_in_thread
 from subiquitycore.utils import run_command
 
+import aiohttp
+import requests
 import requests_unixsocket
 
 
 log = logging.getLogger('subiquitycore.snapd')
 
-# Every method in this module blocks. Do not call them from the main thread!
+# The methods of the connection classes in this module other than
+# AsyncSnapdConnection and ThreadedSnapdConnection block. Do not call
+# them from the main thread!
 
 
 class SnapdConnection:
@@ -73,6 +78,95 @@ class SnapdConnection:
             run_command(cmd)
 
 
+class AsyncSnapdConnection:
+    """Talk to snapd with aiohttp, reusing connections to the socket.
+
+    At most max_connections requests are made at once.  Errors are
+    raised as the requests exceptions SnapdConnection's responses raise
+    so that callers do not need to care which connection is in use.
+    """
+
+    def __init__(self, root, sock, *, max_connections=8):
+        self.root = root
+        self.sock = sock
+        self.max_connections = max_connections
+        self._session = None
+        self._session_stale = False
+
+    async def _get_session(self):
+        if self._session_stale:
+            # snapd has been restarted, so any kept alive connections
+            # are dead.
+            self._session_stale = False
+            if self._session is not None:
+                await self._session.close()
+                self._session = None
+        if self._session is None:
+            connector = aiohttp.UnixConnector(
+                path=self.sock, limit=self.max_connections)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=60))
+        return self._session
+
+    async def _request(self, method, path, body=None, **args):
+        session = await self._get_session()
+        url = 'http://localhost/' + path
+        try:
+            async with session.request(
+                    method, url, params=args or None,
+                    data=None if body is None else json.dumps(body)) as resp:
+                content = await resp.text()
+                if resp.status >= 400:
+                    raise requests.exceptions.HTTPError(
+                        "{} {} for {}".format(resp.status, resp.reason, path))
+                return json.loads(content)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            raise requests.exceptions.ConnectionError(str(exc)) from exc
+
+    async def get(self, path, **args):
+        return await self._request('GET', path, **args)
+
+    async def post(self, path, body, **args):
+        return await self._request('POST', path, body, **args)
+
+    def configure_proxy(self, proxy):
+        SnapdConnection.configure_proxy(self, proxy)
+        self._session_stale = True
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class ThreadedSnapdConnection:
+    """Give a blocking connection, such as SnapdConnection or
+    FakeSnapdConnection, the interface of AsyncSnapdConnection by making
+    its requests in a thread."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def get(self, path, **args):
+        response = await run_in_thread(
+            partial(self.connection.get, path, **args))
+        response.raise_for_status()
+        return response.json()
+
+    async def post(self, path, body, **args):
+        response = await run_in_thread(
+            partial(self.connection.post, path, body, **args))
+        response.raise_for_status()
+        return response.json()
+
+    def configure_proxy(self, proxy):
+        self.connection.configure_proxy(proxy)
+
+    async def close(self):
+        pass
+
+
 class _FakeFileResponse:
 
     def __init__(self, path):
@@ -125,6 +219,7 @@ class FakeSnapdConnection:
         self.scale_factor = scale_factor
         self.response_sets = {}
         self.output_base = output_base
+        self.notice_count = 0
 
     def configure_proxy(self, proxy):
         log.debug("pretending to restart snapd to pick up proxy config")
@@ -165,6 +260,21 @@ class FakeSnapdConnection:
             "Don't know how to fake POST response to {}".format((path, args)))
 
     def get(self, path, **args):
+        if path == 'v2/notices':
+            # Pretend that whatever is being waited for has just changed.
+            self.notice_count += 1
+            now = datetime.datetime.now(datetime.timezone.utc)
+            return _FakeMemoryResponse({
+                "type": "sync",
+                "status-code": 200,
+                "status": "OK",
+                "result": [{
+                    "id": str(self.notice_count),
+                    "type": args['types'],
+                    "key": args['keys'],
+                    "last-occurred": now.isoformat(),
+                    }],
+                })
         if 'change' not in path:
             time.sleep(1/self.scale_factor)
         filename = path.replace('/', '-')
@@ -194,26 +304,72 @@ def get_fake_connection(scale_factor=1000, output_base=None):
 
 class AsyncSnapd:
 
-    def __init__(self, connection):
+    # Without notices, a change is polled after min_poll_interval and
+    # then at doubling intervals up to max_poll_interval.
+    min_poll_interval = 0.1
+    max_poll_interval = 2.0
+    # How long each long-poll of v2/notices lasts (snapd 2.61 and later).
+    notice_timeout = 10
+
+    def __init__(self, connection, *, use_notices=False):
+        # connection is an AsyncSnapdConnection or a blocking connection
+        # wrapped in a ThreadedSnapdConnection.
         self.connection = connection
+        self.use_notices = use_notices
+        self._change_waits = {}
 
     async def get(self, path, **args):
-        response = await run_in_thread(
-            partial(self.connection.get, path, **args))
-        response.raise_for_status()
-        return response.json()
+        return await self.connection.get(path, **args)
 
     async def post(self, path, body, **args):
-        response = await run_in_thread(
-            partial(self.connection.post, path, body, **args))
-        response.raise_for_status()
-        return response.json()
+        return await self.connection.post(path, body, **args)
+
+    async def close(self):
+        await self.connection.close()
+
+    async def _wait_notice(self, change_id, after):
+        args = {
+            'types': 'change-update',
+            'keys': change_id,
+            'timeout': '{}s'.format(self.notice_timeout),
+            }
+        if after is not None:
+            args['after'] = after
+        notices = (await self.get('v2/notices', **args))['result']
+        if notices:
+            return notices[-1]['last-occurred']
+        return after
+
+    async def _poll_change(self, change_id):
+        change_path = 'v2/changes/{}'.format(change_id)
+        interval = self.min_poll_interval
+        after = None
+        while True:
+            change = (await self.get(change_path))['result']
+            if change['ready']:
+                return change
+            if self.use_notices:
+                try:
+                    after = await self._wait_notice(change_id, after)
+                    continue
+                except requests.exceptions.HTTPError:
+                    log.debug("snapd does not support notices, polling")
+                    self.use_notices = False
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+
+    async def wait_change(self, change_id):
+        """Wait for a change to be ready and return it.
+
+        Everyone waiting for the same change shares one poller."""
+        task = self._change_waits.get(change_id)
+        if task is None:
+            task = asyncio.create_task(self._poll_change(change_id))
+            self._change_waits[change_id] = task
+            task.add_done_callback(
+                lambda t: self._change_waits.pop(change_id, None))
+        return await asyncio.shield(task)
 
     async def post_and_wait(self, path, body, **args):
         change = (await self.post(path, body, **args))['change']
-        change_path = 'v2/changes/{}'.format(change)
-        while True:
-            result = await self.get(change_path)
-            if result["result"]["status"] == "Done":
-                break
-            await asyncio.sleep(0.1)
+        return await self.wait_change(change)
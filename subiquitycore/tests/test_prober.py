@@ -13,9 +13,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+from unittest import mock
+
 from subiquitycore.tests import SubiTestCase
 
-from subiquitycore.prober import Prober
+from subiquitycore.prober import mount_state, Prober
 
 
 class TestProber(SubiTestCase):
@@ -25,3 +28,44 @@ class TestProber(SubiTestCase):
         none_storage = prober.get_storage(probe_types=None)
         defaults_storage = prober.get_storage(probe_types={'defaults'})
         self.assertEqual(defaults_storage, none_storage)
+
+    def test_storage_fingerprint(self):
+        with open('examples/simple.json', 'r') as fp:
+            prober = Prober(machine_config=fp, debug_flags=())
+        restricted = prober.storage_fingerprint({'blockdev'})
+        self.assertEqual(restricted, prober.storage_fingerprint({'blockdev'}))
+        self.assertNotEqual(
+            restricted, prober.storage_fingerprint({'defaults'}))
+        with open('examples/win10.json', 'r') as fp:
+            other = Prober(machine_config=fp, debug_flags=())
+        self.assertNotEqual(
+            restricted, other.storage_fingerprint({'blockdev'}))
+
+    def test_count_block_devices(self):
+        with open('examples/simple.json', 'r') as fp:
+            prober = Prober(machine_config=fp, debug_flags=())
+        self.assertEqual(
+            len(prober.saved_config['storage']['blockdev']),
+            prober.count_block_devices())
+
+    def test_mount_state(self):
+        mountpoint = os.path.join(self.tmp_dir(), 'a dir')
+        os.mkdir(mountpoint)
+        escaped = mountpoint.replace(' ', '\\040')
+        mountinfo = os.path.join(self.tmp_dir(), 'mountinfo')
+        with open(mountinfo, 'w') as fp:
+            fp.write(
+                f"30 1 8:1 / {escaped} rw - ext4 /dev/sda1 rw\n"
+                "31 1 0:5 / /proc rw - proc proc rw\n")
+        statvfs = mock.Mock(f_bfree=10, f_ffree=20)
+        with mock.patch('os.statvfs', return_value=statvfs) as m_statvfs:
+            before = mount_state(mountinfo)
+            # Writing to a mounted filesystem changes the state.
+            statvfs.f_bfree = 9
+            after = mount_state(mountinfo)
+        m_statvfs.assert_called_with(mountpoint)
+        self.assertEqual(m_statvfs.call_count, 2)
+        self.assertNotEqual(before, after)
+        with open(mountinfo, 'a') as fp:
+            fp.write("32 1 8:2 / /mnt rw - ext4 /dev/sda2 rw\n")
+        self.assertNotEqual(after, mount_state(mountinfo))
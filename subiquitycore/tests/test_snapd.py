@@ -0,0 +1,204 @@
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+from unittest import mock
+
+from aiohttp import web
+import requests
+
+from subiquitycore.snapd import (
+    AsyncSnapd,
+    AsyncSnapdConnection,
+    get_fake_connection,
+    ThreadedSnapdConnection,
+    )
+from subiquitycore.tests import SubiTestCase
+
+
+class TestWaitChange(SubiTestCase):
+
+    def setUp(self):
+        # Replay every response the fake has for a change.
+        patcher = mock.patch.dict(
+            os.environ, {'SUBIQUITY_REPLAY_TIMESCALE': '1'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connection = get_fake_connection(
+            output_base=self.tmp_dir())
+        self.connection.get = mock.Mock(wraps=self.connection.get)
+
+    def paths_requested(self):
+        return [c.args[0] for c in self.connection.get.call_args_list]
+
+    async def test_backoff(self):
+        snapd = AsyncSnapd(ThreadedSnapdConnection(self.connection))
+        snapd.min_poll_interval = 0.001
+        snapd.max_poll_interval = 0.004
+        sleeps = []
+        real_sleep = asyncio.sleep
+
+        async def sleep(interval):
+            sleeps.append(interval)
+            await real_sleep(0)
+
+        with mock.patch('subiquitycore.snapd.asyncio.sleep', sleep):
+            change = await snapd.wait_change('6')
+        self.assertTrue(change['ready'])
+        self.assertEqual(change['status'], 'Done')
+        self.assertEqual(sleeps[:4], [0.001, 0.002, 0.004, 0.004])
+        self.assertEqual(len(sleeps), len(self.paths_requested()) - 1)
+
+    async def test_shared_poller(self):
+        snapd = AsyncSnapd(ThreadedSnapdConnection(self.connection))
+        snapd.min_poll_interval = snapd.max_poll_interval = 0.001
+        changes = await asyncio.gather(
+            snapd.wait_change('6'), snapd.wait_change('6'))
+        self.assertEqual(changes[0], changes[1])
+        # The second waiter did not cause any more requests.
+        fake = get_fake_connection(output_base=self.tmp_dir())
+        fake.get = mock.Mock(wraps=fake.get)
+        alone = AsyncSnapd(ThreadedSnapdConnection(fake))
+        alone.min_poll_interval = alone.max_poll_interval = 0.001
+        await alone.wait_change('6')
+        self.assertEqual(
+            len(self.paths_requested()),
+            len(fake.get.call_args_list))
+        self.assertEqual(snapd._change_waits, {})
+
+    async def test_error_is_ready(self):
+        snapd = AsyncSnapd(ThreadedSnapdConnection(self.connection))
+        snapd.min_poll_interval = snapd.max_poll_interval = 0.001
+        change = await snapd.wait_change('15')
+        self.assertEqual(change['status'], 'Error')
+
+    async def test_notices(self):
+        snapd = AsyncSnapd(
+            ThreadedSnapdConnection(self.connection), use_notices=True)
+        with mock.patch('subiquitycore.snapd.asyncio.sleep') as sleep:
+            change = await snapd.wait_change('6')
+        self.assertEqual(change['status'], 'Done')
+        sleep.assert_not_called()
+        paths = self.paths_requested()
+        self.assertEqual(
+            paths[:3], ['v2/changes/6', 'v2/notices', 'v2/changes/6'])
+        first, second = [
+            c.kwargs for c in self.connection.get.call_args_list
+            if c.args[0] == 'v2/notices'][:2]
+        self.assertEqual(first['keys'], '6')
+        self.assertNotIn('after', first)
+        self.assertIn('after', second)
+
+    async def test_notices_unsupported(self):
+        snapd = AsyncSnapd(
+            ThreadedSnapdConnection(self.connection), use_notices=True)
+        snapd.min_poll_interval = snapd.max_poll_interval = 0.001
+        real_get = self.connection.get
+
+        def get(path, **args):
+            if path == 'v2/notices':
+                raise requests.exceptions.HTTPError('404')
+            return real_get(path, **args)
+
+        self.connection.get = get
+        change = await snapd.wait_change('6')
+        self.assertEqual(change['status'], 'Done')
+        self.assertFalse(snapd.use_notices)
+
+
+class TestAsyncSnapdConnection(SubiTestCase):
+
+    async def asyncSetUp(self):
+        self.peers = set()
+        self.in_flight = self.max_in_flight = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+        async def handler(request):
+            self.peers.add(id(request.transport))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                await self.release.wait()
+            finally:
+                self.in_flight -= 1
+            if request.path == '/v2/missing':
+                return web.json_response({'type': 'error'}, status=404)
+            body = None
+            if request.method == 'POST':
+                body = await request.json()
+            return web.json_response({
+                'type': 'sync',
+                'result': {
+                    'path': request.path,
+                    'query': dict(request.query),
+                    'body': body,
+                    },
+                })
+
+        app = web.Application()
+        app.router.add_route('*', '/{path:.*}', handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        self.sock = os.path.join(self.tmp_dir(), 'snapd.socket')
+        await web.UnixSite(self.runner, self.sock).start()
+        self.connection = AsyncSnapdConnection(
+            self.tmp_dir(), self.sock, max_connections=2)
+
+    async def asyncTearDown(self):
+        await self.connection.close()
+        await self.runner.cleanup()
+
+    async def test_get_post(self):
+        result = await self.connection.get('v2/snaps', select='all')
+        result = result['result']
+        self.assertEqual(result['path'], '/v2/snaps')
+        self.assertEqual(result['query'], {'select': 'all'})
+        result = await self.connection.post('v2/snaps/x', {'a': 1})
+        result = result['result']
+        self.assertEqual(result['body'], {'a': 1})
+
+    async def test_keep_alive(self):
+        for i in range(3):
+            await self.connection.get('v2/snaps')
+        self.assertEqual(len(self.peers), 1)
+
+    async def test_max_connections(self):
+        self.release.clear()
+        gets = asyncio.gather(
+            *[self.connection.get('v2/snaps') for i in range(5)])
+        await asyncio.sleep(0.1)
+        self.release.set()
+        await gets
+        self.assertEqual(self.max_in_flight, 2)
+
+    async def test_http_error(self):
+        with self.assertRaises(requests.exceptions.HTTPError):
+            await self.connection.get('v2/missing')
+
+    async def test_connection_error(self):
+        connection = AsyncSnapdConnection(
+            self.tmp_dir(), os.path.join(self.tmp_dir(), 'nothing'))
+        self.addAsyncCleanup(connection.close)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            await connection.get('v2/snaps')
+
+    async def test_async_snapd(self):
+        snapd = AsyncSnapd(self.connection)
+        result = await snapd.get('v2/snaps')
+        self.assertEqual(result['result']['path'], '/v2/snaps')
+        await snapd.close()
+        self.assertIsNone(self.connection._session)
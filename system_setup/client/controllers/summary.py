@@ -49,13 +49,11 @@ class SummaryController(SubiquityTuiController):
     @with_context()
     async def _wait_status(self, context):
         install_running = None
-        while True:
-            try:
-                app_status = await self.app.client.meta.status.GET(
-                    cur=self.app_state)
-            except aiohttp.ClientError:
-                await asyncio.sleep(1)
+        app_status = None
+        async for new_status in self.app.status_changes():
+            if new_status == app_status:
                 continue
+            app_status = new_status
             self.app_state = app_status.state
 
             if self.summary_view: